@@ -1,49 +1,90 @@
 from pathlib import Path
 
 import matplotlib.pyplot as plt
-from snowflake.snowpark.functions import col, date_trunc
-
+import pandas as pd
+
+from analyses.decimation import (
+    get_time_range,
+    m4_aggregate,
+    m4_aggregate_bars,
+    m4_to_points,
+)
+from analyses.query_cache import cached_to_pandas
 from analyses.snowflake_utils import get_snowflake_connection
 
+# Size of the plot, one M4 bucket being computed per pixel
+PLOT_WIDTH_PX = 1200
+PLOT_DPI = 100
 
-def plot_es_futures_adjusted():
-    """
-    Plot the adjusted prices for ES futures.
+# Continuous series of adjusted prices, and its rollup of one row per contract and minute
+CONTINUOUS_TABLE = "data_platform.transform.int__es_equity_index_future__continuous"
+MINUTE_ROLLUP_TABLE = (
+    "data_platform.fact.timeseries__es_equity_index_future__minute_rollup"
+)
+
+
+def load_data(session, start=None, end=None):
     """
+    Query the adjusted prices of ES futures, decimated to the first, last, minimum
+    and maximum price of each contract for each pixel of the plot.
 
-    print("Plotting ES futures adjusted prices")
+    Args:
+        session (Session): The Snowpark session.
+        start, end (str or datetime, optional): Time range to plot, defaults to the
+            whole series.
+    """
 
-    # Connect to Snowflake
-    session = get_snowflake_connection()
+    # Read the minute rollup unless a pixel spans less than a minute, e.g. when
+    # zooming on a session, which only the ticks resolve
+    if start is None or end is None:
+        first_time, last_time = get_time_range(
+            session, MINUTE_ROLLUP_TABLE, "minute_start"
+        )
+        start = first_time if start is None else start
+        end = last_time if end is None else end
+    pixel_span = (pd.Timestamp(end) - pd.Timestamp(start)) / PLOT_WIDTH_PX
+
+    # At most 4 points per contract and pixel, keeping the true price envelope
+    if pixel_span >= pd.Timedelta(minutes=1):
+        table_name = MINUTE_ROLLUP_TABLE
+        buckets = m4_aggregate_bars(
+            session,
+            table_name,
+            "minute_start",
+            width=PLOT_WIDTH_PX,
+            start=start,
+            end=end,
+            group_columns=["contract_symbol"],
+        )
+    else:
+        table_name = CONTINUOUS_TABLE
+        buckets = m4_aggregate(
+            session,
+            table_name,
+            "trading_datetime",
+            "price",
+            width=PLOT_WIDTH_PX,
+            start=start,
+            end=end,
+            group_columns=["contract_symbol"],
+        )
 
-    # Create a table object for the ES futures data after adjustment
-    es_futures = session.table(
-        "data_platform.transform.int__es_equity_index_future__continuous"
-    )
+    # Convert to pandas DataFrame, reusing the cached result until the table changes
+    df = m4_to_points(cached_to_pandas(buckets, [table_name]), ["contract_symbol"])
 
-    print(f"Number of rows in the ES futures table: {es_futures.count():,}")
+    return df
 
-    # Sample the data and aggregate by day to reduce the number of points
-    sampled_data = (
-        es_futures.select(
-            date_trunc("DAY", col("trading_datetime")).alias("date"),
-            col("contract_symbol"),
-            col("price"),
-        )
-        .groupBy("date", "contract_symbol")
-        .agg({"price": "mean"})
-        .withColumnRenamed("AVG(PRICE)", "avg_price")
-        .sample(n=10000)
-    )
 
-    # Convert to pandas DataFrame
-    df = sampled_data.to_pandas()
+def render(df):
+    """
+    Plot the adjusted prices of ES futures and save the figure.
+    """
 
-    # Create the plot
-    plt.figure(figsize=(12, 8))  # Increased figure height to accommodate legend
+    # Create the plot, with an increased figure height to accommodate the legend
+    plt.figure(figsize=(PLOT_WIDTH_PX / PLOT_DPI, 8), dpi=PLOT_DPI)
     for symbol in df["CONTRACT_SYMBOL"].unique():
         symbol_data = df[df["CONTRACT_SYMBOL"] == symbol]
-        plt.plot(symbol_data["DATE"], symbol_data["AVG_PRICE"], label=symbol)
+        plt.plot(symbol_data["TIME"], symbol_data["VALUE"], label=symbol)
 
     plt.title("Adjusted Prices for ES Equity Index Futures")
     plt.xlabel("Date")
@@ -62,9 +103,26 @@ def plot_es_futures_adjusted():
     plot_path = script_dir / plot_name
     plt.savefig(plot_path, bbox_inches="tight")
     print(f"Plot saved as {plot_path}\n\n")
+    plt.close()
+
+
+def plot_es_futures_adjusted():
+    """
+    Plot the adjusted prices for ES futures.
+    """
 
+    print("Plotting ES futures adjusted prices")
+
+    # Connect to Snowflake
+    session = get_snowflake_connection()
+
+    data = load_data(session)
+
+    # Close the Snowflake session
     session.close()
 
+    render(data)
+
 
 if __name__ == "__main__":
     plot_es_futures_adjusted()
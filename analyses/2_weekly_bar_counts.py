@@ -1,38 +1,39 @@
 from pathlib import Path
 
 import matplotlib.pyplot as plt
-from snowflake.snowpark.functions import col
 
+from analyses.query_cache import cached_to_pandas
 from analyses.snowflake_utils import get_snowflake_connection
 
 
-def plot_weekly_bar_counts():
+def load_data(session):
     """
-    Plot the weekly bar counts for ES futures.
+    Query the weekly bar counts of ES futures.
     """
 
-    print("Plotting weekly bar counts for ES futures")
-
-    # Connect to Snowflake
-    session = get_snowflake_connection()
-
     # Create a table object for the weekly bar counts data
-    weekly_bar_counts = session.table(
+    table_name = (
         "data_platform.fact.timeseries__es_equity_index_future__weekly_bar_counts"
     )
-
-    # Select and order the data
-    df = (
-        weekly_bar_counts.select(
-            col("WEEK_START"),
-            col("TICK_BAR_COUNT"),
-            col("VOLUME_BAR_COUNT"),
-            col("DOLLAR_BAR_COUNT"),
-        )
-        .order_by("WEEK_START")
-        .to_pandas()
+    weekly_bar_counts = session.sql(
+        f"""
+        SELECT week_start, tick_bar_count, volume_bar_count, dollar_bar_count
+        FROM {table_name}
+        ORDER BY week_start
+    """
     )
 
+    # Convert the query to a pandas DataFrame
+    df = cached_to_pandas(weekly_bar_counts, [table_name])
+
+    return df
+
+
+def render(df):
+    """
+    Plot the weekly bar counts of ES futures and save the figure.
+    """
+
     # Rename all columns to lowercase
     df.columns = df.columns.str.lower()
 
@@ -92,9 +93,26 @@ def plot_weekly_bar_counts():
     plot_path = script_dir / plot_name
     plt.savefig(plot_path, bbox_inches="tight")
     print(f"Plot saved as {plot_path}\n\n")
+    plt.close()
+
+
+def plot_weekly_bar_counts():
+    """
+    Plot the weekly bar counts for ES futures.
+    """
 
+    print("Plotting weekly bar counts for ES futures")
+
+    # Connect to Snowflake
+    session = get_snowflake_connection()
+
+    data = load_data(session)
+
+    # Close the Snowflake session
     session.close()
 
+    render(data)
+
 
 if __name__ == "__main__":
     plot_weekly_bar_counts()
@@ -1,30 +1,34 @@
 from pathlib import Path
 
 import matplotlib.pyplot as plt
-from snowflake.snowpark.functions import col
 
+from analyses.query_cache import cached_to_pandas
 from analyses.snowflake_utils import get_snowflake_connection
 
 
-def plot_es_futures_bar_returns_correlation():
+def load_data(session):
     """
-    Plot the serial correlation of bar returns for ES futures.
+    Query the serial correlation of bar returns of ES futures.
     """
 
-    print("Plotting ES futures bar returns correlation")
-
-    # Connect to Snowflake
-    session = get_snowflake_connection()
-
     # Create a table object for the weekly bar counts data
-    bar_returns_correlation = session.table(
+    table_name = (
         "data_platform.fact.timeseries__es_equity_index_future__bar_returns_correlation"
     )
+    bar_returns_correlation = session.sql(
+        f"SELECT bar_type, serial_correlation FROM {table_name}"
+    )
 
     # Convert Snowflake table to pandas DataFrame
-    df = bar_returns_correlation.select(
-        col("BAR_TYPE"), col("SERIAL_CORRELATION")
-    ).to_pandas()
+    df = cached_to_pandas(bar_returns_correlation, [table_name])
+
+    return df
+
+
+def render(df):
+    """
+    Plot the serial correlation of bar returns and save the figure.
+    """
 
     # Create a bar plot
     plt.figure(figsize=(10, 6))
@@ -53,9 +57,24 @@ def plot_es_futures_bar_returns_correlation():
     print(f"Plot saved as {plot_path}\n\n")
     plt.close()
 
+
+def plot_es_futures_bar_returns_correlation():
+    """
+    Plot the serial correlation of bar returns for ES futures.
+    """
+
+    print("Plotting ES futures bar returns correlation")
+
+    # Connect to Snowflake
+    session = get_snowflake_connection()
+
+    data = load_data(session)
+
     # Close the Snowflake session
     session.close()
 
+    render(data)
+
 
 if __name__ == "__main__":
     plot_es_futures_bar_returns_correlation()
@@ -3,30 +3,34 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from snowflake.snowpark.functions import col
 
+from analyses.query_cache import cached_to_pandas
 from analyses.snowflake_utils import get_snowflake_connection
 
 
-def plot_monthly_bar_variance_analysis():
+def load_data(session):
     """
-    Plot the monthly bar variance analysis for ES futures.
+    Query the monthly bar count variance of ES futures.
     """
 
-    print("Plotting ES futures monthly bar variance analysis")
-
-    # Connect to Snowflake
-    session = get_snowflake_connection()
-
     # Create a table object for the monthly bar variance data
-    monthly_bar_variance = session.table(
+    table_name = (
         "data_platform.fact.timeseries__es_equity_index_future__monthly_bar_variance"
     )
+    monthly_bar_variance = session.sql(
+        f"SELECT month_start, bar_type, bar_count_variance FROM {table_name}"
+    )
 
     # Convert Snowflake table to pandas DataFrame
-    df = monthly_bar_variance.select(
-        col("MONTH_START"), col("BAR_TYPE"), col("BAR_COUNT_VARIANCE")
-    ).to_pandas()
+    df = cached_to_pandas(monthly_bar_variance, [table_name])
+
+    return df
+
+
+def render(df):
+    """
+    Plot the monthly bar variance analysis and save the figure.
+    """
 
     # Convert MONTH_START to datetime
     df["MONTH_START"] = pd.to_datetime(df["MONTH_START"])
@@ -91,9 +95,24 @@ def plot_monthly_bar_variance_analysis():
     plt.close()
     print(f"Combined plot saved as {plot_path}\n\n")
 
+
+def plot_monthly_bar_variance_analysis():
+    """
+    Plot the monthly bar variance analysis for ES futures.
+    """
+
+    print("Plotting ES futures monthly bar variance analysis")
+
+    # Connect to Snowflake
+    session = get_snowflake_connection()
+
+    data = load_data(session)
+
     # Close the Snowflake session
     session.close()
 
+    render(data)
+
 
 if __name__ == "__main__":
     plot_monthly_bar_variance_analysis()
@@ -0,0 +1,15 @@
+"""
+Run all the analyses with a single Snowflake session.
+
+The queries of every analysis are submitted concurrently from threads sharing the
+session, and each figure is rendered in a worker process as soon as its data is
+downloaded, so the suite takes about as long as its slowest query rather than the
+sum of all of them.
+
+Run with: python -m analyses
+"""
+
+from analyses.runner import run_analyses
+
+if __name__ == "__main__":
+    run_analyses()
@@ -0,0 +1,287 @@
+"""
+Streaming tick, volume and dollar bar engine over Arrow record batches of ticks.
+
+Bars follow the semantics of the int__es_equity_index_future__*_bars models: ticks
+are numbered per contract in arrival order, and a new bar starts whenever
+FLOOR((row_num - 1) / threshold) for tick bars, FLOOR(cumulative_volume / threshold)
+for volume bars or FLOOR(cumulative_dollars / threshold) for dollar bars changes.
+Counters reset for every contract.
+
+The state of the bar in progress of each contract is carried across batches, so
+bars can be built over hundreds of millions of ticks in bounded memory, e.g.
+
+    bars = build_bars(sorted(Path("data/ES").glob("*filter0vol*.parquet")), "volume",
+                      threshold=25_000)
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+TICK_BARS = "tick"
+VOLUME_BARS = "volume"
+DOLLAR_BARS = "dollar"
+BAR_TYPES = (TICK_BARS, VOLUME_BARS, DOLLAR_BARS)
+
+# Column names of the parquet parts written by convert_h5_to_parquet
+RAW_COLUMNS = {
+    "contract_symbol": "Instrument",
+    "trading_datetime": "Time",
+    "price": "Price",
+    "volume": "Volume",
+}
+
+# Column names of the continuous series (int__es_equity_index_future__continuous)
+CONTINUOUS_COLUMNS = {
+    "contract_symbol": "contract_symbol",
+    "trading_datetime": "trading_datetime",
+    "price": "price",
+    "volume": "volume",
+}
+
+BAR_SCHEMA = pa.schema(
+    [
+        ("contract_symbol", pa.string()),
+        ("bar_start_time", pa.timestamp("ms")),
+        ("bar_end_time", pa.timestamp("ms")),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.int64()),
+        ("total_dollars_traded", pa.float64()),
+        ("tick_count", pa.int64()),
+        ("start_row_num", pa.int64()),
+        ("end_row_num", pa.int64()),
+    ]
+)
+
+# Aggregates of a bar, in the order of BAR_SCHEMA after the contract symbol
+_AGGREGATES = BAR_SCHEMA.names[1:]
+
+
+def to_epoch_ms(times):
+    """
+    Convert an Arrow array of trading datetimes into int64 milliseconds since epoch.
+
+    Accepts timestamp columns, or the YYYYMMDDHHMMSSfff strings of the HDF5 source.
+    """
+    if pa.types.is_timestamp(times.type):
+        return pc.cast(times, pa.timestamp("ms")).to_numpy().astype("int64")
+    seconds = pc.strptime(
+        pc.utf8_slice_codeunits(times, 0, 14), format="%Y%m%d%H%M%S", unit="ms"
+    )
+    millis = pc.cast(pc.utf8_slice_codeunits(times, 14, 17), pa.int64())
+    return seconds.to_numpy().astype("int64") + millis.to_numpy()
+
+
+class BarBuilder:
+    """
+    Incrementally build bars of one type and threshold from batches of ticks.
+
+    Ticks of each contract must be passed in trading order, but contracts may be
+    interleaved. update() returns the bars completed by a batch, and flush() the
+    bars still in progress once all ticks were passed.
+    """
+
+    def __init__(self, bar_type, threshold):
+        if bar_type not in BAR_TYPES:
+            raise ValueError(f"Unsupported bar type '{bar_type}'")
+        if threshold <= 0:
+            raise ValueError(f"Bar threshold must be positive, got {threshold}")
+        self.bar_type = bar_type
+        self.threshold = threshold
+        # Per contract: ticks seen, cumulative volume or dollars, and the bar in
+        # progress as (group, aggregates) or None
+        self._row_counts = {}
+        self._cumulative = {}
+        self._partial_bars = {}
+
+    def _group_keys(self, contract, prices, volumes):
+        """Compute the bar group of each tick of a contract and update counters."""
+        row_count = self._row_counts.get(contract, 0)
+        row_nums = np.arange(row_count + 1, row_count + len(prices) + 1)
+        self._row_counts[contract] = row_count + len(prices)
+
+        if self.bar_type == TICK_BARS:
+            return row_nums, (row_nums - 1) // self.threshold
+
+        amounts = volumes if self.bar_type == VOLUME_BARS else prices * volumes
+        cumulative = self._cumulative.get(contract, 0) + np.cumsum(amounts)
+        self._cumulative[contract] = cumulative[-1]
+        return row_nums, np.floor(cumulative / self.threshold).astype("int64")
+
+    def _update_contract(self, contract, times, prices, volumes):
+        """Aggregate the ticks of one contract and return its completed bars."""
+        row_nums, groups = self._group_keys(contract, prices, volumes)
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(groups)) + 1))
+        ends = np.append(starts[1:], len(groups))
+        dollars = prices * volumes
+        segments = {
+            "bar_start_time": times[starts],
+            "bar_end_time": times[ends - 1],
+            "open": prices[starts],
+            "high": np.maximum.reduceat(prices, starts),
+            "low": np.minimum.reduceat(prices, starts),
+            "close": prices[ends - 1],
+            "volume": np.add.reduceat(volumes, starts),
+            "total_dollars_traded": np.add.reduceat(dollars, starts),
+            "tick_count": ends - starts,
+            "start_row_num": row_nums[starts],
+            "end_row_num": row_nums[ends - 1],
+        }
+
+        # Merge the first segment into the bar in progress if they share a group,
+        # otherwise the bar in progress is complete
+        completed = []
+        partial = self._partial_bars.get(contract)
+        if partial is not None:
+            partial_group, partial_bar = partial
+            if partial_group == groups[0]:
+                segments["bar_start_time"][0] = partial_bar["bar_start_time"]
+                segments["open"][0] = partial_bar["open"]
+                segments["high"][0] = max(segments["high"][0], partial_bar["high"])
+                segments["low"][0] = min(segments["low"][0], partial_bar["low"])
+                segments["start_row_num"][0] = partial_bar["start_row_num"]
+                for name in ("volume", "total_dollars_traded", "tick_count"):
+                    segments[name][0] += partial_bar[name]
+            else:
+                completed.append({name: [value] for name, value in partial_bar.items()})
+
+        # The last segment may continue in the next batch
+        self._partial_bars[contract] = (
+            groups[-1],
+            {name: values[-1] for name, values in segments.items()},
+        )
+        completed.append({name: values[:-1] for name, values in segments.items()})
+        return {
+            name: np.concatenate([np.asarray(bars[name]) for bars in completed])
+            for name in _AGGREGATES
+        }
+
+    def update(self, contracts, times, prices, volumes):
+        """
+        Add a batch of ticks and return the bars it completed as an Arrow table.
+
+        Args:
+            contracts (pa.Array): Contract symbol of each tick.
+            times (np.ndarray): Trading datetime of each tick, in epoch milliseconds.
+            prices (np.ndarray): Price of each tick.
+            volumes (np.ndarray): Volume of each tick.
+        """
+        if isinstance(contracts, pa.ChunkedArray):
+            contracts = contracts.combine_chunks()
+        if pa.types.is_dictionary(contracts.type):
+            encoded = contracts
+        else:
+            encoded = pc.dictionary_encode(contracts)
+        indices = encoded.indices.to_numpy(zero_copy_only=False)
+        prices = np.asarray(prices, dtype="float64")
+        volumes = np.asarray(volumes, dtype="int64")
+        times = np.asarray(times, dtype="int64")
+
+        bars = []
+        for index, contract in enumerate(encoded.dictionary.to_pylist()):
+            rows = np.flatnonzero(indices == index)
+            if len(rows) == 0:
+                continue
+            contract_bars = self._update_contract(
+                contract, times[rows], prices[rows], volumes[rows]
+            )
+            bars.append(_bars_to_table(contract, contract_bars))
+        return _concat_bars(bars)
+
+    def update_batch(self, batch, columns=RAW_COLUMNS):
+        """Add a record batch of ticks, whose column names are given by columns."""
+        return self.update(
+            batch.column(columns["contract_symbol"]),
+            to_epoch_ms(batch.column(columns["trading_datetime"])),
+            batch.column(columns["price"]).to_numpy(zero_copy_only=False),
+            batch.column(columns["volume"]).to_numpy(zero_copy_only=False),
+        )
+
+    def flush(self):
+        """Return the bars in progress of every contract, and reset them."""
+        bars = [
+            _bars_to_table(contract, {name: [value] for name, value in bar.items()})
+            for contract, (_, bar) in self._partial_bars.items()
+        ]
+        self._partial_bars = {}
+        return _concat_bars(bars)
+
+
+def _bars_to_table(contract, bars):
+    arrays = [pa.array([contract] * len(bars["tick_count"]), type=pa.string())]
+    for field in BAR_SCHEMA.remove(0):
+        values = np.asarray(bars[field.name])
+        if pa.types.is_timestamp(field.type):
+            arrays.append(pa.array(values.astype("int64")).cast(field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=BAR_SCHEMA)
+
+
+def _concat_bars(tables):
+    if not tables:
+        return BAR_SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def iter_tick_batches(paths, columns=RAW_COLUMNS, batch_size=1_000_000):
+    """
+    Iterate over the ticks of parquet files as record batches, one file at a time.
+
+    Args:
+        paths (iterable of Path): Parquet files, in trading order for each contract.
+        columns (dict): Names of the contract, datetime, price and volume columns.
+        batch_size (int): Maximum number of ticks per batch.
+    """
+    for path in paths:
+        parquet_file = pq.ParquetFile(Path(path))
+        yield from parquet_file.iter_batches(
+            batch_size=batch_size, columns=list(columns.values())
+        )
+
+
+def build_bars(paths, bar_type, threshold, columns=RAW_COLUMNS, batch_size=1_000_000):
+    """
+    Build bars over parquet files of ticks in bounded memory.
+
+    Returns an Arrow table with the columns of BAR_SCHEMA, ordered by contract
+    symbol and bar start time like the dbt bar models.
+    """
+    builder = BarBuilder(bar_type, threshold)
+    tables = [
+        builder.update_batch(batch, columns)
+        for batch in iter_tick_batches(paths, columns, batch_size)
+    ]
+    tables.append(builder.flush())
+    return _concat_bars(tables).sort_by(
+        [("contract_symbol", "ascending"), ("bar_start_time", "ascending")]
+    )
+
+
+def derive_bar_thresholds(tick_bars):
+    """
+    Derive volume and dollar thresholds from tick bars, like the dbt models: the
+    average volume per tick bar, and the average dollars per tick bar valued at the
+    bar's (open + high + low + close) / 4.
+
+    Returns:
+        tuple: The volume and dollar thresholds, rounded to integers.
+    """
+    num_bars = tick_bars.num_rows
+    total_volume = pc.sum(tick_bars["volume"]).as_py()
+    average_price = pc.divide(
+        pc.add(
+            pc.add(tick_bars["open"], tick_bars["high"]),
+            pc.add(tick_bars["low"], tick_bars["close"]),
+        ),
+        4,
+    )
+    total_dollars = pc.sum(pc.multiply(average_price, tick_bars["volume"])).as_py()
+    return round(total_volume / num_bars), round(total_dollars / num_bars)
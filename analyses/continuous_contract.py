@@ -0,0 +1,427 @@
+"""
+Streaming continuous-contract back-adjustment engine over the local tick parquet parts.
+
+The continuous series is built in two passes over Arrow record batches of ticks, in
+bounded memory:
+
+1. A ContractScanner aggregates the first and last tick, volume and tick count of
+   each contract and calendar day, from which build_roll_calendar() finds the roll
+   between consecutive contracts and the price gap at each roll.
+2. A ContinuousSeriesBuilder shifts the prices of each contract by the cumulative
+   adjustment of its own roll and of all the later rolls, so that the series is
+   back-adjusted onto the latest contract.
+
+The default "difference" method and "first_tick" roll rule follow the
+int__es_equity_index_future__roll_calendar and __continuous models: the series rolls
+at the first tick of the next contract, and prices are shifted by the difference
+between its first price and the last price of the contract. The "ratio" method
+scales prices by the ratio of the two prices instead, which keeps returns unchanged,
+and the "volume_crossover" rule rolls at the start of the day following the first
+day on which the next contract traded more volume. Each variant is written to its
+own parquet file, e.g.
+
+    store = TickStore(Path("data/ES"))
+    calendar = build_continuous_series(
+        store, Path("data/ES_continuous_ratio.parquet"), method="ratio",
+        roll_rule="volume_crossover",
+    )
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from analyses.bar_engine import RAW_COLUMNS, to_epoch_ms
+from analyses.tick_store import DEFAULT_BATCH_SIZE
+
+DIFFERENCE = "difference"
+RATIO = "ratio"
+ADJUSTMENT_METHODS = (DIFFERENCE, RATIO)
+
+FIRST_TICK = "first_tick"
+VOLUME_CROSSOVER = "volume_crossover"
+ROLL_RULES = (FIRST_TICK, VOLUME_CROSSOVER)
+
+# Futures month codes, in calendar order
+MONTH_CODES = "FGHJKMNQUVXZ"
+
+MS_PER_DAY = 86_400_000
+
+# Per contract and day, in the order of the daily statistics of ContractScanner
+_DAILY_FIELDS = (
+    "first_time",
+    "first_price",
+    "last_time",
+    "last_price",
+    "volume",
+    "tick_count",
+)
+
+CONTINUOUS_SCHEMA = pa.schema(
+    [
+        ("contract_symbol", pa.string()),
+        ("trading_datetime", pa.timestamp("ms")),
+        ("row_num", pa.int64()),
+        ("unadjusted_price", pa.float64()),
+        ("price", pa.float64()),
+        ("cumulative_adjustment", pa.float64()),
+        ("volume", pa.int64()),
+    ]
+)
+
+
+def parse_contract_symbol(contract_symbol):
+    """
+    Parse the year and month order of a contract symbol like ESZ03, as the roll
+    calendar model does: two-digit years below 80 are in the 2000s.
+    """
+    year = int(contract_symbol[3:5])
+    year += 2000 if year < 80 else 1900
+    return year, MONTH_CODES.index(contract_symbol[2]) + 1
+
+
+def _encode_contracts(contracts):
+    """Dictionary-encode contract symbols into (indices, symbols)."""
+    if isinstance(contracts, pa.ChunkedArray):
+        contracts = contracts.combine_chunks()
+    if not pa.types.is_dictionary(contracts.type):
+        contracts = pc.dictionary_encode(contracts)
+    indices = contracts.indices.to_numpy(zero_copy_only=False)
+    return indices, contracts.dictionary.to_pylist()
+
+
+class ContractScanner:
+    """
+    First pass: aggregate daily statistics of each contract from batches of ticks.
+
+    Ticks of each contract must be passed in trading order, but contracts may be
+    interleaved. Memory grows with the number of contract days, not of ticks.
+    """
+
+    def __init__(self):
+        # Per contract: {day: [first_time, first_price, last_time, last_price,
+        # volume, tick_count]}
+        self._days = {}
+
+    def _update_contract(self, contract, times, prices, volumes):
+        days = times // MS_PER_DAY
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(days)) + 1))
+        ends = np.append(starts[1:], len(days))
+        daily = zip(
+            days[starts].tolist(),
+            times[starts].tolist(),
+            prices[starts].tolist(),
+            times[ends - 1].tolist(),
+            prices[ends - 1].tolist(),
+            np.add.reduceat(volumes, starts).tolist(),
+            (ends - starts).tolist(),
+        )
+        contract_days = self._days.setdefault(contract, {})
+        for day, *stats in daily:
+            current = contract_days.get(day)
+            if current is None:
+                contract_days[day] = stats
+            else:
+                # The day continues from the previous batch
+                current[2:4] = stats[2:4]
+                current[4] += stats[4]
+                current[5] += stats[5]
+
+    def update(self, contracts, times, prices, volumes):
+        """
+        Add a batch of ticks.
+
+        Args:
+            contracts (pa.Array): Contract symbol of each tick.
+            times (np.ndarray): Trading datetime of each tick, in epoch milliseconds.
+            prices (np.ndarray): Price of each tick.
+            volumes (np.ndarray): Volume of each tick.
+        """
+        indices, symbols = _encode_contracts(contracts)
+        times = np.asarray(times, dtype="int64")
+        prices = np.asarray(prices, dtype="float64")
+        volumes = np.asarray(volumes, dtype="int64")
+        for index, contract in enumerate(symbols):
+            rows = np.flatnonzero(indices == index)
+            if len(rows):
+                self._update_contract(contract, times[rows], prices[rows], volumes[rows])
+
+    def update_batch(self, batch, columns=RAW_COLUMNS):
+        """Add a record batch of ticks, whose column names are given by columns."""
+        self.update(
+            batch.column(columns["contract_symbol"]),
+            to_epoch_ms(batch.column(columns["trading_datetime"])),
+            batch.column(columns["price"]).to_numpy(zero_copy_only=False),
+            batch.column(columns["volume"]).to_numpy(zero_copy_only=False),
+        )
+
+    def daily_statistics(self):
+        """
+        Return one row per contract and day, with the day in epoch days and the
+        first and last tick times in epoch milliseconds.
+        """
+        rows = [
+            (contract, day, *stats)
+            for contract, contract_days in self._days.items()
+            for day, stats in contract_days.items()
+        ]
+        daily = pd.DataFrame(rows, columns=["contract_symbol", "day", *_DAILY_FIELDS])
+        return daily.sort_values(["contract_symbol", "day"], ignore_index=True)
+
+
+def _find_roll(current, following, roll_rule):
+    """
+    Find the roll from a contract to the next one, given their daily statistics.
+
+    Returns:
+        tuple: The roll time in epoch milliseconds, the price of the contract and of
+        the next one at the roll, and whether the contracts traded at the same time,
+        in which case the ticks of the contract after the roll and of the next one
+        before the roll are dropped.
+    """
+    if roll_rule == VOLUME_CROSSOVER:
+        common = current.merge(following, on="day", suffixes=("", "_next"))
+        # Only days on which both contracts traded at the same time, unlike the day
+        # the ticks of one contract end and those of the next start
+        common = common[
+            np.maximum(common["first_time"], common["first_time_next"])
+            < np.minimum(common["last_time"], common["last_time_next"])
+        ]
+        if len(common):
+            crossed = common[common["volume_next"] > common["volume"]]
+            # Roll at the latest on the last day both contracts traded
+            day = crossed.iloc[0] if len(crossed) else common.iloc[-1]
+            return (
+                (int(day["day"]) + 1) * MS_PER_DAY,
+                day["last_price"],
+                day["last_price_next"],
+                True,
+            )
+    # Like the roll calendar model, roll at the first tick of the next contract and
+    # keep every tick of both contracts
+    return (
+        int(following["first_time"].iloc[0]),
+        current["last_price"].iloc[-1],
+        following["first_price"].iloc[0],
+        False,
+    )
+
+
+def build_roll_calendar(daily, method=DIFFERENCE, roll_rule=FIRST_TICK):
+    """
+    Build the roll calendar from the daily statistics of ContractScanner.
+
+    Returns one row per contract in roll order, like
+    int__es_equity_index_future__roll_calendar, with the roll to the next contract,
+    its adjustment (price gap or ratio) and the cumulative adjustment of the
+    contract's prices. active_from and active_until bound the ticks of each contract
+    kept in the series, and are only set when contracts overlap at a volume
+    crossover roll.
+    """
+    if method not in ADJUSTMENT_METHODS:
+        raise ValueError(f"Unsupported adjustment method '{method}'")
+    if roll_rule not in ROLL_RULES:
+        raise ValueError(f"Unsupported roll rule '{roll_rule}'")
+
+    contracts = sorted(daily["contract_symbol"].unique(), key=parse_contract_symbol)
+    days = {contract: group for contract, group in daily.groupby("contract_symbol")}
+    rows = []
+    for contract in contracts:
+        contract_days = days[contract]
+        year, month_order = parse_contract_symbol(contract)
+        rows.append(
+            {
+                "contract_symbol": contract,
+                "contract_year": year,
+                "month_order": month_order,
+                "first_trading_datetime": contract_days["first_time"].iloc[0],
+                "last_trading_datetime": contract_days["last_time"].iloc[-1],
+                "tick_count": contract_days["tick_count"].sum(),
+                "first_price": contract_days["first_price"].iloc[0],
+                "last_price": contract_days["last_price"].iloc[-1],
+                "next_contract_symbol": None,
+                "roll_datetime": None,
+                "roll_price": np.nan,
+                "next_roll_price": np.nan,
+                "active_from": None,
+                "active_until": None,
+            }
+        )
+
+    for row, next_row in zip(rows, rows[1:]):
+        roll_time, price, next_price, overlap = _find_roll(
+            days[row["contract_symbol"]],
+            days[next_row["contract_symbol"]],
+            roll_rule,
+        )
+        row["next_contract_symbol"] = next_row["contract_symbol"]
+        row["roll_datetime"] = roll_time
+        row["roll_price"] = price
+        row["next_roll_price"] = next_price
+        if overlap:
+            row["active_until"] = roll_time
+            next_row["active_from"] = roll_time
+
+    calendar = pd.DataFrame(rows)
+    # The latest contract has no roll yet, which leaves its prices unchanged
+    if method == DIFFERENCE:
+        adjustment = (calendar["next_roll_price"] - calendar["roll_price"]).fillna(0)
+        cumulative = adjustment[::-1].cumsum()[::-1]
+    else:
+        adjustment = (calendar["next_roll_price"] / calendar["roll_price"]).fillna(1)
+        cumulative = adjustment[::-1].cumprod()[::-1]
+    calendar["roll_adjustment"] = adjustment
+    calendar["cumulative_adjustment"] = cumulative
+
+    for column in (
+        "first_trading_datetime",
+        "last_trading_datetime",
+        "roll_datetime",
+        "active_from",
+        "active_until",
+    ):
+        calendar[column] = pd.to_datetime(calendar[column].astype("Int64"), unit="ms")
+    return calendar
+
+
+class ContinuousSeriesBuilder:
+    """
+    Second pass: back-adjust batches of ticks with the cumulative adjustments of a
+    roll calendar.
+
+    Ticks are numbered per contract in arrival order, like the row_num of the
+    continuous model, so the ticks of each contract must be passed in trading order.
+    """
+
+    def __init__(self, calendar, method=DIFFERENCE):
+        if method not in ADJUSTMENT_METHODS:
+            raise ValueError(f"Unsupported adjustment method '{method}'")
+        self.method = method
+        self._symbols = pa.array(calendar["contract_symbol"], type=pa.string())
+        self._positions = {
+            contract: position
+            for position, contract in enumerate(self._symbols.to_pylist())
+        }
+        self._adjustments = calendar["cumulative_adjustment"].to_numpy("float64")
+        # Unbounded windows are widened to the int64 range
+        self._active_from = _to_epoch_ms(calendar["active_from"], np.iinfo("int64").min)
+        self._active_until = _to_epoch_ms(
+            calendar["active_until"], np.iinfo("int64").max
+        )
+        self._row_counts = np.zeros(len(calendar), dtype="int64")
+
+    def update(self, contracts, times, prices, volumes):
+        """
+        Adjust a batch of ticks and return its ticks in the series as an Arrow table
+        with the columns of CONTINUOUS_SCHEMA.
+
+        Args:
+            contracts (pa.Array): Contract symbol of each tick.
+            times (np.ndarray): Trading datetime of each tick, in epoch milliseconds.
+            prices (np.ndarray): Price of each tick.
+            volumes (np.ndarray): Volume of each tick.
+        """
+        indices, symbols = _encode_contracts(contracts)
+        # Ticks of contracts missing from the calendar are dropped
+        lookup = np.array(
+            [self._positions.get(contract, -1) for contract in symbols], dtype="int64"
+        )
+        positions = lookup[indices]
+        times = np.asarray(times, dtype="int64")
+        keep = positions >= 0
+        keep[keep] = (times[keep] >= self._active_from[positions[keep]]) & (
+            times[keep] < self._active_until[positions[keep]]
+        )
+        positions, times = positions[keep], times[keep]
+        prices = np.asarray(prices, dtype="float64")[keep]
+        volumes = np.asarray(volumes, dtype="int64")[keep]
+
+        # Number the ticks of each contract after those of the previous batches
+        order = np.argsort(positions, kind="stable")
+        counts = np.bincount(positions, minlength=len(self._row_counts))
+        group_starts = np.cumsum(counts) - counts
+        row_nums = np.empty(len(positions), dtype="int64")
+        row_nums[order] = np.arange(len(positions)) - group_starts[positions[order]]
+        row_nums += self._row_counts[positions] + 1
+        self._row_counts += counts
+
+        adjustments = self._adjustments[positions]
+        if self.method == DIFFERENCE:
+            adjusted = prices + adjustments
+        else:
+            adjusted = prices * adjustments
+        return pa.Table.from_arrays(
+            [
+                self._symbols.take(pa.array(positions)),
+                pa.array(times).cast(pa.timestamp("ms")),
+                pa.array(row_nums),
+                pa.array(prices),
+                pa.array(adjusted),
+                pa.array(adjustments),
+                pa.array(volumes),
+            ],
+            schema=CONTINUOUS_SCHEMA,
+        )
+
+    def update_batch(self, batch, columns=RAW_COLUMNS):
+        """Adjust a record batch of ticks, whose column names are given by columns."""
+        return self.update(
+            batch.column(columns["contract_symbol"]),
+            to_epoch_ms(batch.column(columns["trading_datetime"])),
+            batch.column(columns["price"]).to_numpy(zero_copy_only=False),
+            batch.column(columns["volume"]).to_numpy(zero_copy_only=False),
+        )
+
+
+def _to_epoch_ms(datetimes, default):
+    """Convert a Series of datetimes into epoch milliseconds, NaT becoming default."""
+    values = datetimes.to_numpy("datetime64[ms]")
+    return np.where(np.isnat(values), default, values.astype("int64"))
+
+
+def build_continuous_series(
+    store,
+    output_path,
+    method=DIFFERENCE,
+    roll_rule=FIRST_TICK,
+    contracts=None,
+    start=None,
+    end=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """
+    Build a back-adjusted continuous series from a TickStore and write it to parquet.
+
+    The ticks are read twice, once to build the roll calendar and once to adjust
+    them, so memory stays bounded by the batch size. The file is written next to
+    output_path and renamed once complete.
+
+    Args:
+        store (TickStore): Local ticks, e.g. TickStore(Path("data/ES")).
+        output_path (Path): Parquet file of the series.
+        method (str): "difference" or "ratio" adjustment.
+        roll_rule (str): "first_tick" or "volume_crossover".
+        contracts (str or list of str, optional): Contract symbols to select.
+        start (optional): Inclusive lower bound on the trading time.
+        end (optional): Exclusive upper bound on the trading time.
+        batch_size (int): Maximum number of ticks per record batch.
+
+    Returns:
+        DataFrame: The roll calendar of the series.
+    """
+    columns = list(RAW_COLUMNS.values())
+
+    scanner = ContractScanner()
+    for batch in store.iter_batches(columns, contracts, start, end, batch_size):
+        scanner.update_batch(batch)
+    calendar = build_roll_calendar(scanner.daily_statistics(), method, roll_rule)
+
+    builder = ContinuousSeriesBuilder(calendar, method)
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp")
+    with pq.ParquetWriter(tmp_path, CONTINUOUS_SCHEMA) as writer:
+        for batch in store.iter_batches(columns, contracts, start, end, batch_size):
+            writer.write_table(builder.update_batch(batch))
+    tmp_path.replace(output_path)
+    return calendar
@@ -0,0 +1,229 @@
+"""
+M4 decimation of time series for plotting, computed in Snowflake.
+
+The time range of the plot is split into one bucket per pixel, and only the first,
+last, minimum and maximum values of each bucket are returned. Drawing lines through
+these points renders the same envelope as drawing every point, including extremes
+that random sampling would miss, while at most 4 points per bucket are transferred
+whatever the zoom level, e.g.
+
+    buckets = m4_aggregate(
+        session, CONTINUOUS, "trading_datetime", "price", width=1200,
+        start="2008-09-01", end="2008-12-31", group_columns=["contract_symbol"],
+    )
+    points = m4_to_points(buckets.to_pandas(), ["contract_symbol"])
+
+Pre-aggregated bars, e.g. the minute rollup of the continuous series, are decimated
+the same way by m4_aggregate_bars, from their open, high, low and close.
+
+The queries are plain SQL, which the local DuckDB database of the analyses runs too.
+"""
+
+import pandas as pd
+
+
+def get_time_range(session, table_name, time_column):
+    """
+    Fetch the first and last time of a series, which Snowflake answers from the
+    micro-partition metadata of a table without scanning it.
+    """
+    row = session.sql(
+        f"SELECT MIN({time_column}) AS first_time, MAX({time_column}) AS last_time"
+        f" FROM {table_name}"
+    ).collect()[0]
+    return row["FIRST_TIME"], row["LAST_TIME"]
+
+
+def bucket_series(
+    session,
+    table_name,
+    time_column,
+    value_columns,
+    width,
+    start=None,
+    end=None,
+    group_columns=(),
+):
+    """
+    Build the query selecting the points of a series within a time range, with the
+    bucket of time each of them falls in, the last bucket including the end of the
+    range.
+
+    Args:
+        session (Session): The Snowpark session.
+        table_name (str): Fully qualified name of the series to decimate.
+        time_column (str): Name of the timestamp column.
+        value_columns (list of str): Names of the value columns to keep.
+        width (int): Number of buckets, typically the width of the plot in pixels.
+        start, end (str or datetime, optional): Time range of the plot, defaults to
+            the range of the series.
+        group_columns (list of str): Columns identifying separate series.
+
+    Returns:
+        str: The SQL of the points, with a bucket column.
+    """
+    if start is None or end is None:
+        first_time, last_time = get_time_range(session, table_name, time_column)
+        start = first_time if start is None else start
+        end = last_time if end is None else end
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+
+    span_ms = (end - start) // pd.Timedelta(milliseconds=1) or 1
+    start_literal = f"TIMESTAMP '{start.isoformat(sep=' ')}'"
+    end_literal = f"TIMESTAMP '{end.isoformat(sep=' ')}'"
+    elapsed_ms = f"DATEDIFF('millisecond', {start_literal}, {time_column})"
+    columns = ", ".join([*group_columns, time_column, *value_columns])
+    return f"""
+        SELECT
+            {columns},
+            LEAST(FLOOR({elapsed_ms} * {width} / {span_ms}), {width - 1}) AS bucket
+        FROM {table_name}
+        WHERE {time_column} BETWEEN {start_literal} AND {end_literal}
+    """
+
+
+def m4_aggregate(
+    session,
+    table_name,
+    time_column,
+    value_column,
+    width,
+    start=None,
+    end=None,
+    group_columns=(),
+):
+    """
+    Build the query returning the first, last, minimum and maximum value of each of
+    width buckets of time, and the times at which they were reached.
+
+    Args:
+        session (Session): The Snowpark session.
+        table_name (str): Fully qualified name of the series to decimate.
+        time_column (str): Name of the timestamp column.
+        value_column (str): Name of the value column.
+        width (int): Number of buckets, typically the width of the plot in pixels.
+        start, end (str or datetime, optional): Time range of the plot, defaults to
+            the range of the series.
+        group_columns (list of str): Columns identifying separate series, e.g. the
+            contract symbol, which are decimated independently.
+
+    Returns:
+        snowflake.snowpark.DataFrame: One row per series and bucket.
+    """
+    series = bucket_series(
+        session,
+        table_name,
+        time_column,
+        [value_column],
+        width,
+        start,
+        end,
+        group_columns,
+    )
+
+    time, value = time_column, value_column
+    keys = ", ".join([*group_columns, "bucket"])
+    return session.sql(
+        f"""
+        SELECT
+            {keys},
+            MIN({time}) AS first_time,
+            MIN_BY({value}, {time}) AS first_value,
+            MIN_BY({time}, {value}) AS min_time,
+            MIN({value}) AS min_value,
+            MAX_BY({time}, {value}) AS max_time,
+            MAX({value}) AS max_value,
+            MAX({time}) AS last_time,
+            MAX_BY({value}, {time}) AS last_value
+        FROM ({series}) AS series
+        GROUP BY {keys}
+    """
+    )
+
+
+def m4_aggregate_bars(
+    session,
+    table_name,
+    time_column,
+    width,
+    start=None,
+    end=None,
+    group_columns=(),
+    open_column="open",
+    high_column="high",
+    low_column="low",
+    close_column="close",
+):
+    """
+    Build the same query as m4_aggregate over bars rather than points, e.g. the
+    minute rollup of the continuous series, taking the first value from the open of
+    the first bar, the last value from the close of the last bar, and the extremes
+    from the highs and lows. The times of the extremes are those of the bars they
+    were reached in, which is exact as long as a bucket spans at least one bar.
+
+    Args:
+        session (Session): The Snowpark session.
+        table_name (str): Fully qualified name of the bars to decimate.
+        time_column (str): Name of the column holding the start time of each bar.
+        width (int): Number of buckets, typically the width of the plot in pixels.
+        start, end (str or datetime, optional): Time range of the plot, defaults to
+            the range of the bars.
+        group_columns (list of str): Columns identifying separate series.
+        open_column, high_column, low_column, close_column (str): Names of the OHLC
+            columns of the bars.
+
+    Returns:
+        snowflake.snowpark.DataFrame: One row per series and bucket, with the columns
+            of m4_aggregate.
+    """
+    value_columns = [open_column, high_column, low_column, close_column]
+    series = bucket_series(
+        session,
+        table_name,
+        time_column,
+        value_columns,
+        width,
+        start,
+        end,
+        group_columns,
+    )
+
+    time, high, low = time_column, high_column, low_column
+    keys = ", ".join([*group_columns, "bucket"])
+    return session.sql(
+        f"""
+        SELECT
+            {keys},
+            MIN({time}) AS first_time,
+            MIN_BY({open_column}, {time}) AS first_value,
+            MIN_BY({time}, {low}) AS min_time,
+            MIN({low}) AS min_value,
+            MAX_BY({time}, {high}) AS max_time,
+            MAX({high}) AS max_value,
+            MAX({time}) AS last_time,
+            MAX_BY({close_column}, {time}) AS last_value
+        FROM ({series}) AS series
+        GROUP BY {keys}
+    """
+    )
+
+
+def m4_to_points(df, group_columns=()):
+    """
+    Flatten M4 buckets into the time-ordered points to draw, one row per distinct
+    (time, value) of each series, with TIME and VALUE columns.
+    """
+    group_columns = [column.upper() for column in group_columns]
+    points = pd.concat(
+        [
+            df[group_columns + [f"{point}_TIME", f"{point}_VALUE"]].set_axis(
+                group_columns + ["TIME", "VALUE"], axis=1
+            )
+            for point in ("FIRST", "MIN", "MAX", "LAST")
+        ]
+    )
+    return (
+        points.drop_duplicates()
+        .sort_values(group_columns + ["TIME"])
+        .reset_index(drop=True)
+    )
@@ -0,0 +1,74 @@
+"""
+Sessions running the analyses' queries on the local DuckDB database built by dbt.
+
+get_local_connection() is only imported by snowflake_utils when ANALYSES_TARGET=local,
+so duckdb is never loaded on the Snowflake path. A LocalSession provides the part of
+the Snowpark Session the analyses use, sql() and table(), and the database holds the
+tables under their data_platform names, so the analyses' SQL runs unchanged on both.
+"""
+
+import os
+
+import duckdb
+
+DEFAULT_DUCKDB_PATH = "data/data_platform.duckdb"
+
+
+class LocalSession:
+    """Read-only session on a DuckDB database, shared by the threads of the runner."""
+
+    def __init__(self, database_path):
+        self._connection = duckdb.connect(str(database_path), read_only=True)
+
+    def sql(self, query):
+        return LocalDataFrame(self, query)
+
+    def table(self, table_name):
+        return self.sql(f"SELECT * FROM {table_name}")
+
+    def cursor(self):
+        """A connection to the same database for a single thread."""
+        return self._connection.cursor()
+
+    def close(self):
+        self._connection.close()
+
+
+class LocalDataFrame:
+    """Result of a query of a LocalSession, fetched like a Snowpark DataFrame."""
+
+    def __init__(self, session, query):
+        self.session = session
+        self.query = query
+
+    def to_pandas(self):
+        with self.session.cursor() as cursor:
+            df = cursor.sql(self.query).df()
+        # Unquoted Snowflake identifiers are uppercase
+        df.columns = [column.upper() for column in df.columns]
+        return df
+
+    def collect(self):
+        return self.to_pandas().to_dict("records")
+
+
+def get_local_connection(database_path=None) -> LocalSession:
+    """
+    Open a session on the tables built by the local DuckDB target of dbt, so that the
+    analyses run their queries offline.
+
+    Args:
+        database_path (str or Path, optional): DuckDB database file, defaults to the
+            DUCKDB_PATH environment variable like the dbt profile.
+
+    Returns:
+        LocalSession: The local session, whose tables keep their data_platform names.
+    """
+    return LocalSession(
+        database_path or os.environ.get("DUCKDB_PATH", DEFAULT_DUCKDB_PATH)
+    )
+
+
+def is_local_session(session) -> bool:
+    """Whether a session was created by get_local_connection."""
+    return isinstance(session, LocalSession)
@@ -0,0 +1,157 @@
+"""
+Local Parquet cache for the results of Snowpark queries.
+
+Results are keyed by a hash of the query's SQL and of the last-altered timestamps of
+the tables it reads, so a cached result is reused until one of these tables is
+rebuilt by dbt. Looking up the timestamps only queries the information schema, and
+no warehouse is needed when the result is cached.
+
+The cache is bounded in size: once it exceeds max_size_mb, the least recently used
+results are evicted. It can be shared by threads, e.g. those of the analyses runner,
+and by processes: a result evicted by one of them while another reads it is treated
+as a cache miss. e.g.
+
+    df = cached_to_pandas(
+        session.table(WEEKLY_BAR_COUNTS).order_by("WEEK_START"), [WEEKLY_BAR_COUNTS]
+    )
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from analyses.snowflake_utils import is_local_session
+
+# Constants
+CACHE_DIR = Path(__file__).parent / ".cache"
+MAX_CACHE_SIZE_MB = 2048
+
+# Serializes evictions between the threads of a process
+_EVICTION_LOCK = threading.Lock()
+
+
+def get_last_altered(session, table_names):
+    """
+    Fetch the last-altered timestamp of tables from the information schema.
+
+    Args:
+        session (Session): The Snowpark session.
+        table_names (list of str): Fully qualified names, "database.schema.table".
+
+    Returns:
+        dict: Mapping of each table name to its last-altered timestamp, as a string.
+    """
+    last_altered = {}
+    for table_name in table_names:
+        database, schema, table = table_name.upper().split(".")
+        rows = session.sql(
+            f"""
+            SELECT last_altered
+            FROM {database}.information_schema.tables
+            WHERE table_schema = '{schema}' AND table_name = '{table}'
+            """
+        ).collect()
+        if not rows:
+            raise ValueError(f"Table {table_name} not found")
+        last_altered[table_name] = str(rows[0]["LAST_ALTERED"])
+    return last_altered
+
+
+def get_cache_key(query, last_altered):
+    """Hash a query's SQL together with the last-altered timestamps of its tables."""
+    payload = json.dumps({"query": query, "last_altered": last_altered}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _file_stats(path):
+    """Return the stat of a cached file, or None if it was evicted meanwhile."""
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def evict_least_recently_used(cache_dir, max_size_mb):
+    """
+    Delete the least recently used results until the cache fits in max_size_mb.
+
+    The modification time of each file is its last access time, as it is updated
+    on every cache hit. Files deleted meanwhile by another process are skipped.
+    """
+    with _EVICTION_LOCK:
+        files = [
+            (path, stats)
+            for path in cache_dir.glob("*.parquet")
+            if (stats := _file_stats(path)) is not None
+        ]
+        files.sort(key=lambda file: file[1].st_mtime)
+        total_size = sum(stats.st_size for _, stats in files)
+        while files and total_size > max_size_mb * 1024 * 1024:
+            oldest, stats = files.pop(0)
+            total_size -= stats.st_size
+            oldest.unlink(missing_ok=True)
+            print(f"Evicted {oldest.name} from the query cache")
+
+
+def _read_cached(cache_file):
+    """Read a cached result and mark it as used, or return None if it is missing."""
+    try:
+        os.utime(cache_file)
+        return pd.read_parquet(cache_file)
+    except FileNotFoundError:
+        return None
+
+
+def cached_to_pandas(
+    dataframe,
+    source_tables,
+    cache_dir=CACHE_DIR,
+    max_size_mb=MAX_CACHE_SIZE_MB,
+    refresh=False,
+):
+    """
+    Return the result of a Snowpark DataFrame as pandas, from the local cache if
+    the tables it reads have not changed since it was cached.
+
+    Note that the result of a query which is not deterministic, e.g. a sample, is
+    reused as-is until its tables change. Queries of local sessions, which read the
+    local DuckDB database, are run without the cache.
+
+    Args:
+        dataframe (snowflake.snowpark.DataFrame): The query to run.
+        source_tables (list of str): Fully qualified names of the tables it reads.
+        cache_dir (Path): Directory of the cached results.
+        max_size_mb (int): Maximum size of the cache before evicting results.
+        refresh (bool): Run the query even if its result is cached.
+
+    Returns:
+        pd.DataFrame: The result of the query.
+    """
+    if is_local_session(dataframe.session):
+        return dataframe.to_pandas()
+
+    query = "\n".join(dataframe.queries["queries"])
+    last_altered = get_last_altered(dataframe.session, source_tables)
+    cache_file = cache_dir / f"{get_cache_key(query, last_altered)}.parquet"
+
+    if not refresh:
+        # A result evicted since it was found is run again
+        df = _read_cached(cache_file)
+        if df is not None:
+            print(f"Loaded query result from cache {cache_file.name}")
+            return df
+
+    df = dataframe.to_pandas()
+
+    # Write to a temporary file first, so that an interrupted write is never read,
+    # named after the thread in case another one runs the same query
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}.tmp")
+    df.to_parquet(tmp_file, index=False)
+    tmp_file.replace(cache_file)
+    evict_least_recently_used(cache_dir, max_size_mb)
+    return df
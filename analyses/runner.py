@@ -0,0 +1,105 @@
+"""
+Run all the analyses with a single Snowflake session, see analyses/__main__.py.
+
+The functions run in worker processes live in this module rather than in __main__,
+which spawned workers cannot import.
+"""
+
+import importlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from analyses.snowflake_utils import get_snowflake_connection
+
+ANALYSES = [
+    "1_es_futures_adjusted_prices",
+    "2_weekly_bar_counts",
+    "3_bar_returns_correlation",
+    "4_monthly_bar_variance_analysis",
+    "5_jarque_bera_test_bar_returns",
+]
+
+
+def _load_data(session, name):
+    """Run the queries of an analysis, and return its data and the time taken."""
+    start = time.perf_counter()
+    data = importlib.import_module(f"analyses.{name}").load_data(session)
+    return data, time.perf_counter() - start
+
+
+def _render(name, data):
+    """Render the figure of an analysis in a worker process, and return the time taken."""
+    import matplotlib
+
+    # Workers have no display
+    matplotlib.use("Agg")
+
+    start = time.perf_counter()
+    importlib.import_module(f"analyses.{name}").render(data)
+    return time.perf_counter() - start
+
+
+def run_analyses(names=ANALYSES, max_render_workers=None):
+    """
+    Run the given analyses, sharing one Snowflake session between their queries.
+
+    Args:
+        names (list of str): Module names of the analyses, in the analyses package.
+        max_render_workers (int, optional): Number of processes rendering figures,
+            defaults to the number of CPUs.
+
+    Returns:
+        dict: The query and render time, and the wall time from the start of the
+            suite until it completed, of each analysis, in seconds.
+    """
+    suite_start = time.perf_counter()
+    session = get_snowflake_connection()
+    timings = {name: {} for name in names}
+    failed = []
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=len(names)
+        ) as query_pool, ProcessPoolExecutor(
+            max_workers=max_render_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as render_pool:
+            queries = {
+                query_pool.submit(_load_data, session, name): name for name in names
+            }
+            renders = {}
+            for future in as_completed(queries):
+                name = queries[future]
+                try:
+                    data, timings[name]["query"] = future.result()
+                except Exception as e:
+                    print(f"Error querying the data of {name}: {str(e)}")
+                    failed.append(name)
+                    continue
+                renders[render_pool.submit(_render, name, data)] = name
+
+            for future in as_completed(renders):
+                name = renders[future]
+                try:
+                    timings[name]["render"] = future.result()
+                except Exception as e:
+                    print(f"Error rendering {name}: {str(e)}")
+                    failed.append(name)
+                    continue
+                timings[name]["wall"] = time.perf_counter() - suite_start
+    finally:
+        session.close()
+
+    print(f"{'Analysis':<40} {'Query (s)':>10} {'Render (s)':>11} {'Wall (s)':>9}")
+    for name, timing in timings.items():
+        print(
+            f"{name:<40} {timing.get('query', float('nan')):>10.1f}"
+            f" {timing.get('render', float('nan')):>11.1f}"
+            f" {timing.get('wall', float('nan')):>9.1f}"
+        )
+    print(f"Ran {len(names)} analyses in {time.perf_counter() - suite_start:.1f}s")
+
+    if failed:
+        raise RuntimeError(f"Some analyses failed: {', '.join(failed)}")
+    return timings
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -12,8 +13,16 @@ env_path = current_dir.parent.parent / ".env"
 # Load the .env file
 load_dotenv(dotenv_path=env_path)
 
+# Setting ANALYSES_TARGET=local runs the analyses on the database of the local dbt target
+LOCAL_TARGET = "local"
+
 
 def get_snowflake_connection() -> Session:
+    if os.environ.get("ANALYSES_TARGET") == LOCAL_TARGET:
+        # Imported lazily, as it loads duckdb
+        from analyses.local_session import get_local_connection
+
+        return get_local_connection()
     try:
         session = Session.builder.configs(
             {
@@ -30,3 +39,10 @@ def get_snowflake_connection() -> Session:
     except SnowparkSQLException as e:
         print(f"Error connecting to Snowflake: {str(e)}")
         raise
+
+
+def is_local_session(session) -> bool:
+    """Whether a session was created by analyses.local_session.get_local_connection."""
+    # No local session can exist unless the module was imported
+    local_session = sys.modules.get("analyses.local_session")
+    return local_session is not None and local_session.is_local_session(session)
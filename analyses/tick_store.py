@@ -0,0 +1,259 @@
+"""
+Local read API over the Parquet parts written by convert_h5_to_parquet.
+
+A TickStore opens the parts of one dataset, in the flat or hive layout and typed or
+not, as a pyarrow dataset over memory-mapped files. Queries project columns and
+filter on contract symbols and a time range, which is pushed down to the scan:
+hive partitions of other contracts and days are skipped without being opened, and
+row groups whose Instrument and Time statistics fall outside the filter are not
+read. When the converter's _index.parquet metadata index is present, the scan is
+planned from it, so only the row groups which may match the filter are read and no
+other footer is opened. Small research queries run locally in milliseconds, e.g.
+
+    store = TickStore(Path("data/ES"))
+    ticks = store.to_pandas(
+        columns=["Time", "Price", "Volume"],
+        contracts="ESZ03",
+        start="2003-11-03",
+        end="2003-11-10",
+    )
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+
+# Constants
+DEFAULT_DATASET = "tick/trades_filter0vol"
+CONTRACT_FIELD = "Instrument"
+TIME_FIELD = "Time"
+DEFAULT_BATCH_SIZE = 1_000_000
+
+# Partition fields of the hive layout
+CONTRACT_PARTITION = "contract"
+DATE_PARTITION = "date"
+
+# Metadata index written by convert_h5_to_parquet, one row per row group
+INDEX_FILE_NAME = "_index.parquet"
+
+
+def to_timestamp(value):
+    """Parse a datetime, date string or pandas Timestamp into a naive Timestamp."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp
+
+
+def format_time_string(timestamp):
+    """Format a Timestamp like the YYYYMMDDHHMMSSfff Time strings of the parts."""
+    return timestamp.strftime("%Y%m%d%H%M%S") + f"{timestamp.microsecond // 1000:03d}"
+
+
+class TickStore:
+    """
+    Read the ticks of one dataset from the local Parquet parts.
+
+    Args:
+        root (Path): Output directory of convert_h5_to_parquet, e.g. data/ES.
+        dataset_name (str): Name of the HDF5 dataset whose parts are read.
+        memory_map (bool): Whether to memory-map the files instead of reading them.
+        use_index (bool): Whether to plan scans from the metadata index, if present.
+    """
+
+    def __init__(
+        self, root, dataset_name=DEFAULT_DATASET, memory_map=True, use_index=True
+    ):
+        self.root = Path(root)
+        self.dataset_name = dataset_name
+        sanitized_name = dataset_name.replace("/", "_").replace(" ", "_")
+        # Flat parts sit in the root, hive parts in internal_id=.../date=... dirs
+        self.paths = sorted(self.root.rglob(f"{sanitized_name}_part_*.parquet"))
+        if not self.paths:
+            raise FileNotFoundError(
+                f"No parquet parts of dataset {dataset_name} found in {self.root}"
+            )
+        self.is_hive = any(path.parent != self.root for path in self.paths)
+        self.dataset = ds.dataset(
+            [str(path) for path in self.paths],
+            format="parquet",
+            filesystem=fs.LocalFileSystem(use_mmap=memory_map),
+            partitioning="hive" if self.is_hive else None,
+            partition_base_dir=str(self.root) if self.is_hive else None,
+        )
+        self.time_type = self.dataset.schema.field(TIME_FIELD).type
+        self.index = self._read_index() if use_index else None
+
+    def _read_index(self):
+        """
+        Read the row groups of the dataset's files from the metadata index, or return
+        None if there is no index. Row groups of files which no longer exist are
+        dropped, and the index is ignored if it misses any file.
+        """
+        index_path = self.root / INDEX_FILE_NAME
+        if not index_path.exists():
+            return None
+        index = pq.read_table(
+            index_path, filters=[("dataset", "=", self.dataset_name)]
+        ).to_pandas()
+        relative_paths = {path.relative_to(self.root).as_posix() for path in self.paths}
+        index = index[index["path"].isin(relative_paths)]
+        if set(index["path"]) != relative_paths:
+            return None
+        # Keep the hive partition values of each file for the planned fragments
+        self._partition_expressions = {}
+        for fragment in self.dataset.get_fragments():
+            relative_path = Path(fragment.path).relative_to(self.root).as_posix()
+            self._partition_expressions[relative_path] = fragment.partition_expression
+        return index
+
+    @property
+    def schema(self):
+        """Schema of the ticks, including the partition fields of the hive layout."""
+        return self.dataset.schema
+
+    def _time_scalar(self, value):
+        """Convert a time bound into a scalar comparable with the Time column."""
+        timestamp = to_timestamp(value)
+        if pa.types.is_timestamp(self.time_type):
+            return pa.scalar(timestamp.to_pydatetime(), type=self.time_type)
+        # The fixed-width strings sort like the times they represent
+        return pa.scalar(format_time_string(timestamp), type=self.time_type)
+
+    def filter_expression(self, contracts=None, start=None, end=None):
+        """
+        Build the filter of a query, pushed down to the partitions and row groups.
+
+        Args:
+            contracts (str or list of str, optional): Contract symbols to select.
+            start (optional): Inclusive lower bound on the trading time.
+            end (optional): Exclusive upper bound on the trading time.
+
+        Returns:
+            Expression: The filter, or None to read every tick.
+        """
+        conditions = []
+        if contracts is not None:
+            if isinstance(contracts, str):
+                contracts = [contracts]
+            conditions.append(ds.field(CONTRACT_FIELD).isin(contracts))
+            if self.is_hive:
+                conditions.append(ds.field(CONTRACT_PARTITION).isin(contracts))
+        if start is not None:
+            conditions.append(ds.field(TIME_FIELD) >= self._time_scalar(start))
+            if self.is_hive:
+                start_date = to_timestamp(start).strftime("%Y-%m-%d")
+                conditions.append(ds.field(DATE_PARTITION) >= start_date)
+        if end is not None:
+            conditions.append(ds.field(TIME_FIELD) < self._time_scalar(end))
+            if self.is_hive:
+                end_date = to_timestamp(end).strftime("%Y-%m-%d")
+                conditions.append(ds.field(DATE_PARTITION) <= end_date)
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def plan_row_groups(self, contracts=None, start=None, end=None):
+        """
+        Select the row groups of the metadata index which may hold matching ticks.
+
+        Args:
+            contracts (str or list of str, optional): Contract symbols to select.
+            start (optional): Inclusive lower bound on the trading time.
+            end (optional): Exclusive upper bound on the trading time.
+
+        Returns:
+            DataFrame: The selected rows of the index, or None without an index.
+        """
+        if self.index is None:
+            return None
+        selected = self.index[self.index["num_rows"] > 0]
+        if contracts is not None:
+            contracts = {contracts} if isinstance(contracts, str) else set(contracts)
+            selected = selected[
+                selected["instruments"].map(lambda values: bool(contracts & set(values)))
+            ]
+        # Times are indexed as YYYYMMDDHHMMSSfff strings, which sort like the times
+        if start is not None:
+            start_time = format_time_string(to_timestamp(start))
+            selected = selected[selected["max_time"] >= start_time]
+        if end is not None:
+            end_time = format_time_string(to_timestamp(end))
+            selected = selected[selected["min_time"] < end_time]
+        return selected
+
+    def _planned_dataset(self, contracts, start, end):
+        """
+        Restrict the dataset to the row groups planned from the metadata index, or
+        return the whole dataset without an index.
+        """
+        selected = self.plan_row_groups(contracts, start, end)
+        if selected is None:
+            return self.dataset
+        fragments = [
+            self.dataset.format.make_fragment(
+                str(self.root / path),
+                self.dataset.filesystem,
+                partition_expression=self._partition_expressions[path],
+                row_groups=sorted(row_groups["row_group"].tolist()),
+            )
+            for path, row_groups in selected.groupby("path", sort=True)
+        ]
+        return ds.FileSystemDataset(
+            fragments, self.dataset.schema, self.dataset.format, self.dataset.filesystem
+        )
+
+    def scanner(
+        self,
+        columns=None,
+        contracts=None,
+        start=None,
+        end=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+    ):
+        """
+        Build a scanner reading the selected columns of the ticks matching a filter.
+
+        Args:
+            columns (list of str, optional): Columns to read, all of them by default.
+            contracts (str or list of str, optional): Contract symbols to select.
+            start (optional): Inclusive lower bound on the trading time.
+            end (optional): Exclusive upper bound on the trading time.
+            batch_size (int): Maximum number of ticks per record batch.
+
+        Returns:
+            Scanner: The pyarrow dataset scanner.
+        """
+        return self._planned_dataset(contracts, start, end).scanner(
+            columns=columns,
+            filter=self.filter_expression(contracts, start, end),
+            batch_size=batch_size,
+        )
+
+    def iter_batches(
+        self,
+        columns=None,
+        contracts=None,
+        start=None,
+        end=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+    ):
+        """Iterate over the matching ticks as non-empty Arrow record batches."""
+        scanner = self.scanner(columns, contracts, start, end, batch_size)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch
+
+    def to_table(self, columns=None, contracts=None, start=None, end=None):
+        """Read the matching ticks into an Arrow table."""
+        return self.scanner(columns, contracts, start, end).to_table()
+
+    def to_pandas(self, columns=None, contracts=None, start=None, end=None):
+        """Read the matching ticks into a pandas DataFrame."""
+        return self.to_table(columns, contracts, start, end).to_pandas()
@@ -0,0 +1,189 @@
+"""
+This script generates a synthetic HDF5 file of ES futures ticks, shaped like the
+ES.h5 file of the data provider, to benchmark the pipeline offline.
+
+The file holds the tick/trades and tick/trades_filter0vol structured datasets, with
+the Instrument, Time, Price and Volume fields. Ticks follow the quarterly roll
+calendar of analyses/identified_rolls.csv: only the front contract trades, and it
+rolls to the next one 9 days before its expiry, on the third Friday of March, June,
+September and December. Rows are generated and written in blocks, so the file can
+scale to any number of rows in bounded memory.
+
+Run with: python -m benchmarks.generate_es_ticks data/benchmarks/ES.h5 --rows 10000000
+"""
+
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+# Same layout as the provider's ES.h5
+TICK_DTYPE = np.dtype(
+    [("Instrument", "S5"), ("Time", "S17"), ("Price", "<f8"), ("Volume", "<i4")]
+)
+TRADES_DATASET = "tick/trades"
+TRADES_FILTER0VOL_DATASET = "tick/trades_filter0vol"
+
+MONTH_CODES = {3: "H", 6: "M", 9: "U", 12: "Z"}
+ROLL_DAYS_BEFORE_EXPIRY = 9
+PRICE_TICK_SIZE = 0.25
+ZERO_VOLUME_FRACTION = 0.02
+BLOCK_ROWS = 1_000_000
+
+
+def third_friday(year, month):
+    """Return the expiry date of the contract of a month, its third Friday."""
+    first = date(year, month, 1)
+    return first + timedelta(days=(4 - first.weekday()) % 7 + 14)
+
+
+def roll_calendar(start_year, num_contracts):
+    """
+    Build the roll calendar of consecutive quarterly contracts, starting with the
+    September contract of start_year like the provider's data.
+
+    Returns:
+        list: (contract_symbol, first_time, last_time) tuples, each contract trading
+            from 15:30 on the roll date of the previous one until 15:14:59.999 on its
+            own roll date.
+    """
+    contracts = []
+    year, month = start_year, 9
+    first_time = datetime(start_year, 6, 30, 23, 0)
+    for _ in range(num_contracts):
+        roll_date = third_friday(year, month) - timedelta(days=ROLL_DAYS_BEFORE_EXPIRY)
+        last_time = datetime.combine(roll_date, datetime.min.time()) + timedelta(
+            hours=15, minutes=14, seconds=59, milliseconds=999
+        )
+        contracts.append(
+            (f"ES{MONTH_CODES[month]}{year % 100:02d}", first_time, last_time)
+        )
+        first_time = last_time + timedelta(minutes=15, milliseconds=1)
+        year, month = (year + 1, 3) if month == 12 else (year, month + 3)
+    return contracts
+
+
+def format_times(epoch_ms):
+    """Format epoch milliseconds as the YYYYMMDDHHMMSSfff byte strings of ES.h5."""
+    times = np.datetime_as_string(epoch_ms.astype("datetime64[ms]"), unit="ms")
+    for separator in ("-", "T", ":", "."):
+        times = np.char.replace(times, separator, "")
+    return times.astype("S17")
+
+
+def generate_block(rng, contract_symbol, start_ms, end_ms, num_rows, last_price):
+    """Generate the sorted ticks of a contract between two epoch milliseconds."""
+    block = np.empty(num_rows, dtype=TICK_DTYPE)
+    block["Instrument"] = contract_symbol
+    block["Time"] = format_times(np.sort(rng.integers(start_ms, end_ms, num_rows)))
+    steps = rng.choice(
+        [-PRICE_TICK_SIZE, 0.0, PRICE_TICK_SIZE], num_rows, p=[0.3, 0.4, 0.3]
+    )
+    block["Price"] = np.maximum(last_price + np.cumsum(steps), PRICE_TICK_SIZE)
+    volumes = rng.geometric(0.3, num_rows)
+    volumes[rng.random(num_rows) < ZERO_VOLUME_FRACTION] = 0
+    block["Volume"] = volumes
+    return block
+
+
+def append_rows(dataset, rows):
+    """Append rows at the end of a resizable dataset."""
+    start = dataset.shape[0]
+    dataset.resize((start + len(rows),))
+    dataset[start:] = rows
+
+
+def generate_es_h5(
+    output_file: Path,
+    num_rows,
+    num_contracts=8,
+    start_year=2003,
+    seed=0,
+    chunk_rows=65536,
+    compression=None,
+):
+    """
+    Write a synthetic ES.h5 file of num_rows ticks spread over num_contracts
+    consecutive quarterly contracts, proportionally to their trading period.
+
+    The tick/trades_filter0vol dataset holds the same ticks without the ones with
+    zero volume, as in the provider's file.
+    """
+    rng = np.random.default_rng(seed)
+    contracts = roll_calendar(start_year, num_contracts)
+    durations = np.array(
+        [(last - first).total_seconds() for _, first, last in contracts]
+    )
+    rows_per_contract = np.diff(
+        np.round(
+            np.concatenate(([0], np.cumsum(durations))) / durations.sum() * num_rows
+        )
+    ).astype("int64")
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with h5py.File(output_file, "w") as h5file:
+        datasets = [
+            h5file.create_dataset(
+                name,
+                shape=(0,),
+                maxshape=(None,),
+                dtype=TICK_DTYPE,
+                chunks=(chunk_rows,),
+                compression=compression,
+            )
+            for name in (TRADES_DATASET, TRADES_FILTER0VOL_DATASET)
+        ]
+        trades, trades_filter0vol = datasets
+
+        last_price = 1000.0
+        for (contract_symbol, first, last), contract_rows in zip(
+            contracts, rows_per_contract
+        ):
+            # Split the trading period of the contract into blocks of BLOCK_ROWS ticks
+            first_ms = int(first.replace(tzinfo=timezone.utc).timestamp() * 1000)
+            last_ms = int(last.replace(tzinfo=timezone.utc).timestamp() * 1000)
+            num_blocks = max(1, -(-contract_rows // BLOCK_ROWS))
+            bounds = np.linspace(first_ms, last_ms + 1, num_blocks + 1).astype("int64")
+            block_rows = np.diff(
+                np.linspace(0, contract_rows, num_blocks + 1).astype("int64")
+            )
+            for block_start, block_end, num_block_rows in zip(
+                bounds[:-1], bounds[1:], block_rows
+            ):
+                if num_block_rows == 0:
+                    continue
+                block = generate_block(
+                    rng,
+                    contract_symbol,
+                    block_start,
+                    block_end,
+                    num_block_rows,
+                    last_price,
+                )
+                append_rows(trades, block)
+                append_rows(trades_filter0vol, block[block["Volume"] > 0])
+                last_price = block["Price"][-1]
+
+            # The next contract trades at a premium, like the roll gaps of the
+            # continuous series
+            last_price += PRICE_TICK_SIZE * rng.integers(4, 40)
+            print(f"Generated {contract_rows:,} ticks for {contract_symbol}")
+
+    print(f"Generated {num_rows:,} ticks in {output_file}")
+    return contracts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output_file", type=Path)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--contracts", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_es_h5(args.output_file, args.rows, args.contracts, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
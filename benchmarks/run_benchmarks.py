@@ -0,0 +1,315 @@
+"""
+This script benchmarks the extract, load and bar computation steps of the pipeline
+offline, on a synthetic ES.h5 file.
+
+Each benchmark runs in a fresh process, so that its peak resident memory is measured
+in isolation:
+
+- convert: convert_h5_to_parquet over the whole file (rows/s, MB/s, peak RSS)
+- upload: upload_directory of the converted files to a local S3 stand-in, a moto
+  server unless AWS_ENDPOINT_URL points to another one, e.g. MinIO (files/s, MB/s)
+- bars: build_bars of tick, volume and dollar bars over the converted files (rows/s)
+
+Results are written as JSON, along with the commit and machine they were measured on,
+and can be compared with the results of another commit with --baseline.
+
+Run with: python -m benchmarks.run_benchmarks --rows 10000000
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from queue import Empty
+
+from benchmarks.generate_es_ticks import TRADES_FILTER0VOL_DATASET, generate_es_h5
+
+# Constants
+BENCHMARKS_DIR = Path(__file__).parent
+WORK_DIR = BENCHMARKS_DIR / ".data"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+BENCHMARKS = ("convert", "upload", "bars")
+BUCKET = "benchmark-bucket"
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB."""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        / unit
+    )
+
+
+def directory_size_mb(directory, pattern="*.parquet"):
+    """Total size of the files of a directory matching a pattern, in MB."""
+    return sum(path.stat().st_size for path in directory.rglob(pattern)) / 1024 / 1024
+
+
+def benchmark_convert(input_file, target_file_size_mb, num_workers, layout, typed):
+    """Time the conversion of the whole HDF5 file into Parquet."""
+    import h5py
+
+    from scripts.convert_h5_to_parquet_chunks import (
+        convert_h5_to_parquet,
+        read_h5_datasets,
+    )
+
+    with h5py.File(input_file, "r") as h5file:
+        datasets = read_h5_datasets(h5file)
+        num_rows = sum(dataset.shape[0] for dataset in datasets.values())
+        input_mb = sum(dataset.nbytes for dataset in datasets.values()) / 1024 / 1024
+
+    start = time.perf_counter()
+    convert_h5_to_parquet(
+        input_file,
+        target_file_size_mb=target_file_size_mb,
+        num_workers=num_workers,
+        layout=layout,
+        typed=typed,
+        incremental=False,
+    )
+    seconds = time.perf_counter() - start
+
+    output_dir = input_file.with_suffix("")
+    return {
+        "seconds": seconds,
+        "rows": num_rows,
+        "rows_per_second": num_rows / seconds,
+        "input_mb": input_mb,
+        "input_mb_per_second": input_mb / seconds,
+        "output_mb": directory_size_mb(output_dir),
+        "target_file_size_mb": target_file_size_mb,
+        "num_workers": num_workers,
+        "layout": layout,
+        "typed": typed,
+    }
+
+
+def benchmark_upload(input_file, max_workers):
+    """Time the upload of the converted files to a local S3 stand-in."""
+    from scripts.upload_parquet_chunks_to_s3 import get_s3_client, upload_directory
+
+    server = None
+    if "AWS_ENDPOINT_URL" not in os.environ:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError as e:
+            raise ImportError(
+                "The upload benchmark needs a local S3 stand-in: install the test"
+                " dependencies, which include moto, with `poetry install --with test`,"
+                " or set AWS_ENDPOINT_URL"
+            ) from e
+
+        server = ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        os.environ["AWS_ENDPOINT_URL"] = f"http://{host}:{port}"
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+    try:
+        s3 = get_s3_client()
+        s3.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-1"},
+        )
+        output_dir = input_file.with_suffix("")
+        manifest_path = WORK_DIR / "upload_manifest.json"
+        manifest_path.unlink(missing_ok=True)
+
+        start = time.perf_counter()
+        uploaded, _, failed = upload_directory(
+            output_dir,
+            BUCKET,
+            "benchmark",
+            max_workers=max_workers,
+            manifest_path=manifest_path,
+            s3_client=s3,
+        )
+        seconds = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.stop()
+
+    upload_mb = directory_size_mb(output_dir, "*filter0*.parquet")
+    return {
+        "seconds": seconds,
+        "files": uploaded,
+        "failed_files": failed,
+        "files_per_second": uploaded / seconds,
+        "mb": upload_mb,
+        "mb_per_second": upload_mb / seconds,
+        "max_workers": max_workers,
+    }
+
+
+def benchmark_bars(input_file, ticks_per_bar):
+    """Time the computation of tick, volume and dollar bars over the converted files."""
+    import pyarrow.parquet as pq
+
+    from analyses.bar_engine import (
+        DOLLAR_BARS,
+        TICK_BARS,
+        VOLUME_BARS,
+        build_bars,
+        derive_bar_thresholds,
+    )
+
+    dataset_name = TRADES_FILTER0VOL_DATASET.replace("/", "_")
+    paths = sorted(input_file.with_suffix("").rglob(f"*{dataset_name}*.parquet"))
+    num_rows = sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+
+    results = {"rows": num_rows}
+    start = time.perf_counter()
+    tick_bars = build_bars(paths, TICK_BARS, ticks_per_bar)
+    results[TICK_BARS] = {"seconds": time.perf_counter() - start}
+    volume_threshold, dollar_threshold = derive_bar_thresholds(tick_bars)
+    for bar_type, threshold in (
+        (VOLUME_BARS, volume_threshold),
+        (DOLLAR_BARS, dollar_threshold),
+    ):
+        start = time.perf_counter()
+        bars = build_bars(paths, bar_type, threshold)
+        results[bar_type] = {"seconds": time.perf_counter() - start, "bars": len(bars)}
+    results[TICK_BARS]["bars"] = len(tick_bars)
+
+    for bar_type in (TICK_BARS, VOLUME_BARS, DOLLAR_BARS):
+        results[bar_type]["rows_per_second"] = num_rows / results[bar_type]["seconds"]
+    return results
+
+
+def _run_in_child(queue, name, kwargs):
+    """Run a benchmark and send back its results along with the peak memory usage."""
+    benchmark = globals()[f"benchmark_{name}"]
+    try:
+        results = benchmark(**kwargs)
+        results["peak_rss_mb"] = peak_rss_mb()
+        queue.put((True, results))
+    except Exception as e:
+        queue.put((False, f"{type(e).__name__}: {e}"))
+
+
+def run_benchmark(name, **kwargs):
+    """Run a benchmark in a fresh process and return its results."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(queue, name, kwargs))
+    process.start()
+    while True:
+        try:
+            succeeded, results = queue.get(timeout=1)
+            break
+        except Empty:
+            # e.g. killed by the OOM killer, before sending any result
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"Benchmark {name} exited with code {process.exitcode}"
+                )
+    process.join()
+    if not succeeded:
+        raise RuntimeError(f"Benchmark {name} failed: {results}")
+    return results
+
+
+def get_git_commit():
+    """Return the commit of the working tree, or None outside of a git repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline):
+    """Print the ratio of the timings of two benchmark runs, < 1 being faster."""
+    print(f"Compared with {baseline.get('git_commit')} ({baseline.get('timestamp')}):")
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict):
+                walk(value, previous[key], f"{path}{key}.")
+            elif key in ("seconds", "peak_rss_mb") and previous[key]:
+                print(f"  {path}{key}: {value / previous[key]:.2f}x")
+
+    walk(results["benchmarks"], baseline["benchmarks"], "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--contracts", type=int, default=8)
+    parser.add_argument("--target-file-size-mb", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--layout", choices=("flat", "hive"), default="flat")
+    parser.add_argument("--typed", action="store_true")
+    parser.add_argument("--ticks-per-bar", type=int, default=10_000)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    args = parser.parse_args()
+
+    # The generated file is reused as long as its parameters are unchanged
+    input_file = WORK_DIR / f"ES_{args.rows}_{args.contracts}" / "ES.h5"
+    if not input_file.exists():
+        generate_es_h5(input_file, args.rows, args.contracts)
+
+    benchmark_kwargs = {
+        "convert": {
+            "input_file": input_file,
+            "target_file_size_mb": args.target_file_size_mb,
+            "num_workers": args.workers,
+            "layout": args.layout,
+            "typed": args.typed,
+        },
+        "upload": {"input_file": input_file, "max_workers": args.workers},
+        "bars": {"input_file": input_file, "ticks_per_bar": args.ticks_per_bar},
+    }
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": args.rows,
+        "contracts": args.contracts,
+        "benchmarks": {},
+    }
+    # Benchmarks run in order, as the upload and bars read the converted files
+    for name in BENCHMARKS:
+        if name in args.only:
+            print(f"Running benchmark {name}")
+            results["benchmarks"][name] = run_benchmark(name, **benchmark_kwargs[name])
+
+    output = args.output or RESULTS_DIR / f"{results['git_commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(json.dumps(results["benchmarks"], indent=2))
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        compare_results(results, json.loads(args.baseline.read_text()))
+
+
+if __name__ == "__main__":
+    main()
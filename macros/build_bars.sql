@@ -0,0 +1,66 @@
+/*
+    Aggregates ticks into bars with a single GROUP BY.
+
+    `ticks` is a relation or CTE with one row per tick and the columns contract_symbol,
+    trading_datetime, row_num (per contract, in trading order), price and tick_volume.
+    `bar_group` is a SQL expression assigning each tick to a bar within its contract,
+    e.g. FLOOR((row_num - 1) / 1000) for tick bars, or the cumulative volume of the
+    contract divided by the bar size for volume bars (see cumulative_bar_group).
+
+    Open and close are the prices of the first and last tick of the bar by row_num,
+    so every tick is read once and no DISTINCT is needed to deduplicate the bars.
+
+    `group_columns` are extra columns of `ticks` which bars are also grouped by, e.g.
+    the bar type and threshold when `ticks` holds one copy of each tick per bar size.
+*/
+
+{% macro build_bars(ticks, bar_group, include_dollars_traded=false, group_columns=[]) -%}
+
+  SELECT
+    {%- for column in group_columns %}
+    {{ column }},
+    {%- endfor %}
+    contract_symbol,
+    bar_group,
+    MIN(trading_datetime)      AS bar_start_time,
+    MAX(trading_datetime)      AS bar_end_time,
+    MIN_BY(price, row_num)     AS open,
+    MAX(price)                 AS high,
+    MIN(price)                 AS low,
+    MAX_BY(price, row_num)     AS close,
+    SUM(tick_volume)           AS volume,
+    {%- if include_dollars_traded %}
+    SUM(price * tick_volume)   AS total_dollars_traded,
+    {%- endif %}
+    COUNT(*)                   AS tick_count,
+    MIN(row_num)               AS start_row_num,
+    MAX(row_num)               AS end_row_num
+  FROM (
+    SELECT
+      {%- for column in group_columns %}
+      {{ column }},
+      {%- endfor %}
+      contract_symbol,
+      trading_datetime,
+      row_num,
+      price,
+      tick_volume,
+      {{ bar_group }} AS bar_group
+    FROM {{ ticks }}
+  )
+  GROUP BY {% for column in group_columns %}{{ column }}, {% endfor %}contract_symbol, bar_group
+
+{%- endmacro %}
+
+
+/*
+    Bar group of each tick when a new bar starts every time the running total of
+    `amount` over the ticks of a contract crosses a multiple of `bar_size`.
+*/
+
+{% macro cumulative_bar_group(amount, bar_size) -%}
+  FLOOR(
+    SUM({{ amount }}) OVER (PARTITION BY contract_symbol ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    / ({{ bar_size }})
+  )
+{%- endmacro %}
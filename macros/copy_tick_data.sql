@@ -0,0 +1,70 @@
+/*
+    Loads the raw tick parquet files into a native, typed table with COPY INTO, when the
+    tick_data_load_mode var is copy_into, instead of querying the external table. The local
+    DuckDB target always reads the files directly.
+
+    `external_source` is the external table, whose stage location and file format are reused,
+    and `loaded_source` the native table, created by the first load and clustered by contract
+    and day like the queries of the downstream models.
+
+    COPY INTO keeps the load history of the table, so each run only reads the files added
+    to the stage since the last load, and a file is never loaded twice. Files whose history
+    expired (after 64 days) are skipped too, as LOAD_UNCERTAIN_FILES is left to FALSE.
+*/
+
+{% macro load_tick_data(external_source, loaded_source) -%}
+  {%- if var('tick_data_load_mode') == 'copy_into' and target.type == 'snowflake' -%}
+    {{ copy_tick_data(external_source, loaded_source) }}
+  {%- else -%}
+    {{ refresh_external_table(external_source) }}
+  {%- endif -%}
+{%- endmacro %}
+
+
+{% macro copy_tick_data(external_source, loaded_source) -%}
+  {#- The graph is only populated at execution time -#}
+  {%- if not execute -%}
+    {{ return('') }}
+  {%- endif -%}
+  {%- set source_node = graph.sources.values()
+    | selectattr('identifier', 'equalto', external_source.identifier)
+    | first -%}
+  {%- set external = source_node.external -%}
+
+  CREATE TABLE IF NOT EXISTS {{ loaded_source }} (
+    index_internal_id varchar,
+    data_provider varchar,
+    contract_symbol varchar,
+    price float,
+    trading_datetime timestamp,
+    volume int,
+    source_file_name varchar,
+    loaded_at timestamp DEFAULT CURRENT_TIMESTAMP::timestamp
+  )
+  CLUSTER BY (contract_symbol, TO_DATE(trading_datetime));
+
+  COPY INTO {{ loaded_source }} (
+    index_internal_id,
+    data_provider,
+    contract_symbol,
+    price,
+    trading_datetime,
+    volume,
+    source_file_name
+  )
+  FROM (
+    SELECT
+      -- As the internal_id and data_provider partitions of the external table
+      SPLIT_PART(SPLIT_PART(metadata$filename, '/', 3), '=', 2),
+      SPLIT_PART(SPLIT_PART(metadata$filename, '/', 4), '=', 2),
+      {{ snowflake__tick_field('Instrument', 'varchar', variant='$1') }},
+      {{ snowflake__tick_field('Price', 'float', variant='$1') }},
+      {{ snowflake__tick_time('Time', variant='$1') }},
+      {{ snowflake__tick_field('Volume', 'int', variant='$1') }},
+      metadata$filename
+    FROM {{ external.location }}
+  )
+  FILE_FORMAT = (FORMAT_NAME = '{{ external.file_format }}')
+  PATTERN = '.*[.]parquet'
+  ON_ERROR = ABORT_STATEMENT
+{%- endmacro %}
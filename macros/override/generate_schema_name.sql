@@ -3,6 +3,8 @@
     It prevents the issue where dbt would automatically append the target schema
     to custom schema names, which could lead to unintended schema structures.
     This version ensures that custom schema names are used as-is, without modification.
+    On DuckDB, which keeps the case of the schemas it creates, they are lowercased so
+    that dbt finds them again on incremental runs.
 */
 
 {% macro generate_schema_name(custom_schema_name, node) -%}
@@ -13,6 +15,10 @@
 
         {{ default_schema }}
 
+    {% elif target.type == 'duckdb' %}
+
+        {{ custom_schema_name | trim | lower }}
+
     {% else %}
 
         {{ custom_schema_name | trim }}
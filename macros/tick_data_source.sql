@@ -0,0 +1,77 @@
+/*
+    Reads the fields of the raw tick parquet files, whichever engine the models run on.
+
+    On Snowflake (the data_platform target), the files are read through an external table
+    over the S3 stage, whose rows are a VARIANT `value` column and which is refreshed
+    before each build. On DuckDB (the local target), the source is a read_parquet() over
+    the local hive layout written by convert_h5_to_parquet, whose columns are read as-is.
+*/
+
+/* Statement refreshing the file listing of an external table, run as a pre-hook */
+{% macro refresh_external_table(relation) -%}
+  {{ return(adapter.dispatch('refresh_external_table')(relation)) }}
+{%- endmacro %}
+
+{% macro snowflake__refresh_external_table(relation) -%}
+  alter external table {{ relation }} refresh
+{%- endmacro %}
+
+{# read_parquet() lists the files on every query, so there is nothing to refresh #}
+{% macro duckdb__refresh_external_table(relation) -%}
+{%- endmacro %}
+
+
+/* A field of the parquet files, cast to data_type */
+{% macro tick_field(field, data_type) -%}
+  {{ return(adapter.dispatch('tick_field')(field, data_type)) }}
+{%- endmacro %}
+
+{# `variant` is the VARIANT column of the rows, e.g. $1 when reading the stage directly #}
+{% macro snowflake__tick_field(field, data_type, variant='value') -%}
+  {{ variant }}:"{{ field }}"::{{ data_type }}
+{%- endmacro %}
+
+{% macro duckdb__tick_field(field, data_type) -%}
+  "{{ field }}"::{{ data_type }}
+{%- endmacro %}
+
+
+/*
+    The trading time of a tick. Files written by the typed conversion hold a timestamp[ms]
+    column, which does not need parsing. Other files hold YYYYMMDDHHMMSSfff strings.
+*/
+{% macro tick_time(field) -%}
+  {{ return(adapter.dispatch('tick_time')(field)) }}
+{%- endmacro %}
+
+{# The timestamp column is read as epoch milliseconds, or as a timestamp if the file format uses logical types #}
+{% macro snowflake__tick_time(field, variant='value') -%}
+  CASE
+    WHEN IS_INTEGER({{ variant }}:"{{ field }}") THEN TO_TIMESTAMP_NTZ({{ variant }}:"{{ field }}"::int, 3)
+    WHEN IS_TIMESTAMP_NTZ({{ variant }}:"{{ field }}") THEN {{ variant }}:"{{ field }}"::timestamp_ntz
+    ELSE TO_TIMESTAMP({{ variant }}:"{{ field }}"::varchar, 'YYYYMMDDHHMISSFF3')
+  END::timestamp
+{%- endmacro %}
+
+{# Both branches are cast, as the column is either a timestamp or a string #}
+{% macro duckdb__tick_time(field) -%}
+  COALESCE(
+    TRY_STRPTIME("{{ field }}"::varchar, '%Y%m%d%H%M%S%g'),
+    TRY_CAST("{{ field }}" AS timestamp)
+  )
+{%- endmacro %}
+
+
+/* Path of the file a tick was read from */
+{% macro tick_source_file_name() -%}
+  {{ return(adapter.dispatch('tick_source_file_name')()) }}
+{%- endmacro %}
+
+{% macro snowflake__tick_source_file_name() -%}
+  metadata$filename
+{%- endmacro %}
+
+{# Added by the filename option of read_parquet() #}
+{% macro duckdb__tick_source_file_name() -%}
+  filename
+{%- endmacro %}
@@ -0,0 +1,38 @@
+-- This model bins the returns of each bar type into equal-width bins between their minimum and maximum
+-- The last bin includes the maximum return, like numpy.histogram
+
+{% set num_bins = 50 %}  -- Adjust this value to change the number of bins
+
+-- Calculate the range of returns and the width of each bin for each bar type
+WITH return_range AS (
+  SELECT
+    bar_type,
+    MIN(return_value)                                        AS min_return,
+    (MAX(return_value) - MIN(return_value)) / {{ num_bins }} AS bin_width
+  FROM {{ ref('int__es_equity_index_future__bar_returns') }}
+  GROUP BY bar_type
+),
+
+-- Assign each return to a bin
+binned_returns AS (
+  SELECT
+    r.bar_type,
+    CASE
+      WHEN g.bin_width = 0 THEN 0
+      ELSE LEAST(FLOOR((r.return_value - g.min_return) / g.bin_width), {{ num_bins - 1 }})
+    END AS bin_index
+  FROM {{ ref('int__es_equity_index_future__bar_returns') }} r
+  INNER JOIN return_range g ON r.bar_type = g.bar_type
+)
+
+-- Count the returns in each bin
+SELECT
+  b.bar_type,
+  b.bin_index,
+  g.min_return + b.bin_index * g.bin_width       AS bin_lower_bound,
+  g.min_return + (b.bin_index + 1) * g.bin_width AS bin_upper_bound,
+  COUNT(*)                                       AS return_count
+FROM binned_returns b
+INNER JOIN return_range g ON b.bar_type = g.bar_type
+GROUP BY b.bar_type, b.bin_index, g.min_return, g.bin_width
+ORDER BY b.bar_type, b.bin_index
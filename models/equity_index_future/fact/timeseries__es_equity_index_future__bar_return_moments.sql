@@ -0,0 +1,52 @@
+-- This model computes the moments of the returns of each bar type and applies the Jarque-Bera normality test
+-- Skewness and kurtosis use the biased (population) central moments, like scipy.stats.jarque_bera
+-- Note: under normality the JB statistic follows a chi-squared distribution with 2 degrees of freedom,
+-- whose survival function is EXP(-JB / 2).
+
+-- Calculate the count and mean of returns for each bar type
+WITH return_stats AS (
+  SELECT
+    bar_type,
+    COUNT(*)          AS return_count,
+    AVG(return_value) AS mean_return
+  FROM {{ ref('int__es_equity_index_future__bar_returns') }}
+  GROUP BY bar_type
+),
+
+-- Calculate the second, third and fourth central moments of returns for each bar type
+central_moments AS (
+  SELECT
+    r.bar_type,
+    AVG(POWER(r.return_value - s.mean_return, 2)) AS m2,
+    AVG(POWER(r.return_value - s.mean_return, 3)) AS m3,
+    AVG(POWER(r.return_value - s.mean_return, 4)) AS m4
+  FROM {{ ref('int__es_equity_index_future__bar_returns') }} r
+  INNER JOIN return_stats s ON r.bar_type = s.bar_type
+  GROUP BY r.bar_type
+),
+
+-- Derive the skewness and excess kurtosis from the central moments
+shape_stats AS (
+  SELECT
+    s.bar_type,
+    s.return_count,
+    s.mean_return,
+    m.m2                      AS return_variance,
+    m.m3 / POWER(m.m2, 1.5)   AS return_skewness,
+    m.m4 / POWER(m.m2, 2) - 3 AS return_excess_kurtosis
+  FROM return_stats s
+  INNER JOIN central_moments m ON s.bar_type = m.bar_type
+)
+
+-- Compute the Jarque-Bera statistic and its p-value for each bar type
+SELECT
+  bar_type,
+  return_count,
+  mean_return,
+  return_variance,
+  return_skewness,
+  return_excess_kurtosis,
+  return_count / 6 * (POWER(return_skewness, 2) + POWER(return_excess_kurtosis, 2) / 4)            AS jb_statistic,
+  EXP(-(return_count / 6 * (POWER(return_skewness, 2) + POWER(return_excess_kurtosis, 2) / 4)) / 2) AS jb_p_value
+FROM shape_stats
+ORDER BY bar_type
@@ -0,0 +1,31 @@
+-- This model computes a fixed set of sample quantiles of the returns of each bar type, used for Q-Q plots
+-- The quantile levels are the plotting positions (i - 0.5) / num_quantiles, so the tails are included
+-- whatever the number of returns
+
+{% set num_quantiles = 500 %}  -- Adjust this value to change the number of points of the Q-Q plots
+
+-- Generate the quantile levels
+WITH quantile_levels AS (
+  SELECT (generated_number::int - 0.5) / {{ num_quantiles }} AS quantile_level
+  FROM ({{ dbt_utils.generate_series(num_quantiles) }}) AS levels
+),
+
+-- Rank returns within each bar type
+ranked_returns AS (
+  SELECT
+    bar_type,
+    return_value,
+    ROW_NUMBER() OVER (PARTITION BY bar_type ORDER BY return_value) AS return_rank,
+    COUNT(*) OVER (PARTITION BY bar_type)                           AS return_count
+  FROM {{ ref('int__es_equity_index_future__bar_returns') }}
+)
+
+-- Select the order statistic closest to each quantile level
+SELECT
+  r.bar_type,
+  q.quantile_level,
+  r.return_value AS return_quantile
+FROM ranked_returns r
+INNER JOIN quantile_levels q
+  ON r.return_rank = GREATEST(1, CEIL(q.quantile_level * r.return_count))
+ORDER BY r.bar_type, q.quantile_level
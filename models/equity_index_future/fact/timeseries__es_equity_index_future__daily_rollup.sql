@@ -0,0 +1,49 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
+/*
+  One row per contract and day, with the same columns as the minute rollup, aggregated from
+  its rows rather than from the ticks.
+*/
+
+-- Select the minutes of the contracts rebuilt in the minute rollup since the last build
+WITH minutes AS (
+  SELECT *
+  FROM {{ ref('timeseries__es_equity_index_future__minute_rollup') }}
+  {% if is_incremental() %}
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('timeseries__es_equity_index_future__minute_rollup') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
+)
+
+-- Aggregate the minutes of each day, the VWAP being re-weighted by the volume of each minute
+SELECT
+  contract_symbol,
+  DATE_TRUNC('day', minute_start)                       AS day_start,
+  MIN(first_trading_datetime)                           AS first_trading_datetime,
+  MAX(last_trading_datetime)                            AS last_trading_datetime,
+  MIN_BY(open, minute_start)                            AS open,
+  MAX(high)                                             AS high,
+  MIN(low)                                              AS low,
+  MAX_BY(close, minute_start)                           AS close,
+  MIN_BY(unadjusted_open, minute_start)                 AS unadjusted_open,
+  MAX(unadjusted_high)                                  AS unadjusted_high,
+  MIN(unadjusted_low)                                   AS unadjusted_low,
+  MAX_BY(unadjusted_close, minute_start)                AS unadjusted_close,
+  SUM(volume)                                           AS volume,
+  SUM(tick_count)                                       AS tick_count,
+  SUM(dollars_traded)                                   AS dollars_traded,
+  SUM(vwap * volume) / NULLIF(SUM(volume), 0)           AS vwap,
+  SUM(dollars_traded) / NULLIF(SUM(volume), 0)          AS unadjusted_vwap,
+  CURRENT_TIMESTAMP::timestamp                          AS transformed_at
+FROM minutes
+GROUP BY contract_symbol, DATE_TRUNC('day', minute_start)
+ORDER BY day_start, contract_symbol
@@ -0,0 +1,56 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
+/*
+  One row per contract and minute of the continuous series, with the OHLC of the back-adjusted
+  and unadjusted prices, volume, tick count and VWAP. Plots and time range queries read these
+  rows instead of scanning every tick, and the daily rollup is aggregated from them.
+*/
+
+-- Select the ticks of the contracts rebuilt in the continuous series since the last build
+WITH ticks AS (
+  SELECT
+    contract_symbol,
+    trading_datetime,
+    row_num,
+    price,
+    unadjusted_price,
+    volume
+  FROM {{ ref('int__es_equity_index_future__continuous') }}
+  {% if is_incremental() %}
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('int__es_equity_index_future__continuous') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
+)
+
+-- Aggregate the ticks of each minute, taking the open and close by the tick's row number
+SELECT
+  contract_symbol,
+  DATE_TRUNC('minute', trading_datetime)                     AS minute_start,
+  MIN(trading_datetime)                                      AS first_trading_datetime,
+  MAX(trading_datetime)                                      AS last_trading_datetime,
+  MIN_BY(price, row_num)                                     AS open,
+  MAX(price)                                                 AS high,
+  MIN(price)                                                 AS low,
+  MAX_BY(price, row_num)                                     AS close,
+  MIN_BY(unadjusted_price, row_num)                          AS unadjusted_open,
+  MAX(unadjusted_price)                                      AS unadjusted_high,
+  MIN(unadjusted_price)                                      AS unadjusted_low,
+  MAX_BY(unadjusted_price, row_num)                          AS unadjusted_close,
+  SUM(volume)                                                AS volume,
+  COUNT(*)                                                   AS tick_count,
+  SUM(unadjusted_price * volume)                             AS dollars_traded,
+  SUM(price * volume) / NULLIF(SUM(volume), 0)               AS vwap,
+  SUM(unadjusted_price * volume) / NULLIF(SUM(volume), 0)    AS unadjusted_vwap,
+  CURRENT_TIMESTAMP::timestamp                               AS transformed_at
+FROM ticks
+GROUP BY contract_symbol, DATE_TRUNC('minute', trading_datetime)
+ORDER BY minute_start, contract_symbol
@@ -1,3 +1,10 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="month_start",
+    )
+}}
 
 -- Transforms weekly bar counts into a monthly view
 -- Aggregates tick, volume, and dollar bar counts for each week
@@ -9,6 +16,14 @@ WITH weekly_counts AS (
     volume_bar_count,
     dollar_bar_count
   FROM {{ ref('timeseries__es_equity_index_future__weekly_bar_counts') }}
+  {% if is_incremental() %}
+    /* Only recompute the months of the weeks recounted since the last build */
+    WHERE DATE_TRUNC('month', week_start) IN (
+      SELECT DATE_TRUNC('month', week_start)
+      FROM {{ ref('timeseries__es_equity_index_future__weekly_bar_counts') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
 ),
 
 -- Calculates monthly statistics for each bar type (tick, volume, dollar)
@@ -52,6 +67,7 @@ SELECT
   bar_type,
   bar_count_variance,
   avg_monthly_bar_count,
-  total_bar_count
+  total_bar_count,
+  CURRENT_TIMESTAMP::timestamp AS transformed_at
 FROM monthly_stats
 ORDER BY month_start, bar_type
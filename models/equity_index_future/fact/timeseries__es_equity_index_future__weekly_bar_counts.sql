@@ -1,8 +1,38 @@
-WITH tick_bars AS (
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="week_start",
+    )
+}}
+
+{% set bar_models = [
+    "int__es_equity_index_future__tick_bars",
+    "int__es_equity_index_future__volume_bars",
+    "int__es_equity_index_future__dollars_traded_bars",
+] %}
+
+WITH
+{% if is_incremental() %}
+  /* Weeks with bars rebuilt since the last build, which are recounted from scratch */
+  touched_weeks AS (
+    {% for bar_model in bar_models %}
+      SELECT DISTINCT DATE_TRUNC('week', bar_start_time) AS week_start
+      FROM {{ ref(bar_model) }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+      {% if not loop.last %}UNION{% endif %}
+    {% endfor %}
+  ),
+{% endif %}
+
+tick_bars AS (
   SELECT
     DATE_TRUNC('week', bar_start_time) AS week_start,
     COUNT(*)                           AS tick_bar_count
   FROM {{ ref('int__es_equity_index_future__tick_bars') }}
+  {% if is_incremental() %}
+    WHERE DATE_TRUNC('week', bar_start_time) IN (SELECT week_start FROM touched_weeks)
+  {% endif %}
   GROUP BY DATE_TRUNC('week', bar_start_time)
 ),
 
@@ -11,6 +41,9 @@ volume_bars AS (
     DATE_TRUNC('week', bar_start_time) AS week_start,
     COUNT(*)                           AS volume_bar_count
   FROM {{ ref('int__es_equity_index_future__volume_bars') }}
+  {% if is_incremental() %}
+    WHERE DATE_TRUNC('week', bar_start_time) IN (SELECT week_start FROM touched_weeks)
+  {% endif %}
   GROUP BY DATE_TRUNC('week', bar_start_time)
 ),
 
@@ -19,6 +52,9 @@ dollar_bars AS (
     DATE_TRUNC('week', bar_start_time) AS week_start,
     COUNT(*)                           AS dollar_bar_count
   FROM {{ ref('int__es_equity_index_future__dollars_traded_bars') }}
+  {% if is_incremental() %}
+    WHERE DATE_TRUNC('week', bar_start_time) IN (SELECT week_start FROM touched_weeks)
+  {% endif %}
   GROUP BY DATE_TRUNC('week', bar_start_time)
 )
 
@@ -26,7 +62,8 @@ SELECT
   COALESCE(t.week_start, v.week_start, d.week_start) AS week_start,
   COALESCE(t.tick_bar_count, 0)                      AS tick_bar_count,
   COALESCE(v.volume_bar_count, 0)                    AS volume_bar_count,
-  COALESCE(d.dollar_bar_count, 0)                    AS dollar_bar_count
+  COALESCE(d.dollar_bar_count, 0)                    AS dollar_bar_count,
+  CURRENT_TIMESTAMP::timestamp                       AS transformed_at
 FROM tick_bars t
 FULL OUTER JOIN volume_bars v ON t.week_start = v.week_start
 FULL OUTER JOIN dollar_bars d ON t.week_start = d.week_start
@@ -1,17 +1,51 @@
 {{
     config(
+        materialized="incremental",
+        incremental_strategy="append",
         pre_hook="""
-            alter external table {{ source('mock_provider', 'equity_index_future__tick_data') }} refresh;
+            {{ load_tick_data(
+                source('mock_provider', 'equity_index_future__tick_data'),
+                source('mock_provider', 'equity_index_future__tick_data_loaded')
+            ) }}
         """,
     )
 }}
 
+/*
+  Incremental runs only append the rows of parquet files that were not loaded yet.
+  The fields are read by the macros of macros/tick_data_source.sql, so that the model
+  runs both on Snowflake and on the local DuckDB target.
+
+  With the tick_data_load_mode var set to copy_into, the pre-hook first copies the new
+  files into a native, typed table on Snowflake, which is read instead of the external
+  table. Both keep the same file names, so switching modes does not load a file twice.
+*/
+{% if var('tick_data_load_mode') == 'copy_into' and target.type == 'snowflake' %}
+SELECT
+  index_internal_id,
+  data_provider,
+  contract_symbol,
+  price::double                                                       AS price,
+  trading_datetime,
+  volume,
+  source_file_name,
+  CURRENT_TIMESTAMP::timestamp                                        AS ingested_at
+FROM {{ source('mock_provider', 'equity_index_future__tick_data_loaded') }}
+{% if is_incremental() %}
+  WHERE source_file_name NOT IN (SELECT DISTINCT source_file_name FROM {{ this }})
+{% endif %}
+{% else %}
 SELECT
   internal_id::varchar                                                AS index_internal_id,
   data_provider::varchar                                              AS data_provider,
-  value:"Instrument"::varchar                                         AS contract_symbol,
-  value:"Price"::float                                                AS price,
-  TO_TIMESTAMP(value:"Time"::varchar, 'YYYYMMDDHHMISSFF3')::timestamp AS trading_datetime,
-  value:"Volume"::int                                                 AS volume,
-  CURRENT_TIMESTAMP()::timestamp                                      AS ingested_at
+  {{ tick_field('Instrument', 'varchar') }}                           AS contract_symbol,
+  {{ tick_field('Price', 'double') }}                                 AS price,
+  {{ tick_time('Time') }}                                             AS trading_datetime,
+  {{ tick_field('Volume', 'int') }}                                   AS volume,
+  {{ tick_source_file_name() }}::varchar                              AS source_file_name,
+  CURRENT_TIMESTAMP::timestamp                                        AS ingested_at
 FROM {{ source('mock_provider', 'equity_index_future__tick_data') }}
+{% if is_incremental() %}
+  WHERE {{ tick_source_file_name() }} NOT IN (SELECT DISTINCT source_file_name FROM {{ this }})
+{% endif %}
+{% endif %}
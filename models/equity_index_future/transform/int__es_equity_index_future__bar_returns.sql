@@ -0,0 +1,45 @@
+-- This model computes the return of each tick, volume and dollar bar relative to the previous bar of the same type
+-- It is shared by the fact models analysing the distribution and serial correlation of bar returns
+
+-- Combine data from all three bar types into a single CTE
+WITH bar_data AS (
+  SELECT
+    contract_symbol,
+    bar_start_time,
+    close,
+    'tick' AS bar_type
+  FROM {{ ref('int__es_equity_index_future__tick_bars') }}
+  UNION ALL
+  SELECT
+    contract_symbol,
+    bar_start_time,
+    close,
+    'volume' AS bar_type
+  FROM {{ ref('int__es_equity_index_future__volume_bars') }}
+  UNION ALL
+  SELECT
+    contract_symbol,
+    bar_start_time,
+    close,
+    'dollar' AS bar_type
+  FROM {{ ref('int__es_equity_index_future__dollars_traded_bars') }}
+),
+
+-- Calculate percentage return using the current and previous close prices
+price_returns AS (
+  SELECT
+    bar_type,
+    contract_symbol,
+    bar_start_time,
+    (close - LAG(close) OVER (PARTITION BY bar_type ORDER BY bar_start_time, contract_symbol)) / LAG(close) OVER (PARTITION BY bar_type ORDER BY bar_start_time, contract_symbol) AS return_value
+  FROM bar_data
+)
+
+-- Output the returns, without the first bar of each type which has no previous bar
+SELECT
+  bar_type,
+  contract_symbol,
+  bar_start_time,
+  return_value
+FROM price_returns
+WHERE return_value IS NOT NULL
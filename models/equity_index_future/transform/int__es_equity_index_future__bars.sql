@@ -0,0 +1,199 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
+/*
+  Tick, volume and dollar bars of every size listed in the bar_* vars of dbt_project.yml, built
+  from a single scan of the continuous series into one long table keyed by (bar_type, threshold),
+  e.g. to compare the statistical properties of several bar sizes:
+
+    dbt run -s int__es_equity_index_future__bars --full-refresh --vars '{bar_ticks_per_bar: [50000, 100000]}'
+
+  Volume and dollar sizes default to the average volume and dollars traded per tick bar of each
+  tick bar size, computed in the same scan. Incremental builds keep the sizes of the last full
+  refresh, so changing the vars requires a full refresh.
+
+  The running counters are computed once per tick, and each size is aggregated from them by its
+  own GROUP BY on FLOOR(counter / threshold), rather than by copying every tick once per size.
+*/
+
+{% set ticks_per_bar = var('bar_ticks_per_bar') %}
+{% set volume_thresholds = var('bar_volume_thresholds') %}
+{% set dollar_thresholds = var('bar_dollar_thresholds') %}
+
+{#- Bar sizes as (bar type, index of the size within the type, running counter of the type) -#}
+{% set bar_sizes = [] %}
+{% for bar_type, num_sizes, counter in [
+  ('tick', ticks_per_bar | length, 'row_num - 1'),
+  ('volume', (volume_thresholds or ticks_per_bar) | length, 'cumulative_volume'),
+  ('dollar', (dollar_thresholds or ticks_per_bar) | length, 'cumulative_dollars'),
+] %}
+  {% for size_index in range(1, num_sizes + 1) %}
+    {% do bar_sizes.append((bar_type, size_index, counter)) %}
+  {% endfor %}
+{% endfor %}
+
+-- Select the ticks from the continuous series, with their running volume and dollars traded
+WITH numbered_ticks AS (
+  SELECT
+    contract_symbol,
+    trading_datetime,
+    row_num,
+    price,
+    volume AS tick_volume,
+    SUM(volume) OVER (
+      PARTITION BY contract_symbol ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+    )                   AS cumulative_volume,
+    SUM(price * volume) OVER (
+      PARTITION BY contract_symbol ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+    )                   AS cumulative_dollars
+  FROM {{ ref('int__es_equity_index_future__continuous') }}
+  {% if is_incremental() %}
+    /* Only rebuild the bars of the contracts rebuilt in the continuous series since the last build */
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('int__es_equity_index_future__continuous') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
+),
+
+{% if is_incremental() %}
+-- Keep the bar sizes of the last full refresh, so that all contracts share the same sizes
+thresholds AS (
+  SELECT DISTINCT
+    bar_type,
+    threshold
+  FROM {{ this }}
+),
+{% else %}
+tick_sizes AS (
+  SELECT ticks_per_bar
+  FROM (VALUES {% for size in ticks_per_bar %}({{ size }}){{ ", " if not loop.last }}{% endfor %}) AS sizes (ticks_per_bar)
+),
+
+-- Count the ticks, volume and dollars traded of each contract to derive the default sizes
+contract_stats AS (
+  SELECT
+    contract_symbol,
+    COUNT(*)                 AS num_ticks,
+    SUM(tick_volume)         AS total_volume,
+    SUM(price * tick_volume) AS total_dollars
+  FROM numbered_ticks
+  GROUP BY contract_symbol
+),
+
+-- Average volume and dollars traded per tick bar (bars restart with every contract)
+tick_bar_stats AS (
+  SELECT
+    tick_sizes.ticks_per_bar,
+    SUM(CEIL(contract_stats.num_ticks / tick_sizes.ticks_per_bar)) AS num_bars,
+    SUM(contract_stats.total_volume)                               AS total_volume,
+    SUM(contract_stats.total_dollars)                              AS total_dollars
+  FROM tick_sizes
+  CROSS JOIN contract_stats
+  GROUP BY tick_sizes.ticks_per_bar
+),
+
+-- Bar sizes to build, one row per bar type and threshold
+thresholds AS (
+  SELECT
+    'tick'                        AS bar_type,
+    ticks_per_bar::decimal(38, 0) AS threshold
+  FROM tick_sizes
+
+  UNION ALL
+
+  {% if volume_thresholds %}
+  SELECT
+    'volume'                  AS bar_type,
+    threshold::decimal(38, 0) AS threshold
+  FROM (VALUES {% for size in volume_thresholds %}({{ size }}){{ ", " if not loop.last }}{% endfor %}) AS sizes (threshold)
+  {% else %}
+  SELECT
+    'volume'                                                   AS bar_type,
+    ROUND(total_volume::numeric / num_bars, 0)::decimal(38, 0) AS threshold
+  FROM tick_bar_stats
+  {% endif %}
+
+  UNION ALL
+
+  {% if dollar_thresholds %}
+  SELECT
+    'dollar'                  AS bar_type,
+    threshold::decimal(38, 0) AS threshold
+  FROM (VALUES {% for size in dollar_thresholds %}({{ size }}){{ ", " if not loop.last }}{% endfor %}) AS sizes (threshold)
+  {% else %}
+  SELECT
+    'dollar'                                                    AS bar_type,
+    ROUND(total_dollars::numeric / num_bars, 0)::decimal(38, 0) AS threshold
+  FROM tick_bar_stats
+  {% endif %}
+),
+{% endif %}
+
+-- Number the sizes of each bar type, to hold them in the columns of a single row (a size missing
+-- from the table of an incremental build is NULL, and skipped)
+numbered_thresholds AS (
+  SELECT
+    bar_type,
+    threshold,
+    ROW_NUMBER() OVER (PARTITION BY bar_type ORDER BY threshold) AS size_index
+  FROM (SELECT DISTINCT bar_type, threshold FROM thresholds)
+),
+
+threshold_columns AS (
+  SELECT
+    {%- for bar_type, size_index, counter in bar_sizes %}
+    MAX(CASE WHEN bar_type = '{{ bar_type }}' AND size_index = {{ size_index }} THEN threshold END)
+      AS {{ bar_type }}_threshold_{{ size_index }}{{ "," if not loop.last }}
+    {%- endfor %}
+  FROM numbered_thresholds
+),
+
+-- Aggregate the bars of each size, joining the ticks with the single row of thresholds
+bars AS (
+  {%- for bar_type, size_index, counter in bar_sizes %}
+  {{
+    build_bars(
+      "(
+        SELECT
+          '" ~ bar_type ~ "' AS bar_type,
+          threshold_columns." ~ bar_type ~ "_threshold_" ~ size_index ~ " AS threshold,
+          numbered_ticks.*
+        FROM numbered_ticks
+        CROSS JOIN threshold_columns
+        WHERE threshold_columns." ~ bar_type ~ "_threshold_" ~ size_index ~ " IS NOT NULL
+      )",
+      "FLOOR((" ~ counter ~ ") / threshold)",
+      include_dollars_traded=true,
+      group_columns=['bar_type', 'threshold'],
+    )
+  }}
+  {{ "UNION ALL" if not loop.last }}
+  {%- endfor %}
+)
+
+-- Output the bars, ordered so that queries filtering on a bar type and threshold prune well
+SELECT
+  bar_type,
+  threshold,
+  contract_symbol,
+  bar_start_time,
+  bar_end_time,
+  open,
+  high,
+  low,
+  close,
+  volume,
+  total_dollars_traded,
+  tick_count,
+  start_row_num,
+  end_row_num,
+  CURRENT_TIMESTAMP::timestamp AS transformed_at
+FROM bars
+ORDER BY bar_type, threshold, contract_symbol, bar_start_time
@@ -1,101 +1,104 @@
-/* Extracts the contract month and year from the contract symbol. */
-WITH parsed AS (
-  SELECT
-    contract_symbol,
-    SUBSTRING(contract_symbol, 3, 1) AS contract_month,
-    CASE
-      WHEN CAST(SUBSTRING(contract_symbol, 4, 2) AS int) < 80 THEN 2000 + CAST(SUBSTRING(contract_symbol, 4, 2) AS int)
-      ELSE 1900 + CAST(SUBSTRING(contract_symbol, 4, 2) AS int)
-    END                              AS contract_year,
-    price,
-    trading_datetime,
-    volume
-  FROM {{ ref('stg__mock_provider__equity_index_future__tick_data') }}
-  WHERE index_internal_id = 'ES_INDEX_FUTURES'
-),
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
 
-/* Orders contracts and assigns row numbers */
-/* The row_num field is used for the cumulative adjustments since we have some identical trading_datetime */
-ordered AS (
+/* The roll dates and cumulative adjustment of every contract */
+WITH roll_calendar AS (
   SELECT
     contract_symbol,
-    CASE contract_month
-      WHEN 'H' THEN 1
-      WHEN 'M' THEN 2
-      WHEN 'U' THEN 3
-      WHEN 'Z' THEN 4
-    END                                                                        AS month_order,
-    contract_month,
     contract_year,
-    price,
-    trading_datetime,
-    volume,
-    ROW_NUMBER() OVER (PARTITION BY contract_symbol ORDER BY trading_datetime) AS row_num
-  FROM parsed
+    month_order,
+    cumulative_adjustment
+  FROM {{ ref('int__es_equity_index_future__roll_calendar') }}
 ),
 
-/* Identifies roll dates */
-roll_adjustments AS (
+ticks AS (
   SELECT
     contract_symbol,
-    contract_year,
-    contract_month,
-    month_order,
-    trading_datetime,
     price,
+    trading_datetime,
     volume,
-    row_num,
-    LEAD(contract_symbol) OVER (ORDER BY contract_year, month_order, row_num) AS next_contract_symbol,
-    LEAD(price) OVER (ORDER BY contract_year, month_order, row_num)           AS next_price
-  FROM ordered
+    ingested_at
+  FROM {{ ref('stg__mock_provider__equity_index_future__tick_data') }}
+  WHERE index_internal_id = 'ES_INDEX_FUTURES'
 ),
 
-/* Calculate adjustment_factor only at roll dates */
-adjustment_factors AS (
-  SELECT
-    *,
-    CASE
-      WHEN contract_symbol != next_contract_symbol THEN next_price - price
-      ELSE 0
-    END AS adjustment_factor
-  FROM roll_adjustments
+{% if is_incremental() %}
+/* Contracts with ticks ingested since the last build, whose ticks are numbered again */
+updated_contracts AS (
+  SELECT DISTINCT contract_symbol
+  FROM ticks
+  WHERE ingested_at > (SELECT COALESCE(MAX(ingested_at), '1900-01-01'::timestamp) FROM {{ this }})
 ),
 
-/* Applies the cumulative adjustments to create a back-adjusted continuous price series. */
-cumulative_adjustments AS (
-  SELECT
-    *,
-    SUM(adjustment_factor) OVER (
-      ORDER BY contract_year, month_order, row_num DESC
-      ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING
-    ) AS cumulative_adjustment
-  FROM adjustment_factors
+/* Other contracts whose adjustment changed, e.g. every earlier contract when a new contract
+   starts trading, whose already numbered ticks are only adjusted again. Ticks appended to the
+   latest contract do not change the adjustment of any other contract. */
+readjusted_contracts AS (
+  SELECT roll_calendar.contract_symbol
+  FROM roll_calendar
+  INNER JOIN (
+    SELECT
+      contract_symbol,
+      MAX(cumulative_adjustment) AS cumulative_adjustment
+    FROM {{ this }}
+    GROUP BY contract_symbol
+  ) AS built
+    ON roll_calendar.contract_symbol = built.contract_symbol
+  WHERE
+    roll_calendar.cumulative_adjustment != built.cumulative_adjustment
+    AND roll_calendar.contract_symbol NOT IN (SELECT contract_symbol FROM updated_contracts)
 ),
+{% endif %}
 
-final_series AS (
+/* Assigns row numbers within each contract */
+/* The row_num field orders ticks with identical trading_datetime */
+numbered AS (
   SELECT
-    trading_datetime,
     contract_symbol,
-    contract_year,
-    month_order,
-    row_num,
     price,
-    price + cumulative_adjustment AS adjusted_price,
-    cumulative_adjustment,
-    volume
-  FROM cumulative_adjustments
+    trading_datetime,
+    volume,
+    ingested_at,
+    ROW_NUMBER() OVER (PARTITION BY contract_symbol ORDER BY trading_datetime) AS row_num
+  FROM ticks
+  {% if is_incremental() %}
+    WHERE contract_symbol IN (SELECT contract_symbol FROM updated_contracts)
+  {% endif %}
+
+  {% if is_incremental() %}
+  UNION ALL
+
+  SELECT
+    contract_symbol,
+    unadjusted_price AS price,
+    trading_datetime,
+    volume,
+    ingested_at,
+    row_num
+  FROM {{ this }}
+  WHERE contract_symbol IN (SELECT contract_symbol FROM readjusted_contracts)
+  {% endif %}
 )
 
-/* Returns the continuous price series with both the original and adjusted prices. */
+/* Returns the continuous price series with both the original and back-adjusted prices. */
 SELECT
-  contract_symbol,
-  trading_datetime,
-  contract_year,
-  month_order,
-  row_num,
-  price          AS unadjusted_price,
-  adjusted_price AS price,
-  cumulative_adjustment,
-  volume
-FROM final_series
-ORDER BY contract_year, month_order, row_num
+  numbered.contract_symbol,
+  numbered.trading_datetime,
+  roll_calendar.contract_year,
+  roll_calendar.month_order,
+  numbered.row_num,
+  numbered.price                                       AS unadjusted_price,
+  numbered.price + roll_calendar.cumulative_adjustment AS price,
+  roll_calendar.cumulative_adjustment,
+  numbered.volume,
+  numbered.ingested_at,
+  CURRENT_TIMESTAMP::timestamp                         AS transformed_at
+FROM numbered
+INNER JOIN roll_calendar
+  ON numbered.contract_symbol = roll_calendar.contract_symbol
+ORDER BY roll_calendar.contract_year, roll_calendar.month_order, numbered.row_num
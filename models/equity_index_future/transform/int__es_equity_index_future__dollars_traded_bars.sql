@@ -1,3 +1,11 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
 -- Calculate the total number of bars and total dollar value from continuous futures data
 WITH tick_bar_stats AS (
   SELECT
@@ -8,8 +16,15 @@ WITH tick_bar_stats AS (
 
 -- Calculate the average dollar value per bar to determine the target dollar value for each dollar bar
 avg_dollar_per_bar AS (
-  SELECT ROUND(total_dollar_value::numeric / num_bars, 0) AS avg_dollar_per_bar
-  FROM tick_bar_stats
+  {% if is_incremental() %}
+    /* Incremental builds keep the threshold of the last full refresh, so that the bars
+       of the contracts which are not rebuilt stay consistent with the new ones */
+    SELECT MAX(bar_threshold) AS avg_dollar_per_bar
+    FROM {{ this }}
+  {% else %}
+    SELECT ROUND(total_dollar_value::numeric / num_bars, 0) AS avg_dollar_per_bar
+    FROM tick_bar_stats
+  {% endif %}
 ),
 
 -- Select and rename relevant columns from continuous futures data
@@ -19,55 +34,21 @@ numbered_ticks AS (
     trading_datetime,
     row_num,
     price,
-    volume         AS tick_volume,
-    price * volume AS dollars_traded
+    volume AS tick_volume
   FROM {{ ref('int__es_equity_index_future__continuous') }}
+  {% if is_incremental() %}
+    /* Only rebuild the bars of the contracts rebuilt in the continuous series since the last build */
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('int__es_equity_index_future__continuous') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
 ),
 
--- Calculate cumulative dollars traded and assign dollar groups
-dollar_groups AS (
-  SELECT
-    *,
-    SUM(dollars_traded) OVER (PARTITION BY contract_symbol ORDER BY row_num)                                                              AS cumulative_dollars,
-    FLOOR(SUM(dollars_traded) OVER (PARTITION BY contract_symbol ORDER BY row_num) / (SELECT avg_dollar_per_bar FROM avg_dollar_per_bar)) AS dollar_group
-  FROM numbered_ticks
-),
-
--- Perform window calculations to compute bar statistics (OHLC, volume, tick count, dollars traded)
-window_calcs AS (
-  SELECT
-    *,
-    FIRST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num)                                                         AS bar_start_time,
-    LAST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS bar_end_time,
-    FIRST_VALUE(price) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num)                                                                    AS open,
-    MAX(price) OVER (PARTITION BY contract_symbol, dollar_group)                                                                                             AS high,
-    MIN(price) OVER (PARTITION BY contract_symbol, dollar_group)                                                                                             AS low,
-    LAST_VALUE(price) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)            AS close,
-    SUM(tick_volume) OVER (PARTITION BY contract_symbol, dollar_group)                                                                                       AS volume,
-    SUM(dollars_traded) OVER (PARTITION BY contract_symbol, dollar_group)                                                                                    AS total_dollars_traded,
-    COUNT(*) OVER (PARTITION BY contract_symbol, dollar_group)                                                                                               AS tick_count,
-    FIRST_VALUE(row_num) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num)                                                                  AS start_row_num,
-    LAST_VALUE(row_num) OVER (PARTITION BY contract_symbol, dollar_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)          AS end_row_num
-  FROM dollar_groups
-),
-
--- Select distinct rows to create the final dollars-traded bars
+-- Assign ticks to dollar groups from the cumulative dollars traded and aggregate them into bars
 dollars_traded_bars AS (
-  SELECT DISTINCT
-    contract_symbol,
-    dollar_group,
-    bar_start_time,
-    bar_end_time,
-    open,
-    high,
-    low,
-    close,
-    volume,
-    total_dollars_traded,
-    tick_count,
-    start_row_num,
-    end_row_num
-  FROM window_calcs
+  {{ build_bars('numbered_ticks', cumulative_bar_group('price * tick_volume', '(SELECT avg_dollar_per_bar FROM avg_dollar_per_bar)'), include_dollars_traded=true) }}
 )
 
 -- Output the dollars-traded bars, ordered by contract symbol and bar start time
@@ -83,6 +64,8 @@ SELECT
   total_dollars_traded,
   tick_count,
   start_row_num,
-  end_row_num
+  end_row_num,
+  (SELECT avg_dollar_per_bar FROM avg_dollar_per_bar) AS bar_threshold,
+  CURRENT_TIMESTAMP::timestamp AS transformed_at
 FROM dollars_traded_bars
 ORDER BY contract_symbol, bar_start_time
@@ -0,0 +1,75 @@
+/*
+  One row per contract, in roll order, holding the roll to the next contract and the adjustment
+  which back-adjusts the contract's prices onto the latest contract, like analyses/identified_rolls.csv.
+  The continuous series joins its ticks to this calendar, so that the roll logic only runs over
+  a few rows instead of a window over every tick.
+*/
+
+/* Extracts the contract month and year from the contract symbol. */
+WITH parsed AS (
+  SELECT
+    contract_symbol,
+    SUBSTRING(contract_symbol, 3, 1) AS contract_month,
+    CASE
+      WHEN CAST(SUBSTRING(contract_symbol, 4, 2) AS int) < 80 THEN 2000 + CAST(SUBSTRING(contract_symbol, 4, 2) AS int)
+      ELSE 1900 + CAST(SUBSTRING(contract_symbol, 4, 2) AS int)
+    END                              AS contract_year,
+    price,
+    trading_datetime
+  FROM {{ ref('stg__mock_provider__equity_index_future__tick_data') }}
+  WHERE index_internal_id = 'ES_INDEX_FUTURES'
+),
+
+/* First and last tick of each contract, aggregated in parallel per contract */
+contracts AS (
+  SELECT
+    contract_symbol,
+    contract_year,
+    contract_month,
+    CASE contract_month
+      WHEN 'H' THEN 1
+      WHEN 'M' THEN 2
+      WHEN 'U' THEN 3
+      WHEN 'Z' THEN 4
+    END                             AS month_order,
+    MIN(trading_datetime)           AS first_trading_datetime,
+    MAX(trading_datetime)           AS last_trading_datetime,
+    MIN_BY(price, trading_datetime) AS first_price,
+    MAX_BY(price, trading_datetime) AS last_price,
+    COUNT(*)                        AS tick_count
+  FROM parsed
+  GROUP BY contract_symbol, contract_year, contract_month
+),
+
+/* The series rolls to the next contract at its first tick, with a gap between the last price
+   of the contract and the first price of the next one. The latest contract has no roll yet. */
+rolls AS (
+  SELECT
+    *,
+    LEAD(contract_symbol) OVER (ORDER BY contract_year, month_order)                       AS next_contract_symbol,
+    LEAD(first_trading_datetime) OVER (ORDER BY contract_year, month_order)                AS roll_datetime,
+    COALESCE(LEAD(first_price) OVER (ORDER BY contract_year, month_order) - last_price, 0) AS price_gap
+  FROM contracts
+)
+
+/* Every price of a contract is shifted by the gap of its own roll and of all the later rolls */
+SELECT
+  contract_symbol,
+  contract_year,
+  contract_month,
+  month_order,
+  first_trading_datetime,
+  last_trading_datetime,
+  tick_count,
+  first_price,
+  last_price,
+  next_contract_symbol,
+  roll_datetime,
+  price_gap,
+  SUM(price_gap) OVER (
+    ORDER BY contract_year DESC, month_order DESC
+    ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+  )                              AS cumulative_adjustment,
+  CURRENT_TIMESTAMP::timestamp   AS transformed_at
+FROM rolls
+ORDER BY contract_year, month_order
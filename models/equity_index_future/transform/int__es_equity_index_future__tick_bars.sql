@@ -1,3 +1,11 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
 {% set ticks_per_bar = 100000 %}  -- Adjust this value to change the bar size
 
 -- Select and rename relevant columns from continuous futures data
@@ -5,43 +13,27 @@ WITH numbered_ticks AS (
   SELECT
     contract_symbol,
     trading_datetime,
-    contract_year,
-    month_order,
     row_num,
-    unadjusted_price,
     price,
-    cumulative_adjustment,
     volume AS tick_volume
   FROM {{ ref('int__es_equity_index_future__continuous') }}
+  {% if is_incremental() %}
+    /* Only rebuild the bars of the contracts rebuilt in the continuous series since the last build */
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('int__es_equity_index_future__continuous') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
 ),
 
--- Group ticks into bars based on the specified number of ticks per bar
-with_tick_groups AS (
-  SELECT
-    *,
-    FLOOR((ROW_NUMBER() OVER (PARTITION BY contract_symbol ORDER BY row_num) - 1) / {{ ticks_per_bar }}) AS tick_group
-  FROM numbered_ticks
-),
-
--- Perform window calculations to compute bar statistics (OHLC, volume, tick count)
-window_calcs AS (
-  SELECT
-    *,
-    FIRST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num)                                                         AS bar_start_time,
-    LAST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS bar_end_time,
-    FIRST_VALUE(price) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num)                                                                    AS open,
-    MAX(price) OVER (PARTITION BY contract_symbol, tick_group)                                                                                             AS high,
-    MIN(price) OVER (PARTITION BY contract_symbol, tick_group)                                                                                             AS low,
-    LAST_VALUE(price) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)            AS close,
-    SUM(tick_volume) OVER (PARTITION BY contract_symbol, tick_group)                                                                                       AS volume,
-    COUNT(*) OVER (PARTITION BY contract_symbol, tick_group)                                                                                               AS tick_count,
-    FIRST_VALUE(row_num) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num)                                                                  AS start_row_num,
-    LAST_VALUE(row_num) OVER (PARTITION BY contract_symbol, tick_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)          AS end_row_num
-  FROM with_tick_groups
-),
+-- Group ticks into bars of the specified number of ticks (row_num is numbered per contract)
+tick_bars AS (
+  {{ build_bars('numbered_ticks', 'FLOOR((row_num - 1) / ' ~ ticks_per_bar ~ ')') }}
+)
 
--- Select distinct rows to create the final tick bars
-SELECT DISTINCT
+-- Output the tick bars, ordered by contract symbol and bar start time
+SELECT
   contract_symbol,
   bar_start_time,
   bar_end_time,
@@ -52,6 +44,7 @@ SELECT DISTINCT
   volume,
   tick_count,
   start_row_num,
-  end_row_num
-FROM window_calcs
+  end_row_num,
+  CURRENT_TIMESTAMP::timestamp AS transformed_at
+FROM tick_bars
 ORDER BY contract_symbol, bar_start_time
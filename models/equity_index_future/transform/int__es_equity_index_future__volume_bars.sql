@@ -1,3 +1,11 @@
+{{
+    config(
+        materialized="incremental",
+        incremental_strategy="delete+insert",
+        unique_key="contract_symbol",
+    )
+}}
+
 -- Calculate the total number of bars and total volume from tick bars
 WITH tick_bar_stats AS (
   SELECT
@@ -8,8 +16,15 @@ WITH tick_bar_stats AS (
 
 -- Calculate the average volume per bar to determine the target volume for each volume bar
 avg_volume_per_bar AS (
-  SELECT ROUND(total_volume::numeric / num_bars, 0) AS avg_volume_per_bar
-  FROM tick_bar_stats
+  {% if is_incremental() %}
+    /* Incremental builds keep the threshold of the last full refresh, so that the bars
+       of the contracts which are not rebuilt stay consistent with the new ones */
+    SELECT MAX(bar_threshold) AS avg_volume_per_bar
+    FROM {{ this }}
+  {% else %}
+    SELECT ROUND(total_volume::numeric / num_bars, 0) AS avg_volume_per_bar
+    FROM tick_bar_stats
+  {% endif %}
 ),
 
 -- Select and rename relevant columns from continuous futures data
@@ -21,50 +36,19 @@ numbered_ticks AS (
     price,
     volume AS tick_volume
   FROM {{ ref('int__es_equity_index_future__continuous') }}
+  {% if is_incremental() %}
+    /* Only rebuild the bars of the contracts rebuilt in the continuous series since the last build */
+    WHERE contract_symbol IN (
+      SELECT DISTINCT contract_symbol
+      FROM {{ ref('int__es_equity_index_future__continuous') }}
+      WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), '1900-01-01'::timestamp) FROM {{ this }})
+    )
+  {% endif %}
 ),
 
--- Calculate cumulative volume and assign volume groups
-volume_groups AS (
-  SELECT
-    *,
-    SUM(tick_volume) OVER (PARTITION BY contract_symbol ORDER BY row_num)                                                              AS cumulative_volume,
-    FLOOR(SUM(tick_volume) OVER (PARTITION BY contract_symbol ORDER BY row_num) / (SELECT avg_volume_per_bar FROM avg_volume_per_bar)) AS volume_group
-  FROM numbered_ticks
-),
-
--- Perform window calculations to compute bar statistics (OHLC, volume, tick count)
-window_calcs AS (
-  SELECT
-    *,
-    FIRST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num)                                                         AS bar_start_time,
-    LAST_VALUE(trading_datetime) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS bar_end_time,
-    FIRST_VALUE(price) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num)                                                                    AS open,
-    MAX(price) OVER (PARTITION BY contract_symbol, volume_group)                                                                                             AS high,
-    MIN(price) OVER (PARTITION BY contract_symbol, volume_group)                                                                                             AS low,
-    LAST_VALUE(price) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)            AS close,
-    SUM(tick_volume) OVER (PARTITION BY contract_symbol, volume_group)                                                                                       AS volume,
-    COUNT(*) OVER (PARTITION BY contract_symbol, volume_group)                                                                                               AS tick_count,
-    FIRST_VALUE(row_num) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num)                                                                  AS start_row_num,
-    LAST_VALUE(row_num) OVER (PARTITION BY contract_symbol, volume_group ORDER BY row_num ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)          AS end_row_num
-  FROM volume_groups
-),
-
--- Select distinct rows to create the final volume bars
+-- Assign ticks to volume groups from the cumulative volume and aggregate them into volume bars
 volume_bars AS (
-  SELECT DISTINCT
-    contract_symbol,
-    volume_group,
-    bar_start_time,
-    bar_end_time,
-    open,
-    high,
-    low,
-    close,
-    volume,
-    tick_count,
-    start_row_num,
-    end_row_num
-  FROM window_calcs
+  {{ build_bars('numbered_ticks', cumulative_bar_group('tick_volume', '(SELECT avg_volume_per_bar FROM avg_volume_per_bar)')) }}
 )
 
 -- Output the volume bars, ordered by contract symbol and bar start time
@@ -79,6 +63,8 @@ SELECT
   volume,
   tick_count,
   start_row_num,
-  end_row_num
+  end_row_num,
+  (SELECT avg_volume_per_bar FROM avg_volume_per_bar) AS bar_threshold,
+  CURRENT_TIMESTAMP::timestamp AS transformed_at
 FROM volume_bars
 ORDER BY contract_symbol, bar_start_time
@@ -1,15 +1,83 @@
 """
 This script reads HDF5 files, processes each dataset within, and outputs multiple smaller
 Parquet files, making the data more suitable for efficient ingestion into Snowflake.
+
+Run with: python -m scripts.convert_h5_to_parquet_chunks
 """
 
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
 import h5py
 import numpy
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from scripts.instrumentation import (
+    Instrumentation,
+    PhaseTimer,
+    RssSampler,
+    peak_rss_bytes,
+    profiled,
+)
+
+# Output layouts: flat "{dataset}_part_NNNN.parquet" files, or hive-style
+# "internal_id=.../data_provider=.../contract=.../date=YYYY-MM-DD/" directories
+FLAT_LAYOUT = "flat"
+HIVE_LAYOUT = "hive"
+
+# Partition values of the hive layout, matching the external table's partitions
+INTERNAL_ID = "ES_INDEX_FUTURES"
+DATA_PROVIDER = "mock_provider"
+
+# Fields used to partition and sort the rows of the hive layout
+CONTRACT_FIELD = "Instrument"
+TIME_FIELD = "Time"
+
+# Format of the TIME_FIELD byte strings, YYYYMMDDHHMMSSfff, parsed into
+# timestamp[ms] by the typed conversion
+TIME_STRING_LENGTH = 17
+
+# Compression of the Parquet files
+COMPRESSION = "snappy"
+
+# Maximum rows per Parquet row group. Rows are read from HDF5 in batches of whole
+# chunks of up to this many rows, each written as one row group.
+ROW_GROUP_SIZE = 1024 * 1024
+
+# Rows converted and encoded in memory to measure the compressed size of a row
+SIZE_SAMPLE_ROWS = 250_000
+
+# Number of rows hashed at the start and at the end of the converted rows of a
+# dataset, to detect whether they were rewritten since the last conversion
+FINGERPRINT_ROWS = 1024
+
+# Metadata index of the output directory, with one row per row group of every file,
+# so that readers can plan a scan without opening the footer of every file. The
+# leading underscore hides it from pyarrow datasets and the upload pattern.
+INDEX_FILE_NAME = "_index.parquet"
+INDEX_SCHEMA = pa.schema(
+    [
+        ("dataset", pa.string()),
+        ("path", pa.string()),
+        ("row_group", pa.int32()),
+        ("num_rows", pa.int64()),
+        ("min_time", pa.string()),
+        ("max_time", pa.string()),
+        ("instruments", pa.list_(pa.string())),
+        ("byte_offset", pa.int64()),
+        ("byte_length", pa.int64()),
+    ]
+)
+
 
 def read_h5_datasets(h5file):
     datasets = {}
@@ -60,20 +128,840 @@ def numpy_dtype_to_pa_type(numpy_dtype):
         )
 
 
-def estimate_chunk_size(dataset, target_file_size_mb):
-    """Estimate chunk size based on dataset dtype and target file size."""
-    # Calculate the size of one row in bytes
-    row_size_bytes = dataset.dtype.itemsize
+def get_batch_rows(dataset, row_group_size=ROW_GROUP_SIZE):
+    """
+    Number of rows read from a dataset at once and written as one row group: the
+    largest number of whole HDF5 chunks up to row_group_size rows (at least one
+    chunk), so that no chunk is decompressed by two reads.
+    """
+    chunk_rows = dataset.chunks[0] if dataset.chunks else 1
+    return max(chunk_rows, row_group_size // chunk_rows * chunk_rows)
+
+
+def plan_batches(start, end, batch_rows):
+    """
+    Split rows [start:end] into (start, end) reads which end on multiples of
+    batch_rows, and therefore on HDF5 chunk boundaries.
+    """
+    batches = []
+    while start < end:
+        batch_end = min(end, (start // batch_rows + 1) * batch_rows)
+        batches.append((start, batch_end))
+        start = batch_end
+    return batches
+
+
+def estimate_chunk_size(dataset, target_file_size_mb, typed=False, batch_rows=1):
+    """
+    Estimate the rows per part which write about target_file_size_mb of compressed
+    Parquet, from the size of the first SIZE_SAMPLE_ROWS rows encoded in memory in
+    row groups of batch_rows, like the parts. The estimate is rounded to the nearest
+    multiple of batch_rows, so that parts are made of whole reads.
+    """
+    sample_rows = min(SIZE_SAMPLE_ROWS, dataset.shape[0])
+    if sample_rows == 0:
+        return batch_rows
+    sink = pa.BufferOutputStream()
+    write_parquet(
+        iter_part_tables(dataset, 0, sample_rows, batch_rows, typed), sink, batch_rows
+    )
+    row_size_bytes = sink.getvalue().size / sample_rows
     # Estimate number of rows to reach the target file size
     target_file_size_bytes = target_file_size_mb * 1024 * 1024
-    estimated_rows = target_file_size_bytes // row_size_bytes
-    return max(1, int(estimated_rows))
+    estimated_rows = target_file_size_bytes / row_size_bytes
+    return max(1, round(estimated_rows / batch_rows)) * batch_rows
+
+
+def get_field_names(dataset):
+    """Return the field names of a structured dataset, or generated column names."""
+    if dataset.dtype.names:
+        # Structured array with named fields
+        return dataset.dtype.names
+    # Regular array without named fields
+    return [f"col{i}" for i in range(dataset.shape[1])]
+
+
+def get_part_output_file(output_dir, dataset_name, part_num):
+    """Build the output path of a Parquet part, e.g. tick_trades_part_0003.parquet."""
+    sanitized_name = dataset_name.replace("/", "_").replace(" ", "_")
+    return output_dir / f"{sanitized_name}_part_{part_num:04d}.parquet"
+
+
+def plan_parts(total_rows, chunk_size, start_row=0, first_part_num=0, align_rows=1):
+    """
+    Split the rows [start_row:total_rows] of a dataset into (part_num, start, end)
+    row ranges of up to chunk_size rows, numbered from first_part_num. Parts end on
+    multiples of align_rows, so that a start_row left unaligned by a previous
+    conversion only shortens the first part.
+    """
+    parts = []
+    start = start_row
+    for part_num in itertools.count(first_part_num):
+        if start >= total_rows:
+            break
+        end = (start + chunk_size) // align_rows * align_rows
+        end = min(total_rows, end if end > start else start + chunk_size)
+        parts.append((part_num, start, end))
+        start = end
+    return parts
+
+
+def parse_time_strings(times):
+    """
+    Parse YYYYMMDDHHMMSSfff byte strings into datetime64[ms], by arithmetic on their
+    digits rather than parsing each string.
+    """
+    times = numpy.ascontiguousarray(times, dtype=f"S{TIME_STRING_LENGTH}")
+    digits = times.view(numpy.uint8).reshape(-1, TIME_STRING_LENGTH) - ord("0")
+    # Bytes below "0", including the null padding of shorter strings, wrap around
+    invalid = (digits > 9).any(axis=1)
+    if invalid.any():
+        raise ValueError(
+            f"Invalid {TIME_FIELD} value"
+            f" {times[invalid.argmax()].decode(errors='replace')!r}, expected"
+            " YYYYMMDDHHMMSSfff"
+        )
+
+    def number(first, last):
+        # Accumulate one digit column at a time, in place, to avoid (rows, digits)
+        # int64 temporaries
+        value = numpy.zeros(len(digits), dtype=numpy.int64)
+        for column in range(first, last):
+            value *= 10
+            value += digits[:, column]
+        return value
+
+    month, hours, minutes, seconds = (
+        number(4, 6),
+        number(8, 10),
+        number(10, 12),
+        number(12, 14),
+    )
+    months = (number(0, 4) - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+    months += month - 1
+    # Out of range days roll over into the next month, which is detected below
+    days = months.astype("datetime64[D]") + (number(6, 8) - 1)
+    invalid = (
+        (days.astype("datetime64[M]") != months)
+        | (month < 1)
+        | (month > 12)
+        | (hours > 23)
+        | (minutes > 59)
+        | (seconds > 59)
+    )
+    if invalid.any():
+        raise ValueError(
+            f"Invalid {TIME_FIELD} value"
+            f" {times[invalid.argmax()].decode(errors='replace')!r}"
+        )
+    millis = ((hours * 60 + minutes) * 60 + seconds) * 1000 + number(14, 17)
+    return days.astype("datetime64[ms]") + millis
+
+
+def byte_strings_to_fixed_size_binary(byte_strings):
+    """Wrap contiguous NumPy byte strings as a fixed_size_binary array without a copy."""
+    byte_strings = numpy.ascontiguousarray(byte_strings)
+    return pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(byte_strings.dtype.itemsize),
+        len(byte_strings),
+        [None, pa.py_buffer(byte_strings)],
+    )
+
+
+def byte_strings_to_strings(byte_strings):
+    """
+    Decode byte strings into a string array with an Arrow cast of their buffer,
+    stripping the trailing null padding like NumPy. Falls back to NumPy, which
+    replaces invalid UTF-8 sequences, if any value is not valid UTF-8.
+    """
+    byte_strings = numpy.ascontiguousarray(byte_strings)
+    try:
+        strings = byte_strings_to_fixed_size_binary(byte_strings).cast(pa.string())
+    except pa.ArrowInvalid:
+        decoded = numpy.char.decode(byte_strings, "utf-8", errors="replace")
+        return pa.array(decoded, type=pa.string())
+    # Only strings shorter than the itemsize end with null bytes
+    itemsize = byte_strings.dtype.itemsize
+    if not byte_strings.view(numpy.uint8)[itemsize - 1 :: itemsize].all():
+        strings = pc.utf8_rtrim(strings, characters="\x00")
+    return strings
+
+
+def byte_strings_to_dictionary(byte_strings):
+    """
+    Dictionary-encode byte strings, decoding only the distinct values to Unicode.
+    """
+    encoded = byte_strings_to_fixed_size_binary(byte_strings).dictionary_encode()
+    dictionary = pa.array(
+        [
+            value.rstrip(b"\x00").decode("utf-8", errors="replace")
+            for value in encoded.dictionary.to_pylist()
+        ],
+        type=pa.string(),
+    )
+    return pa.DictionaryArray.from_arrays(encoded.indices, dictionary)
+
+
+def chunk_to_table(data_chunk, dataset_dtype, field_names, typed=False, timer=None):
+    """
+    Convert a slice of an HDF5 dataset into a PyArrow table, timing the decode and
+    arrow_build phases with the optional PhaseTimer.
+
+    With typed=True, the TIME_FIELD strings are parsed into timestamp[ms] and the
+    CONTRACT_FIELD is dictionary-encoded, instead of decoding them into strings.
+    """
+    timer = timer or PhaseTimer()
+    arrays = []
+    for field_name in field_names:
+        numpy_array = data_chunk[field_name]
+        numpy_dtype = dataset_dtype[field_name]
+        if typed and field_name == TIME_FIELD:
+            with timer.phase("decode"):
+                numpy_array = parse_time_strings(numpy_array)
+            with timer.phase("arrow_build"):
+                pa_array = pa.array(numpy_array, type=pa.timestamp("ms"))
+        elif typed and field_name == CONTRACT_FIELD:
+            with timer.phase("arrow_build"):
+                pa_array = byte_strings_to_dictionary(numpy_array)
+        elif numpy_dtype.kind == "S":
+            # Convert byte strings to Unicode strings
+            with timer.phase("decode"):
+                pa_array = byte_strings_to_strings(numpy_array)
+        elif numpy_dtype.kind in ("i", "u", "f"):
+            # Contiguous arrays are wrapped without a copy
+            with timer.phase("arrow_build"):
+                pa_array = pa.array(
+                    numpy_array, type=numpy_dtype_to_pa_type(numpy_dtype)
+                )
+        else:
+            raise ValueError(
+                f"Unsupported numpy dtype kind '{numpy_dtype.kind}' for"
+                f" field '{field_name}'"
+            )
+        arrays.append(pa_array)
+    return pa.Table.from_arrays(arrays, names=field_names)
+
+
+def iter_hive_partitions(table):
+    """
+    Split a table into hive-style contract/date partitions, with the rows of each
+    partition sorted by time. Yields (partition_dir, table) pairs where partition_dir
+    is the relative internal_id=.../data_provider=.../contract=.../date=... path.
+    """
+    contracts = table[CONTRACT_FIELD]
+    if pa.types.is_dictionary(contracts.type):
+        # Arrow cannot sort dictionary columns, so sort on their values instead
+        contracts = contracts.cast(pa.string())
+
+    # A single sort groups the rows by contract, then date (the time string starts
+    # with YYYYMMDD), and orders them by time within each partition
+    order = pc.sort_indices(
+        pa.table({CONTRACT_FIELD: contracts, TIME_FIELD: table[TIME_FIELD]}),
+        sort_keys=[(CONTRACT_FIELD, "ascending"), (TIME_FIELD, "ascending")],
+    )
+    table = table.take(order)
+    contracts = contracts.take(order).combine_chunks()
+    if pa.types.is_timestamp(table.schema.field(TIME_FIELD).type):
+        dates = pc.strftime(table[TIME_FIELD], format="%Y%m%d").combine_chunks()
+    else:
+        dates = pc.utf8_slice_codeunits(table[TIME_FIELD], 0, 8).combine_chunks()
+
+    # Find the row offsets where the (contract, date) partition changes
+    changes = pc.or_(
+        pc.not_equal(contracts[1:], contracts[:-1]),
+        pc.not_equal(dates[1:], dates[:-1]),
+    )
+    boundaries = numpy.flatnonzero(changes.to_numpy(zero_copy_only=False)) + 1
+    offsets = [0, *boundaries.tolist(), table.num_rows] if table.num_rows else []
+
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        contract = contracts[start].as_py()
+        date = dates[start].as_py()
+        partition_dir = (
+            Path(f"internal_id={INTERNAL_ID}")
+            / f"data_provider={DATA_PROVIDER}"
+            / f"contract={contract}"
+            / f"date={date[:4]}-{date[4:6]}-{date[6:8]}"
+        )
+        yield partition_dir, table.slice(start, end - start)
+
+
+class PartReader:
+    """
+    Read row ranges of a structured dataset into NumPy buffers allocated once, and
+    reused by every read of up to max_rows rows.
+
+    Rows are read with read_direct into a record buffer, then each field is copied
+    into its own contiguous buffer, which numeric fields are wrapped in by Arrow
+    without a copy. Tables returned by read() may therefore reference the buffers,
+    and must not be used after the next read.
+    """
+
+    def __init__(self, dataset, max_rows):
+        self.dataset = dataset
+        self.field_names = get_field_names(dataset)
+        self._records = numpy.empty(max_rows, dtype=dataset.dtype)
+        self._fields = {
+            field_name: numpy.empty(max_rows, dtype=dataset.dtype[field_name])
+            for field_name in self.field_names
+        }
+
+    def read(self, start, end, typed=False, timer=None):
+        """
+        Read rows [start:end] into a PyArrow table. The hdf5_read phase includes
+        the decompression of the HDF5 chunks and the copy of each field.
+        """
+        timer = timer or PhaseTimer()
+        num_rows = end - start
+        with timer.phase("hdf5_read"):
+            records = self._records[:num_rows]
+            self.dataset.read_direct(records, numpy.s_[start:end])
+            fields = {}
+            for field_name, buffer in self._fields.items():
+                fields[field_name] = buffer[:num_rows]
+                numpy.copyto(fields[field_name], records[field_name])
+        return chunk_to_table(fields, self.dataset.dtype, self.field_names, typed, timer)
+
+
+def read_part_table(dataset, start, end, typed=False, timer=None):
+    """
+    Read rows [start:end] of a dataset into a PyArrow table. The hdf5_read phase
+    includes the decompression of the HDF5 chunks.
+    """
+    return PartReader(dataset, end - start).read(start, end, typed, timer)
+
+
+def iter_part_tables(dataset, start, end, batch_rows, typed=False, timer=None):
+    """
+    Read rows [start:end] of a dataset as tables of chunk-aligned batches, which
+    share the buffers of a PartReader: each table must be consumed before the next
+    one is read.
+    """
+    reader = PartReader(dataset, min(batch_rows, end - start))
+    for batch_start, batch_end in plan_batches(start, end, batch_rows):
+        yield reader.read(batch_start, batch_end, typed, timer)
+
+
+def iter_part_files(table, dataset_name, part_num, layout=FLAT_LAYOUT):
+    """
+    Split the table of a part into the files of the output layout. Yields
+    (relative_path, table) pairs: a single file for the flat layout, or one file per
+    contract/date directory for the hive layout.
+    """
+    if layout == HIVE_LAYOUT:
+        for partition_dir, partition_table in iter_hive_partitions(table):
+            yield get_part_output_file(
+                partition_dir, dataset_name, part_num
+            ), partition_table
+    else:
+        yield get_part_output_file(Path(), dataset_name, part_num), table
+
+
+def read_part_files(
+    dataset,
+    dataset_name,
+    start,
+    end,
+    part_num,
+    layout=FLAT_LAYOUT,
+    typed=False,
+    row_group_size=ROW_GROUP_SIZE,
+    timer=None,
+):
+    """
+    Read rows [start:end] of a dataset in chunk-aligned batches and split them into
+    the files of the output layout. Yields (relative_path, tables) pairs, where
+    tables iterates over the rows of the file: the flat layout streams the batches
+    as they are read, while the hive layout reads the whole part to sort it.
+    """
+    timer = timer or PhaseTimer()
+    if layout == HIVE_LAYOUT:
+        # Parts end on chunk boundaries, so a single read decompresses each chunk once
+        table = read_part_table(dataset, start, end, typed, timer)
+        with timer.phase("partition"):
+            # Partitions are slices of the sorted table, so this does not copy rows
+            part_files = list(iter_part_files(table, dataset_name, part_num, layout))
+        for relative_path, part_table in part_files:
+            yield relative_path, [part_table]
+    else:
+        batch_rows = get_batch_rows(dataset, row_group_size)
+        tables = iter_part_tables(dataset, start, end, batch_rows, typed, timer)
+        yield get_part_output_file(Path(), dataset_name, part_num), tables
+
+
+def write_parquet(tables, sink, row_group_size=ROW_GROUP_SIZE, timer=None):
+    """
+    Stream tables into a Parquet file or buffer with a ParquetWriter, in row groups
+    of up to row_group_size rows, so that only one table is in memory at a time.
+    """
+    timer = timer or PhaseTimer()
+    writer = None
+    try:
+        for table in tables:
+            with timer.phase("parquet_write"):
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        sink, table.schema, compression=COMPRESSION
+                    )
+                writer.write_table(table, row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_part(
+    dataset,
+    dataset_name,
+    start,
+    end,
+    output_dir,
+    part_num,
+    layout=FLAT_LAYOUT,
+    typed=False,
+    row_group_size=ROW_GROUP_SIZE,
+    timer=None,
+):
+    """
+    Read rows [start:end] of a dataset and write them as Parquet, either to a single
+    file or to one file per hive partition. Returns the list of written files.
+
+    Files are written to a temporary path and renamed once complete, so that an
+    interrupted conversion never leaves a truncated file to be uploaded.
+    """
+    output_files = []
+    for relative_path, tables in read_part_files(
+        dataset,
+        dataset_name,
+        start,
+        end,
+        part_num,
+        layout,
+        typed,
+        row_group_size,
+        timer,
+    ):
+        output_file = output_dir / relative_path
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = output_file.with_name(f"{output_file.name}.tmp")
+        write_parquet(tables, tmp_file, row_group_size, timer)
+        tmp_file.replace(output_file)
+        output_files.append(output_file)
+    return output_files
+
+
+def convert_part(
+    dataset,
+    dataset_name,
+    start,
+    end,
+    output_dir,
+    part_num,
+    layout=FLAT_LAYOUT,
+    typed=False,
+    row_group_size=ROW_GROUP_SIZE,
+    profile_file=None,
+):
+    """
+    Write a part with write_part and measure it, optionally profiling it with
+    cProfile into profile_file.
+
+    Returns:
+        tuple: The list of written files, and the metrics of the part: time per
+            phase, rows, input and output bytes, the peak memory sampled while the
+            part was converted, and the peak memory of the process so far.
+    """
+    timer = PhaseTimer()
+    start_time = time.perf_counter()
+    with RssSampler() as rss_sampler, profiled(profile_file):
+        output_files = write_part(
+            dataset,
+            dataset_name,
+            start,
+            end,
+            output_dir,
+            part_num,
+            layout,
+            typed,
+            row_group_size,
+            timer,
+        )
+    part_metrics = {
+        "seconds": time.perf_counter() - start_time,
+        "phases": dict(timer.phases),
+        "rows": end - start,
+        "input_bytes": (end - start) * dataset.dtype.itemsize,
+        "output_bytes": sum(output_file.stat().st_size for output_file in output_files),
+        "output_files": len(output_files),
+        "peak_rss_bytes": rss_sampler.peak_bytes,
+        # High-water mark of the whole life of the process, e.g. a pool worker
+        "process_peak_rss_bytes": peak_rss_bytes(),
+        "pid": os.getpid(),
+    }
+    return output_files, part_metrics
+
+
+def get_manifest_path(output_dir):
+    """Path of the conversion manifest, stored next to the output directory."""
+    return output_dir.with_name(f"{output_dir.name}.conversion_manifest.json")
+
+
+def load_conversion_manifest(manifest_path):
+    """Load the conversion manifest, or an empty one if it does not exist."""
+    if not manifest_path.exists():
+        return {"datasets": {}}
+    return json.loads(manifest_path.read_text())
 
 
-def convert_h5_to_parquet(input_file: Path, target_file_size_mb=200):
+def save_conversion_manifest(manifest_path, manifest):
+    """Atomically write the conversion manifest."""
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    tmp_path.replace(manifest_path)
+
+
+def dataset_fingerprint(dataset, converted_end):
+    """
+    Fingerprint the rows [0:converted_end] of a dataset from its dtype and a hash of
+    its first and last FINGERPRINT_ROWS rows. Appending rows does not change it.
+    """
+    head = dataset[: min(FINGERPRINT_ROWS, converted_end)]
+    tail = dataset[max(0, converted_end - FINGERPRINT_ROWS) : converted_end]
+    return {
+        "dtype": str(dataset.dtype),
+        "converted_end": converted_end,
+        "head_sha256": hashlib.sha256(head.tobytes()).hexdigest(),
+        "tail_sha256": hashlib.sha256(tail.tobytes()).hexdigest(),
+    }
+
+
+def get_converted_end(entry, dataset, layout, typed, output_dir):
+    """
+    Return the row up to which a dataset was already converted according to its
+    manifest entry, or 0 if it must be fully reconverted because the layout or the
+    typed mode changed, files are missing or the rows already converted do not
+    match the source anymore.
+    """
+    if entry is None or entry["layout"] != layout:
+        return 0
+    if entry.get("typed", False) != typed:
+        return 0
+    for part in entry["parts"]:
+        for part_file in part["files"]:
+            if not (output_dir / part_file["path"]).exists():
+                return 0
+    # Entries saved before any part of their dataset was written have no fingerprint
+    fingerprint = entry.get("fingerprint")
+    if fingerprint is None:
+        return 0
+    converted_end = fingerprint["converted_end"]
+    if dataset.shape[0] < converted_end:
+        return 0
+    if dataset_fingerprint(dataset, converted_end) != fingerprint:
+        return 0
+    return converted_end
+
+
+def get_column_statistics(row_group, field_name):
+    """Return the statistics of a column of a row group, or None if it has none."""
+    names = [row_group.column(i).path_in_schema for i in range(row_group.num_columns)]
+    if field_name not in names:
+        return None
+    statistics = row_group.column(names.index(field_name)).statistics
+    if statistics is None or not statistics.has_min_max:
+        return None
+    return statistics
+
+
+def describe_row_groups(parquet_file):
+    """
+    Describe every row group of a Parquet file for the metadata index: row count,
+    min/max time, the set of contracts and the byte range of its column chunks.
+
+    The contracts come from the statistics when a row group holds a single one, and
+    are only read from the column when it spans a roll.
+    """
+    metadata = parquet_file.metadata
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        time_statistics = get_column_statistics(row_group, TIME_FIELD)
+        contract_statistics = get_column_statistics(row_group, CONTRACT_FIELD)
+        if contract_statistics is not None and (
+            contract_statistics.min == contract_statistics.max
+        ):
+            instruments = [contract_statistics.min]
+        elif CONTRACT_FIELD in metadata.schema.names and row_group.num_rows:
+            contracts = parquet_file.read_row_group(i, columns=[CONTRACT_FIELD])
+            instruments = sorted(
+                pc.unique(contracts[CONTRACT_FIELD].cast(pa.string())).to_pylist()
+            )
+        else:
+            instruments = []
+        columns = [row_group.column(j) for j in range(row_group.num_columns)]
+        byte_offset = min(
+            (
+                column.dictionary_page_offset
+                if column.has_dictionary_page
+                else column.data_page_offset
+            )
+            for column in columns
+        )
+        row_groups.append(
+            {
+                "row_group": i,
+                "num_rows": row_group.num_rows,
+                "min_time": (
+                    format_time(time_statistics.min) if time_statistics else None
+                ),
+                "max_time": (
+                    format_time(time_statistics.max) if time_statistics else None
+                ),
+                "instruments": instruments,
+                "byte_offset": byte_offset,
+                "byte_length": sum(column.total_compressed_size for column in columns),
+            }
+        )
+    return row_groups
+
+
+def describe_part_file(output_file, output_dir):
+    """
+    Read the row count and min/max time of a Parquet file from its footer, with the
+    description of its row groups for the metadata index.
+    """
+    parquet_file = pq.ParquetFile(output_file)
+    row_groups = describe_row_groups(parquet_file)
+    min_times = [rg["min_time"] for rg in row_groups if rg["min_time"] is not None]
+    max_times = [rg["max_time"] for rg in row_groups if rg["max_time"] is not None]
+    return {
+        "path": output_file.relative_to(output_dir).as_posix(),
+        "num_rows": parquet_file.metadata.num_rows,
+        "min_time": min(min_times, default=None),
+        "max_time": max(max_times, default=None),
+        "row_groups": row_groups,
+    }
+
+
+def get_index_path(output_dir):
+    """Path of the metadata index, stored in the output directory."""
+    return output_dir / INDEX_FILE_NAME
+
+
+def write_metadata_index(output_dir, manifest):
+    """
+    Atomically write the metadata index of the files listed in the manifest, with
+    one row per row group. Row groups are described in the manifest as the parts
+    are written, so updating the index does not open any file, except those
+    converted before the index existed, whose description is added to the manifest.
+    """
+    rows = []
+    for dataset_name, entry in sorted(manifest["datasets"].items()):
+        for part in entry["parts"]:
+            for part_file in part["files"]:
+                if "row_groups" not in part_file:
+                    part_file["row_groups"] = describe_row_groups(
+                        pq.ParquetFile(output_dir / part_file["path"])
+                    )
+                for row_group in part_file["row_groups"]:
+                    rows.append(
+                        {"dataset": dataset_name, "path": part_file["path"], **row_group}
+                    )
+    index_path = get_index_path(output_dir)
+    tmp_path = index_path.with_name(f"{index_path.name}.tmp")
+    pq.write_table(pa.Table.from_pylist(rows, schema=INDEX_SCHEMA), tmp_path)
+    tmp_path.replace(index_path)
+
+
+def format_time(value):
+    """
+    Format a min/max time statistic like the source strings, YYYYMMDDHHMMSSfff,
+    whether the file was written by the typed conversion or not.
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%Y%m%d%H%M%S") + f"{value.microsecond // 1000:03d}"
+    return str(value)
+
+
+def print_part_written(dataset_name, start, end, output_files):
+    if len(output_files) == 1:
+        destination = f"file {output_files[0].name}"
+    else:
+        destination = f"{len(output_files)} partition files"
+    print(f"Wrote rows {start} to {end} for dataset {dataset_name} to {destination}")
+
+
+# HDF5 file handle opened once per worker process by _init_worker
+_worker_h5file = None
+
+
+def _init_worker(input_file):
+    """Open the HDF5 file read-only in each worker process of the pool."""
+    global _worker_h5file
+    _worker_h5file = h5py.File(input_file, "r")
+
+
+def _convert_part_in_worker(
+    dataset_name,
+    start,
+    end,
+    output_dir,
+    part_num,
+    layout,
+    typed,
+    row_group_size,
+    profile_file,
+):
+    return convert_part(
+        _worker_h5file[dataset_name],
+        dataset_name,
+        start,
+        end,
+        output_dir,
+        part_num,
+        layout,
+        typed,
+        row_group_size,
+        profile_file,
+    )
+
+
+def _convert_parts_in_pool(
+    input_file,
+    output_dir,
+    dataset_parts,
+    layout,
+    typed,
+    row_group_size,
+    num_workers,
+    on_part_written,
+    on_dataset_failed,
+    instrumentation,
+):
+    """Convert the planned parts of all datasets with a pool of worker processes."""
+    # Use spawn so that workers do not inherit the parent's open HDF5 handle
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(input_file,),
+    ) as executor:
+        futures = {
+            name: [
+                (
+                    part_num,
+                    start,
+                    end,
+                    executor.submit(
+                        _convert_part_in_worker,
+                        name,
+                        start,
+                        end,
+                        output_dir,
+                        part_num,
+                        layout,
+                        typed,
+                        row_group_size,
+                        instrumentation.get_profile_file(name, part_num),
+                    ),
+                )
+                for part_num, start, end in parts
+            ]
+            for name, parts in dataset_parts.items()
+        }
+        # Results are collected in plan order, so parts are recorded in row order
+        for name, parts in futures.items():
+            try:
+                for part_num, start, end, future in parts:
+                    on_part_written(name, part_num, start, end, *future.result())
+                print(
+                    f"Converted dataset {name} into {len(parts)} parts in {output_dir}"
+                )
+            except Exception as e:
+                on_dataset_failed(name, e)
+
+
+def convert_h5_to_parquet(
+    input_file: Path,
+    target_file_size_mb=200,
+    num_workers=1,
+    layout=FLAT_LAYOUT,
+    typed=False,
+    incremental=True,
+    row_group_size=ROW_GROUP_SIZE,
+    instrumentation=None,
+):
+    """
+    Convert every dataset of an HDF5 file into Parquet parts of about
+    target_file_size_mb each, once compressed. The size of a row is measured by
+    encoding a sample of the dataset, and parts are made of whole HDF5 chunks.
+
+    Each part is read in batches of whole HDF5 chunks of up to row_group_size rows,
+    so that no chunk is decompressed twice, and each batch is written as one row
+    group. Flat parts are streamed to their file batch by batch.
+
+    With num_workers > 1, the parts are converted by a pool of processes which
+    each open the HDF5 file read-only. Row ranges and part numbers are planned
+    upfront, so the output is identical to the serial path.
+
+    With layout="hive", each part is split into
+    internal_id=.../data_provider=.../contract=.../date=YYYY-MM-DD/ directories,
+    with the rows of each file sorted by time, so that Snowflake can prune the
+    external table by contract and date.
+
+    With typed=True, the Time strings are parsed into a timestamp[ms] column and
+    the Instrument symbols are dictionary-encoded, instead of both being decoded
+    into strings, which is faster and writes smaller files. The staging model reads
+    both kinds of files.
+
+    A conversion manifest next to the output directory records, for each dataset,
+    the rows already converted, a fingerprint of the source and the row count and
+    min/max time of every file. With incremental=True, only the rows appended since
+    the last conversion are converted, into new parts. A dataset is fully
+    reconverted if its fingerprint, the layout or the typed mode changed.
+
+    Every run also writes the _index.parquet metadata index into the output
+    directory, with the row count, min/max time, contracts and byte range of every
+    row group of every file, from which readers can plan a scan.
+
+    Every converted part and failure is recorded by the instrumentation, which is
+    configured from the PIPELINE_* environment variables by default (see
+    scripts.instrumentation). A dataset which fails does not stop the conversion of
+    the others, but a RuntimeError listing the failed datasets is raised at the end.
+    """
+    if layout not in (FLAT_LAYOUT, HIVE_LAYOUT):
+        raise ValueError(f"Unsupported output layout '{layout}'")
+
     if not input_file.exists():
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
+    if instrumentation is None:
+        instrumentation = Instrumentation.from_env("convert")
+    try:
+        _convert_datasets(
+            input_file,
+            target_file_size_mb,
+            num_workers,
+            layout,
+            typed,
+            incremental,
+            row_group_size,
+            instrumentation,
+        )
+    finally:
+        instrumentation.write_metrics()
+
+
+def _convert_datasets(
+    input_file,
+    target_file_size_mb,
+    num_workers,
+    layout,
+    typed,
+    incremental,
+    row_group_size,
+    instrumentation,
+):
+    """Body of convert_h5_to_parquet, whose metrics are written however it ends."""
     with h5py.File(input_file, "r") as h5file:
         datasets = read_h5_datasets(h5file)
 
@@ -89,82 +977,191 @@ def convert_h5_to_parquet(input_file: Path, target_file_size_mb=200):
             ""
         )  # Remove file extension for output directory
         output_dir.mkdir(exist_ok=True)
+
+        manifest_path = get_manifest_path(output_dir)
+        manifest = load_conversion_manifest(manifest_path)
+        instrumentation.event(
+            "conversion_started",
+            input_file=input_file,
+            num_workers=num_workers,
+            layout=layout,
+            typed=typed,
+            target_file_size_mb=target_file_size_mb,
+            row_group_size=row_group_size,
+        )
+
+        failed_datasets = {}
+
+        def on_dataset_failed(name, error):
+            """Record a failed dataset, so the others are still converted."""
+            print(f"Error processing dataset {name}: {type(error).__name__}: {error}")
+            instrumentation.record_failure(error, dataset=name)
+            failed_datasets[name] = error
+
+        # Plan the row ranges of every part before converting anything
+        dataset_parts = {}
         for name, dataset in datasets.items():
             try:
-                total_rows = dataset.shape[0]
+                # Validate the field types before any part is written
+                field_names = get_field_names(dataset)
+                for field_name in field_names:
+                    numpy_dtype_to_pa_type(dataset.dtype[field_name])
+                if layout == HIVE_LAYOUT and not {CONTRACT_FIELD, TIME_FIELD} <= set(
+                    field_names
+                ):
+                    raise ValueError(
+                        f"The {layout} layout requires the fields '{CONTRACT_FIELD}'"
+                        f" and '{TIME_FIELD}'"
+                    )
+                if (
+                    typed
+                    and TIME_FIELD in field_names
+                    and dataset.dtype[TIME_FIELD] != f"S{TIME_STRING_LENGTH}"
+                ):
+                    raise ValueError(
+                        f"The typed conversion requires '{TIME_FIELD}' to be"
+                        f" S{TIME_STRING_LENGTH} strings, got"
+                        f" {dataset.dtype[TIME_FIELD]}"
+                    )
+
+                entry = manifest["datasets"].get(name)
+                converted_end = (
+                    get_converted_end(entry, dataset, layout, typed, output_dir)
+                    if incremental
+                    else 0
+                )
+                if converted_end == 0 and entry is not None:
+                    # Remove the files of the previous conversion before starting over
+                    for part in entry["parts"]:
+                        for part_file in part["files"]:
+                            (output_dir / part_file["path"]).unlink(missing_ok=True)
+                    entry = None
+                if entry is None:
+                    entry = {
+                        "layout": layout,
+                        "typed": typed,
+                        "converted_rows": [],
+                        "parts": [],
+                        # No rows converted yet, e.g. for an empty dataset
+                        "fingerprint": dataset_fingerprint(dataset, 0),
+                    }
+                    manifest["datasets"][name] = entry
+
+                if converted_end == dataset.shape[0] and converted_end > 0:
+                    print(f"Dataset {name} is up to date ({converted_end} rows)")
+                    continue
+
                 # Estimate chunk size to aim for target file size
-                chunk_size = estimate_chunk_size(dataset, target_file_size_mb)
+                batch_rows = get_batch_rows(dataset, row_group_size)
+                chunk_size = estimate_chunk_size(
+                    dataset, target_file_size_mb, typed, batch_rows
+                )
                 print(
                     f"Estimated chunk size for dataset '{name}': {chunk_size} rows per"
                     " file"
                 )
-
-                # Get field names and data types
-                if dataset.dtype.names:
-                    # Structured array with named fields
-                    field_names = dataset.dtype.names
-                else:
-                    # Regular array without named fields
-                    field_names = [f"col{i}" for i in range(dataset.shape[1])]
-                len(field_names)
-
-                # Prepare output file base path
-                sanitized_name = name.replace("/", "_").replace(" ", "_")
-                dataset_output_base = output_dir / f"{sanitized_name}_part"
-
-                # Prepare schema with accurate type mapping
-                schema_fields = []
-                for field_name in field_names:
-                    numpy_dtype = dataset.dtype[field_name]
-                    pa_type = numpy_dtype_to_pa_type(numpy_dtype)
-                    schema_fields.append(pa.field(field_name, pa_type))
-                pa.schema(schema_fields)
-
-                part_num = 0
-                for start in range(0, total_rows, chunk_size):
-                    end = min(start + chunk_size, total_rows)
-                    data_chunk = dataset[start:end]
-
-                    arrays = []
-                    for field_name in field_names:
-                        numpy_array = data_chunk[field_name]
-                        numpy_dtype = dataset.dtype[field_name]
-                        if numpy_dtype.kind == "S":
-                            # Convert byte strings to Unicode strings
-                            numpy_array = numpy.char.decode(
-                                numpy_array, "utf-8", errors="replace"
-                            )
-                            pa_array = pa.array(numpy_array, type=pa.string())
-                        elif numpy_dtype.kind in ("i", "u", "f"):
-                            pa_array = pa.array(
-                                numpy_array, type=numpy_dtype_to_pa_type(numpy_dtype)
-                            )
-                        else:
-                            raise ValueError(
-                                f"Unsupported numpy dtype kind '{numpy_dtype.kind}' for"
-                                f" field '{field_name}'"
-                            )
-                        arrays.append(pa_array)
-                    table = pa.Table.from_arrays(arrays, names=field_names)
-
-                    # Write each chunk to a separate Parquet file
-                    output_file = dataset_output_base.with_name(
-                        f"{dataset_output_base.stem}_{part_num:04d}.parquet"
-                    )
-                    pq.write_table(table, output_file, compression="snappy")
+                first_part_num = max(
+                    (p["part_num"] + 1 for p in entry["parts"]), default=0
+                )
+                if converted_end > 0:
                     print(
-                        f"Wrote rows {start} to {end} for dataset {name} to file"
-                        f" {output_file.name}"
+                        f"Dataset {name} already converted up to row {converted_end},"
+                        f" converting the {dataset.shape[0] - converted_end} new rows"
                     )
-                    part_num += 1
-                print(f"Converted dataset {name} into {part_num} files in {output_dir}")
+                dataset_parts[name] = plan_parts(
+                    dataset.shape[0],
+                    chunk_size,
+                    converted_end,
+                    first_part_num,
+                    batch_rows,
+                )
+                instrumentation.event(
+                    "dataset_planned",
+                    dataset=name,
+                    rows=dataset.shape[0] - converted_end,
+                    parts=len(dataset_parts[name]),
+                )
             except Exception as e:
-                print(f"Error processing dataset {name}: {str(e)}")
+                on_dataset_failed(name, e)
 
+        def on_part_written(name, part_num, start, end, output_files, part_metrics):
+            """Record a converted part in the manifest as soon as it is written."""
+            print_part_written(name, start, end, output_files)
+            instrumentation.record_part(name, part_num, part_metrics)
+            entry = manifest["datasets"][name]
+            entry["parts"].append(
+                {
+                    "part_num": part_num,
+                    "start": start,
+                    "end": end,
+                    "files": [
+                        describe_part_file(output_file, output_dir)
+                        for output_file in output_files
+                    ],
+                }
+            )
+            converted_rows = entry["converted_rows"]
+            if converted_rows and converted_rows[-1][1] == start:
+                converted_rows[-1][1] = end
+            else:
+                converted_rows.append([start, end])
+            entry["fingerprint"] = dataset_fingerprint(datasets[name], end)
+            save_conversion_manifest(manifest_path, manifest)
+
+        if num_workers > 1:
+            _convert_parts_in_pool(
+                input_file,
+                output_dir,
+                dataset_parts,
+                layout,
+                typed,
+                row_group_size,
+                num_workers,
+                on_part_written,
+                on_dataset_failed,
+                instrumentation,
+            )
+        else:
+            for name, parts in dataset_parts.items():
+                try:
+                    for part_num, start, end in parts:
+                        output_files, part_metrics = convert_part(
+                            datasets[name],
+                            name,
+                            start,
+                            end,
+                            output_dir,
+                            part_num,
+                            layout,
+                            typed,
+                            row_group_size,
+                            instrumentation.get_profile_file(name, part_num),
+                        )
+                        on_part_written(
+                            name, part_num, start, end, output_files, part_metrics
+                        )
+                    print(
+                        f"Converted dataset {name} into {len(parts)} parts in"
+                        f" {output_dir}"
+                    )
+                except Exception as e:
+                    on_dataset_failed(name, e)
+
+        write_metadata_index(output_dir, manifest)
+        save_conversion_manifest(manifest_path, manifest)
+        print(f"Wrote the metadata index {get_index_path(output_dir)}")
+
+        instrumentation.event(
+            "conversion_completed", failed_datasets=sorted(failed_datasets)
+        )
+        if failed_datasets:
+            raise RuntimeError(
+                f"Failed to convert datasets: {', '.join(failed_datasets)}"
+            ) from next(iter(failed_datasets.values()))
         print(f"Conversion completed. Output files are located in {output_dir}")
 
 
 if __name__ == "__main__":
     current_dir = Path(__file__).parent
     input_file = current_dir.parent / "data" / "ES.h5"
-    convert_h5_to_parquet(input_file, target_file_size_mb=1024)
+    convert_h5_to_parquet(input_file, num_workers=os.cpu_count())
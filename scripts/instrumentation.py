@@ -0,0 +1,336 @@
+"""
+Structured instrumentation for the extract and load scripts.
+
+An Instrumentation collects, for one stage of the pipeline (e.g. "convert" or
+"upload"), structured events written as JSON lines, and counters, gauges and
+histograms written as a Prometheus textfile, e.g. for the node_exporter textfile
+collector. Both outputs are optional and configured by environment variables:
+
+- PIPELINE_EVENTS_FILE: JSON lines file the events are appended to
+- PIPELINE_METRICS_DIR: directory of the tick_data_<stage>.prom textfile
+- PIPELINE_PROFILE_PART: "<dataset>:<part_num>" part to profile with cProfile
+- PIPELINE_PROFILE_DIR: directory of the .prof dumps, defaults to the working
+  directory
+"""
+
+import cProfile
+import json
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+METRIC_PREFIX = "tick_data"
+
+# Histogram buckets of upload latencies in seconds, and of attempts per upload
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 10)
+
+# Interval between two samples of the resident memory of a converted part, in seconds
+RSS_SAMPLING_INTERVAL = 0.05
+RSS_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss_bytes():
+    """Peak resident memory of the current process, in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def current_rss_bytes():
+    """
+    Current resident memory of the current process, in bytes, or None where
+    /proc is not available (e.g. macOS).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * RSS_PAGE_SIZE
+
+
+class RssSampler:
+    """
+    Sample the resident memory of the current process in a background thread while
+    the enclosed code runs, so that peak_bytes is the peak of that code alone rather
+    than the high-water mark of the whole process (ru_maxrss). peak_bytes is None
+    where the current memory cannot be read.
+    """
+
+    def __init__(self, interval=RSS_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _record(self):
+        rss_bytes = current_rss_bytes()
+        if rss_bytes is not None:
+            self.peak_bytes = max(self.peak_bytes or 0, rss_bytes)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def __enter__(self):
+        self._record()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._record()
+
+
+class PhaseTimer:
+    """Accumulate the wall time spent in each named phase of a unit of work."""
+
+    def __init__(self):
+        self.phases = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+
+@contextmanager
+def profiled(profile_file):
+    """Profile the enclosed code with cProfile and dump the stats to profile_file."""
+    if profile_file is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(profile_file).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_file)
+        print(f"Profile saved as {profile_file}")
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus format."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _format_labels(labels, **extra):
+    """Format (name, value) pairs as Prometheus labels, escaping the values."""
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in items
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Instrumentation:
+    """
+    Thread-safe collector of the events and metrics of one stage of the pipeline.
+
+    Args:
+        stage (str): Name of the stage, added to every event and metric.
+        events_file (Path, optional): JSON lines file the events are appended to.
+        metrics_file (Path, optional): Prometheus textfile written by write_metrics.
+        profile_part (tuple, optional): (dataset_name, part_num) of a part to profile.
+        profile_dir (Path, optional): Directory of the profile dumps.
+    """
+
+    def __init__(
+        self,
+        stage,
+        events_file=None,
+        metrics_file=None,
+        profile_part=None,
+        profile_dir=None,
+    ):
+        self.stage = stage
+        self.events_file = Path(events_file) if events_file else None
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.profile_part = profile_part
+        self.profile_dir = Path(profile_dir) if profile_dir else Path.cwd()
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._started_at = time.time()
+
+    @classmethod
+    def from_env(cls, stage):
+        """Configure the outputs from the PIPELINE_* environment variables."""
+        metrics_dir = os.environ.get("PIPELINE_METRICS_DIR")
+        profile_part = os.environ.get("PIPELINE_PROFILE_PART")
+        if profile_part:
+            dataset_name, _, part_num = profile_part.rpartition(":")
+            profile_part = (dataset_name, int(part_num))
+        return cls(
+            stage,
+            events_file=os.environ.get("PIPELINE_EVENTS_FILE"),
+            metrics_file=(
+                Path(metrics_dir) / f"{METRIC_PREFIX}_{stage}.prom"
+                if metrics_dir
+                else None
+            ),
+            profile_part=profile_part,
+            profile_dir=os.environ.get("PIPELINE_PROFILE_DIR"),
+        )
+
+    def get_profile_file(self, dataset_name, part_num):
+        """Path of the profile dump of a part, or None if it is not profiled."""
+        if self.profile_part != (dataset_name, part_num):
+            return None
+        sanitized_name = dataset_name.replace("/", "_").replace(" ", "_")
+        return self.profile_dir / f"{sanitized_name}_part_{part_num:04d}.prof"
+
+    def event(self, event, **fields):
+        """Append a structured event to the events file."""
+        if self.events_file is None:
+            return
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "host": socket.gethostname(),
+            "stage": self.stage,
+            "event": event,
+            **fields,
+        }
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.events_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.events_file, "a") as f:
+                f.write(line + "\n")
+
+    def increment(self, name, value=1, **labels):
+        """Add value to a counter."""
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def set_max(self, name, value, **labels):
+        """Raise a gauge to value if it is higher."""
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges[key] = max(self._gauges.get(key, value), value)
+
+    def observe(self, name, value, buckets, **labels):
+        """Record a value in a histogram."""
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def record_part(self, dataset_name, part_num, part_metrics):
+        """
+        Record the metrics of a converted part, as returned by
+        scripts.convert_h5_to_parquet_chunks.convert_part.
+        """
+        seconds = part_metrics["seconds"]
+        self.event(
+            "part_converted",
+            dataset=dataset_name,
+            part_num=part_num,
+            **part_metrics,
+            rows_per_second=part_metrics["rows"] / seconds if seconds else None,
+            input_mb_per_second=(
+                part_metrics["input_bytes"] / 1024 / 1024 / seconds if seconds else None
+            ),
+        )
+        for phase, phase_seconds in part_metrics["phases"].items():
+            self.increment("phase_seconds_total", phase_seconds, phase=phase)
+        self.increment("parts_total", dataset=dataset_name)
+        self.increment("rows_total", part_metrics["rows"], dataset=dataset_name)
+        self.increment("input_bytes_total", part_metrics["input_bytes"])
+        self.increment("output_bytes_total", part_metrics["output_bytes"])
+        if part_metrics["peak_rss_bytes"] is not None:
+            self.set_max("part_peak_rss_bytes", part_metrics["peak_rss_bytes"])
+
+    def record_failure(self, error, **fields):
+        """Record an error, which the caller is expected to raise eventually."""
+        self.increment("failures_total")
+        self.event("failed", error=f"{type(error).__name__}: {error}", **fields)
+
+    def write_metrics(self):
+        """Atomically write the metrics as a Prometheus textfile."""
+        if self.metrics_file is None:
+            return
+        stage = (("stage", self.stage),)
+        lines = []
+        with self._lock:
+            for metrics, metric_type in (
+                (self._counters, "counter"),
+                (self._gauges, "gauge"),
+            ):
+                names = sorted({name for name, _ in metrics})
+                for name in names:
+                    lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+                    for (metric_name, labels), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(
+                                f"{METRIC_PREFIX}_{name}{_format_labels(stage + labels)}"
+                                f" {value}"
+                            )
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+                for (metric_name, labels), histogram in sorted(self._histograms.items()):
+                    if metric_name != name:
+                        continue
+                    labels = stage + labels
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(
+                            f"{METRIC_PREFIX}_{name}_bucket"
+                            f"{_format_labels(labels, le=bound)} {count}"
+                        )
+                    lines.append(
+                        f"{METRIC_PREFIX}_{name}_bucket"
+                        f"{_format_labels(labels, le='+Inf')} {histogram.count}"
+                    )
+                    lines.append(
+                        f"{METRIC_PREFIX}_{name}_sum{_format_labels(labels)}"
+                        f" {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{METRIC_PREFIX}_{name}_count{_format_labels(labels)}"
+                        f" {histogram.count}"
+                    )
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds{_format_labels(stage)}"
+            f" {self._started_at}"
+        )
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_duration_seconds gauge")
+        lines.append(
+            f"{METRIC_PREFIX}_last_run_duration_seconds{_format_labels(stage)}"
+            f" {time.time() - self._started_at}"
+        )
+
+        self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.metrics_file.with_name(f"{self.metrics_file.name}.tmp")
+        tmp_path.write_text("\n".join(lines) + "\n")
+        tmp_path.replace(self.metrics_file)
@@ -0,0 +1,197 @@
+"""
+This script converts the datasets of an HDF5 file into Parquet and streams them to S3
+in a single pipeline, without staging the Parquet files on local disk.
+
+A producer reads chunk-aligned HDF5 slices and encodes them into in-memory Parquet buffers, which
+are handed over to a pool of upload threads through a bounded queue. Conversion and
+network I/O overlap, and memory usage is capped by the size of the queue.
+
+Run with: python -m scripts.stream_h5_to_s3
+"""
+
+import queue
+import threading
+from fnmatch import fnmatch
+from pathlib import Path
+
+import h5py
+import pyarrow as pa
+
+from scripts.convert_h5_to_parquet_chunks import (
+    FLAT_LAYOUT,
+    HIVE_LAYOUT,
+    ROW_GROUP_SIZE,
+    estimate_chunk_size,
+    get_batch_rows,
+    plan_parts,
+    read_h5_datasets,
+    read_part_files,
+    write_parquet,
+)
+from scripts.instrumentation import Instrumentation, PhaseTimer
+from scripts.upload_parquet_chunks_to_s3 import (
+    S3_URI,
+    get_s3_client,
+    get_transfer_config,
+    parse_s3_uri,
+    upload_fileobj_to_s3,
+)
+
+# Constants
+INPUT_FILE = Path(__file__).parent.parent / "data" / "ES.h5"
+
+
+def _upload_worker(buffers, bucket, s3_client, transfer_config, failed, instrumentation):
+    """Upload the buffers taken from the queue until a None sentinel is received."""
+    while True:
+        item = buffers.get()
+        try:
+            if item is None:
+                return
+            s3_path, buffer = item
+            if upload_fileobj_to_s3(
+                pa.BufferReader(buffer),
+                bucket,
+                s3_path,
+                s3_client,
+                transfer_config,
+                instrumentation=instrumentation,
+            ):
+                instrumentation.increment("uploaded_bytes_total", buffer.size)
+                instrumentation.increment("uploaded_files_total")
+            else:
+                failed.set()
+        except Exception as e:
+            # Keep consuming the queue so that the producer never blocks forever,
+            # the error is raised by the producer once the workers are done
+            print(f"Error uploading to {bucket}: {type(e).__name__}: {e}")
+            instrumentation.record_failure(e, bucket=bucket)
+            failed.set()
+        finally:
+            buffers.task_done()
+
+
+def stream_h5_to_s3(
+    input_file: Path,
+    s3_uri,
+    target_file_size_mb=200,
+    layout=FLAT_LAYOUT,
+    typed=False,
+    row_group_size=ROW_GROUP_SIZE,
+    dataset_pattern="*filter0*",
+    max_queued_buffers=4,
+    num_upload_workers=4,
+    s3_client=None,
+    transfer_config=None,
+    instrumentation=None,
+):
+    """
+    Convert the datasets of an HDF5 file into Parquet and upload them to S3 without
+    writing to local disk.
+
+    The S3 keys mirror the paths convert_h5_to_parquet would write under its output
+    directory, in the given layout. With the flat layout, s3_uri should therefore
+    include the internal_id=.../data_provider=... directories expected by the
+    external table. typed and row_group_size select the typed conversion and the
+    row groups of convert_h5_to_parquet, whose files are about target_file_size_mb
+    once compressed.
+
+    At most max_queued_buffers encoded files wait in memory for an upload worker,
+    which bounds peak memory usage. The instrumentation records the time spent by
+    each part in each phase, including queue_wait, the time the producer is blocked
+    by a full queue, and the upload metrics. It is configured from the PIPELINE_*
+    environment variables by default (see scripts.instrumentation).
+
+    Returns the number of files uploaded. Raises a RuntimeError if any upload failed.
+    """
+    if not input_file.exists():
+        raise FileNotFoundError(f"Input file not found: {input_file}")
+
+    bucket, prefix = parse_s3_uri(s3_uri)
+    s3 = s3_client or get_s3_client()
+    transfer_config = transfer_config or get_transfer_config()
+    instrumentation = instrumentation or Instrumentation.from_env("stream")
+
+    buffers = queue.Queue(maxsize=max_queued_buffers)
+    failed = threading.Event()
+    workers = [
+        threading.Thread(
+            target=_upload_worker,
+            args=(buffers, bucket, s3, transfer_config, failed, instrumentation),
+            daemon=True,
+        )
+        for _ in range(num_upload_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    num_files = 0
+    try:
+        with h5py.File(input_file, "r") as h5file:
+            datasets = read_h5_datasets(h5file)
+            for name, dataset in datasets.items():
+                if not fnmatch(name, dataset_pattern):
+                    print(f"Skipping dataset {name}")
+                    continue
+
+                batch_rows = get_batch_rows(dataset, row_group_size)
+                chunk_size = estimate_chunk_size(
+                    dataset, target_file_size_mb, typed, batch_rows
+                )
+                parts = plan_parts(dataset.shape[0], chunk_size, align_rows=batch_rows)
+                for part_num, start, end in parts:
+                    if failed.is_set():
+                        raise RuntimeError("Aborting conversion after a failed upload")
+
+                    timer = PhaseTimer()
+                    output_bytes = 0
+                    for relative_path, tables in read_part_files(
+                        dataset,
+                        name,
+                        start,
+                        end,
+                        part_num,
+                        layout,
+                        typed,
+                        row_group_size,
+                        timer,
+                    ):
+                        sink = pa.BufferOutputStream()
+                        write_parquet(tables, sink, row_group_size, timer)
+                        buffer = sink.getvalue()
+                        s3_path = f"{prefix.rstrip('/')}/{relative_path.as_posix()}"
+                        # Blocks while the queue is full, until a worker frees a slot
+                        with timer.phase("queue_wait"):
+                            buffers.put((s3_path, buffer))
+                        output_bytes += buffer.size
+                        num_files += 1
+                    for phase, seconds in timer.phases.items():
+                        instrumentation.increment(
+                            "phase_seconds_total", seconds, phase=phase
+                        )
+                    instrumentation.increment("rows_total", end - start, dataset=name)
+                    instrumentation.event(
+                        "part_encoded",
+                        dataset=name,
+                        part_num=part_num,
+                        rows=end - start,
+                        output_bytes=output_bytes,
+                        phases=timer.phases,
+                    )
+                    print(f"Encoded rows {start} to {end} for dataset {name}")
+                print(f"Converted dataset {name} into {len(parts)} parts")
+    finally:
+        for _ in workers:
+            buffers.put(None)
+        for worker in workers:
+            worker.join()
+        instrumentation.write_metrics()
+
+    if failed.is_set():
+        raise RuntimeError(f"Some uploads to {s3_uri} failed")
+    print(f"Streamed {num_files} files to {s3_uri}")
+    return num_files
+
+
+if __name__ == "__main__":
+    stream_h5_to_s3(INPUT_FILE, S3_URI, layout=HIVE_LAYOUT)
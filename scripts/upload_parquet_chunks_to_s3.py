@@ -1,37 +1,220 @@
+"""
+This script uploads the Parquet files written by convert_h5_to_parquet_chunks to the S3
+bucket read by the Snowflake external stage.
+
+Run with: python -m scripts.upload_parquet_chunks_to_s3
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
 from urllib.parse import urlparse
 
 import boto3
-from botocore.exceptions import NoCredentialsError
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+
+from scripts.instrumentation import ATTEMPT_BUCKETS, LATENCY_BUCKETS, Instrumentation
 
 # Constants
 LOCAL_DIRECTORY = Path(__file__).parent / "data" / "converted"
-S3_URI = "s3://dev.data-staging.eu-west-1/timeseries/internal_id=ES_INDEX_FUTURES"
+# Location of the external stage, the internal_id=.../data_provider=.../ partitions
+# being the relative paths of the hive-partitioned files
+S3_URI = "s3://dev.data-staging.eu-west-1/timeseries/equity_index_future"
+MANIFEST_FILE_NAME = ".upload_manifest.json"
+
+# Upload tuning
+MAX_WORKERS = 8
+MULTIPART_CHUNKSIZE_MB = 64
+MAX_CONCURRENCY_PER_FILE = 4
+MAX_ATTEMPTS = 3
+
+# The manifest is saved every so many uploaded files or seconds, and at the end
+MANIFEST_SAVE_EVERY_FILES = 100
+MANIFEST_SAVE_EVERY_SECONDS = 30
+
+
+def get_s3_client(max_pool_connections=MAX_WORKERS * MAX_CONCURRENCY_PER_FILE):
+    """
+    Create an S3 client to be shared by all upload threads.
+
+    Args:
+        max_pool_connections (int): Size of the client's HTTP connection pool, which
+            should cover the number of files uploaded in parallel times the number
+            of concurrent parts per file.
+
+    Returns:
+        botocore.client.S3: The S3 client. The endpoint can be overridden with the
+            AWS_ENDPOINT_URL environment variable, e.g. to target a local S3 stand-in.
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=os.environ.get("AWS_ENDPOINT_URL"),
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 10, "mode": "adaptive"},
+        ),
+    )
+
+
+def get_transfer_config(
+    multipart_chunksize_mb=MULTIPART_CHUNKSIZE_MB,
+    max_concurrency=MAX_CONCURRENCY_PER_FILE,
+):
+    """
+    Build the multipart transfer settings used for each file.
+
+    Args:
+        multipart_chunksize_mb (int): Size of each multipart part, also used as the
+            threshold above which files are uploaded in parts.
+        max_concurrency (int): Number of parts of a single file uploaded in parallel.
+
+    Returns:
+        TransferConfig: The boto3 transfer configuration.
+    """
+    chunksize = multipart_chunksize_mb * 1024 * 1024
+    return TransferConfig(
+        multipart_threshold=chunksize,
+        multipart_chunksize=chunksize,
+        max_concurrency=max_concurrency,
+        use_threads=True,
+    )
+
+
+def _upload_with_retries(
+    upload, source, bucket, s3_file, max_attempts, instrumentation=None
+):
+    """
+    Call an upload function, retrying transient failures with exponential backoff.
+
+    Args:
+        upload (callable): Function performing a single upload attempt.
+        source (str): Description of what is uploaded, used in the messages.
+        bucket (str): Name of the S3 bucket.
+        s3_file (str): S3 key (path) where the data will be stored.
+        max_attempts (int): Number of attempts before giving up.
+        instrumentation (Instrumentation, optional): Records the latency of the
+            successful attempt, the number of attempts and the failures.
+
+    Returns:
+        bool: True if upload was successful, False otherwise.
+    """
+    instrumentation = instrumentation or Instrumentation("upload")
+    destination = f"s3://{bucket}/{s3_file}"
+    for attempt in range(1, max_attempts + 1):
+        attempt_start = time.perf_counter()
+        try:
+            upload()
+        except (FileNotFoundError, NoCredentialsError) as e:
+            # Not transient, so not retried
+            print(f"Upload failed: {source} ({type(e).__name__}: {e})")
+            instrumentation.record_failure(
+                e, source=source, destination=destination, attempts=attempt
+            )
+            instrumentation.observe("upload_attempts", attempt, ATTEMPT_BUCKETS)
+            return False
+        except (BotoCoreError, ClientError, S3UploadFailedError) as e:
+            if attempt == max_attempts:
+                print(f"Upload failed after {attempt} attempts: {source} ({e})")
+                instrumentation.record_failure(
+                    e, source=source, destination=destination, attempts=attempt
+                )
+                instrumentation.observe("upload_attempts", attempt, ATTEMPT_BUCKETS)
+                return False
+            print(f"Upload attempt {attempt} failed for {source}, retrying: {e}")
+            instrumentation.increment("upload_retries_total")
+            time.sleep(2**attempt)
+        else:
+            latency = time.perf_counter() - attempt_start
+            print(f"Upload Successful: {source} -> {destination}")
+            instrumentation.observe("upload_latency_seconds", latency, LATENCY_BUCKETS)
+            instrumentation.observe("upload_attempts", attempt, ATTEMPT_BUCKETS)
+            instrumentation.event(
+                "uploaded",
+                source=source,
+                destination=destination,
+                attempts=attempt,
+                seconds=latency,
+            )
+            return True
 
 
-def upload_to_s3(local_file, bucket, s3_file):
+def upload_to_s3(
+    local_file,
+    bucket,
+    s3_file,
+    s3_client=None,
+    transfer_config=None,
+    max_attempts=MAX_ATTEMPTS,
+    instrumentation=None,
+):
     """
-    Upload a local file to an S3 bucket.
+    Upload a local file to an S3 bucket, retrying transient failures.
 
     Args:
         local_file (str or Path): Path to the local file to be uploaded.
         bucket (str): Name of the S3 bucket.
         s3_file (str): S3 key (path) where the file will be stored.
+        s3_client (botocore.client.S3, optional): Shared client, created if not given.
+        transfer_config (TransferConfig, optional): Multipart transfer settings.
+        max_attempts (int): Number of attempts before giving up on the file.
+        instrumentation (Instrumentation, optional): Records the upload metrics.
 
     Returns:
         bool: True if upload was successful, False otherwise.
     """
-    s3 = boto3.client("s3")
-    try:
-        s3.upload_file(str(local_file), bucket, s3_file)
-        print(f"Upload Successful: {local_file} -> s3://{bucket}/{s3_file}")
-        return True
-    except FileNotFoundError:
-        print(f"The file {local_file} was not found")
-        return False
-    except NoCredentialsError:
-        print("Credentials not available")
-        return False
+    s3 = s3_client or get_s3_client()
+    return _upload_with_retries(
+        lambda: s3.upload_file(str(local_file), bucket, s3_file, Config=transfer_config),
+        local_file,
+        bucket,
+        s3_file,
+        max_attempts,
+        instrumentation,
+    )
+
+
+def upload_fileobj_to_s3(
+    fileobj,
+    bucket,
+    s3_file,
+    s3_client=None,
+    transfer_config=None,
+    max_attempts=MAX_ATTEMPTS,
+    instrumentation=None,
+):
+    """
+    Upload an in-memory, seekable file object to an S3 bucket, retrying transient
+    failures.
+
+    Args:
+        fileobj (file-like): Binary file object, rewound before every attempt.
+        bucket (str): Name of the S3 bucket.
+        s3_file (str): S3 key (path) where the data will be stored.
+        s3_client (botocore.client.S3, optional): Shared client, created if not given.
+        transfer_config (TransferConfig, optional): Multipart transfer settings.
+        max_attempts (int): Number of attempts before giving up.
+        instrumentation (Instrumentation, optional): Records the upload metrics.
+
+    Returns:
+        bool: True if upload was successful, False otherwise.
+    """
+    s3 = s3_client or get_s3_client()
+
+    def upload():
+        fileobj.seek(0)
+        s3.upload_fileobj(fileobj, bucket, s3_file, Config=transfer_config)
+
+    return _upload_with_retries(
+        upload, "<in-memory buffer>", bucket, s3_file, max_attempts, instrumentation
+    )
 
 
 def parse_s3_uri(uri):
@@ -48,18 +231,216 @@ def parse_s3_uri(uri):
     return parsed.netloc, parsed.path.lstrip("/")
 
 
+def file_checksum(local_file, block_size=8 * 1024 * 1024):
+    """
+    Compute the MD5 checksum of a file, reading it in blocks.
+
+    Args:
+        local_file (str or Path): Path to the file.
+        block_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: The hexadecimal MD5 digest.
+    """
+    md5 = hashlib.md5()
+    with open(local_file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Load the manifest of files already uploaded.
+
+    Args:
+        manifest_path (Path): Path to the JSON manifest.
+
+    Returns:
+        dict: Mapping of "s3://bucket/key" to the size, mtime and checksum of the
+            local file it was uploaded from. Empty if the manifest does not exist.
+    """
+    if not manifest_path.exists():
+        return {}
+    return json.loads(manifest_path.read_text())
+
+
+def save_manifest(manifest_path, manifest):
+    """
+    Atomically write the manifest, so an interrupted run never leaves it corrupted.
+
+    Args:
+        manifest_path (Path): Path to the JSON manifest.
+        manifest (dict): The manifest entries.
+    """
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp_path.replace(manifest_path)
+
+
+def is_uploaded(manifest, s3_uri, local_file):
+    """
+    Check whether a local file matches the manifest entry of its S3 destination.
+
+    The checksum is only recomputed when the size matches but the file was modified
+    since it was uploaded.
+
+    Args:
+        manifest (dict): The manifest entries.
+        s3_uri (str): Destination of the file, "s3://bucket/key".
+        local_file (Path): Path to the local file.
+
+    Returns:
+        bool: True if the same content was already uploaded to that destination.
+    """
+    entry = manifest.get(s3_uri)
+    if entry is None:
+        return False
+    stat = local_file.stat()
+    if entry["size"] != stat.st_size:
+        return False
+    if entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    return entry["md5"] == file_checksum(local_file)
+
+
+def upload_directory(
+    local_directory,
+    bucket,
+    prefix,
+    pattern="*filter0*.parquet",
+    max_workers=MAX_WORKERS,
+    manifest_path=None,
+    s3_client=None,
+    transfer_config=None,
+    instrumentation=None,
+    manifest_save_every_files=MANIFEST_SAVE_EVERY_FILES,
+    manifest_save_every_seconds=MANIFEST_SAVE_EVERY_SECONDS,
+):
+    """
+    Concurrently upload the files of a directory to S3, skipping those already
+    recorded in the upload manifest.
+
+    Files are matched recursively, and their path relative to local_directory is
+    kept in the S3 key, so hive-partitioned output is uploaded as-is. The manifest
+    is saved every manifest_save_every_files uploads or manifest_save_every_seconds,
+    and when the run ends, even on failure, so a rerun only sends the files that are
+    missing, and at most the last batch again if the process was killed.
+
+    Args:
+        local_directory (Path): Directory containing the files to upload.
+        bucket (str): Name of the S3 bucket.
+        prefix (str): S3 key prefix under which the files are stored.
+        pattern (str): Glob pattern of the files to upload.
+        max_workers (int): Number of files uploaded in parallel.
+        manifest_path (Path, optional): Path to the JSON manifest, defaults to
+            MANIFEST_FILE_NAME in local_directory.
+        s3_client (botocore.client.S3, optional): Shared client, created if not given.
+        transfer_config (TransferConfig, optional): Multipart transfer settings.
+        instrumentation (Instrumentation, optional): Records the upload metrics,
+            configured from the PIPELINE_* environment variables by default.
+        manifest_save_every_files (int): Number of uploads between manifest saves.
+        manifest_save_every_seconds (float): Seconds between manifest saves.
+
+    Returns:
+        tuple: The number of files uploaded, skipped and failed.
+    """
+    instrumentation = instrumentation or Instrumentation.from_env("upload")
+    manifest_path = manifest_path or local_directory / MANIFEST_FILE_NAME
+    s3 = s3_client or get_s3_client()
+    transfer_config = transfer_config or get_transfer_config()
+    manifest = load_manifest(manifest_path)
+    manifest_lock = threading.Lock()
+    # Uploads recorded in the manifest since it was last saved, and when it was
+    unsaved = {"files": 0, "saved_at": time.monotonic()}
+
+    def save_unsaved_manifest():
+        # Called with manifest_lock held
+        if unsaved["files"]:
+            save_manifest(manifest_path, manifest)
+            unsaved.update(files=0, saved_at=time.monotonic())
+
+    pending = {}
+    skipped = 0
+    for file_path in sorted(local_directory.rglob(pattern)):
+        relative_path = file_path.relative_to(local_directory).as_posix()
+        s3_path = f"{prefix.rstrip('/')}/{relative_path}" if prefix else relative_path
+        if is_uploaded(manifest, f"s3://{bucket}/{s3_path}", file_path):
+            skipped += 1
+        else:
+            pending[s3_path] = file_path
+    print(f"Uploading {len(pending)} files ({skipped} already uploaded) to {bucket}")
+
+    def upload(s3_path, file_path):
+        # Record the state of the file before uploading, so that a modification
+        # during the upload invalidates the manifest entry
+        stat = file_path.stat()
+        checksum = file_checksum(file_path)
+        if not upload_to_s3(
+            file_path,
+            bucket,
+            s3_path,
+            s3,
+            transfer_config,
+            instrumentation=instrumentation,
+        ):
+            return False
+        instrumentation.increment("uploaded_bytes_total", stat.st_size)
+        instrumentation.increment("uploaded_files_total")
+        with manifest_lock:
+            manifest[f"s3://{bucket}/{s3_path}"] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "md5": checksum,
+                "uploaded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            unsaved["files"] += 1
+            if (
+                unsaved["files"] >= manifest_save_every_files
+                or time.monotonic() - unsaved["saved_at"] >= manifest_save_every_seconds
+            ):
+                save_unsaved_manifest()
+        return True
+
+    uploaded = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(upload, s3_path, file_path)
+                for s3_path, file_path in pending.items()
+            ]
+            for future in as_completed(futures):
+                if future.result():
+                    uploaded += 1
+                else:
+                    failed += 1
+    finally:
+        with manifest_lock:
+            save_unsaved_manifest()
+        instrumentation.increment("skipped_files_total", skipped)
+        instrumentation.event(
+            "upload_completed", uploaded=uploaded, skipped=skipped, failed=failed
+        )
+        instrumentation.write_metrics()
+
+    print(f"Uploaded {uploaded} files, skipped {skipped}, failed {failed}")
+    return uploaded, skipped, failed
+
+
 def main():
     """
     Main function to upload Parquet files to S3.
 
     Uploads all files matching the pattern '*filter0*.parquet' from the
-    LOCAL_DIRECTORY to the S3 bucket specified in S3_URI.
+    LOCAL_DIRECTORY to the S3 bucket specified in S3_URI, and fails if any file
+    could not be uploaded. The internal_id=... partition directories of the
+    hive-partitioned files are kept in their keys, under the same prefix as
+    stream_h5_to_s3.
     """
     bucket, prefix = parse_s3_uri(S3_URI)
-
-    for file_path in LOCAL_DIRECTORY.glob("*filter0*.parquet"):
-        s3_path = f"{prefix}{file_path.name}"
-        upload_to_s3(file_path, bucket, s3_path)
+    _, _, failed = upload_directory(LOCAL_DIRECTORY, bucket, prefix)
+    if failed:
+        raise RuntimeError(f"Failed to upload {failed} files, rerun to retry them")
 
 
 if __name__ == "__main__":
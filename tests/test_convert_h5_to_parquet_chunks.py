@@ -0,0 +1,75 @@
+"""Incremental conversions of scripts/convert_h5_to_parquet_chunks.py."""
+
+import h5py
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+import scripts.convert_h5_to_parquet_chunks as converter
+from benchmarks.generate_es_ticks import TICK_DTYPE
+
+NUM_ROWS = 1000
+
+
+def write_h5(input_file, datasets):
+    """Write structured tick datasets, given as {name: number of rows}."""
+    with h5py.File(input_file, "w") as h5file:
+        for name, num_rows in datasets.items():
+            rows = np.zeros(num_rows, dtype=TICK_DTYPE)
+            rows["Instrument"] = b"ESZ03"
+            rows["Time"] = b"20031110093000000"
+            rows["Price"] = 1000.0 + np.arange(num_rows)
+            rows["Volume"] = 1
+            h5file.create_dataset(name, data=rows, maxshape=(None,), chunks=True)
+
+
+def converted_rows(output_dir, dataset_name):
+    sanitized_name = dataset_name.replace("/", "_")
+    paths = output_dir.glob(f"{sanitized_name}_part_*.parquet")
+    return sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+
+
+def test_rerun_with_empty_dataset(tmp_path):
+    input_file = tmp_path / "ES.h5"
+    write_h5(input_file, {"tick/trades": NUM_ROWS, "tick/empty": 0})
+
+    converter.convert_h5_to_parquet(input_file, target_file_size_mb=1)
+    # The entry of the empty dataset must not break the next incremental run
+    converter.convert_h5_to_parquet(input_file, target_file_size_mb=1)
+
+    assert converted_rows(tmp_path / "ES", "tick/trades") == NUM_ROWS
+    assert converted_rows(tmp_path / "ES", "tick/empty") == 0
+
+
+def test_rerun_after_first_part_failed(tmp_path, monkeypatch):
+    input_file = tmp_path / "ES.h5"
+    write_h5(input_file, {"tick/trades": NUM_ROWS, "tick/failing": NUM_ROWS})
+    convert_part = converter.convert_part
+
+    def failing_convert_part(dataset, dataset_name, *args, **kwargs):
+        if dataset_name == "tick/failing":
+            raise OSError("Simulated failure")
+        return convert_part(dataset, dataset_name, *args, **kwargs)
+
+    monkeypatch.setattr(converter, "convert_part", failing_convert_part)
+    with pytest.raises(RuntimeError, match="tick/failing"):
+        converter.convert_h5_to_parquet(input_file, target_file_size_mb=1)
+
+    # The failed dataset is converted by the next run, the other one is up to date
+    monkeypatch.setattr(converter, "convert_part", convert_part)
+    converter.convert_h5_to_parquet(input_file, target_file_size_mb=1)
+
+    assert converted_rows(tmp_path / "ES", "tick/trades") == NUM_ROWS
+    assert converted_rows(tmp_path / "ES", "tick/failing") == NUM_ROWS
+
+
+def test_entry_without_fingerprint_is_reconverted(tmp_path):
+    input_file = tmp_path / "ES.h5"
+    write_h5(input_file, {"tick/trades": NUM_ROWS})
+    entry = {"layout": converter.FLAT_LAYOUT, "converted_rows": [], "parts": []}
+
+    with h5py.File(input_file, "r") as h5file:
+        converted_end = converter.get_converted_end(
+            entry, h5file["tick/trades"], converter.FLAT_LAYOUT, False, tmp_path
+        )
+    assert converted_end == 0